@@ -0,0 +1,100 @@
+"""
+Compare the ingestion of plain text logs with the same logs compressed with gzip, bz2 and xz: the bytes
+read from disk, the time to parse one log, and the time to parse a whole batch of logs in the worker
+processes of ingest_logs, where each log is decompressed by the worker parsing it.
+
+    python -m benchmarks.compressed_logs --logs 16 --size 10MB --workers 4
+    python -m benchmarks.compressed_logs --formats gzip,xz --level 6
+
+The frags parsed from every compressed log are checked against the ones of its plain text log,
+the exit status is 1 when they differ.
+"""
+import argparse
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.log_generator import generate_logs, parse_size
+from farcry_data_science import ingest_logs, parse_log_file
+
+# Format: (extension, function opening a file to write it compressed at a level)
+FORMATS = {
+    'plain': ('', None),
+    'gzip': ('.gz', lambda pathname, level: gzip.open(pathname, 'wb', compresslevel=level)),
+    'bz2': ('.bz2', lambda pathname, level: bz2.open(pathname, 'wb', compresslevel=level)),
+    'xz': ('.xz', lambda pathname, level: lzma.open(pathname, 'wb', preset=level)),
+}
+
+
+def write_format(log_file_pathname, format_name, level):
+    """
+    :return: pathname of the log written in the format, the plain log itself for 'plain'
+    """
+    extension, open_compressed = FORMATS[format_name]
+    if open_compressed is None:
+        return log_file_pathname
+    with open(log_file_pathname, 'rb') as log_file, open_compressed(log_file_pathname + extension, level) as output:
+        shutil.copyfileobj(log_file, output, 1 << 20)
+    return log_file_pathname + extension
+
+
+def run_format(pathnames, workers):
+    """
+    :param pathnames: log files of the format
+    :return: a tuple (bytes on disk, seconds to parse the first log, seconds to parse all of them in
+             ingest_logs, list of the frag counts of the logs, frags of the first log)
+    """
+    byte_count = sum(os.path.getsize(pathname) for pathname in pathnames)
+    start = time.perf_counter()
+    frags = parse_log_file(pathnames[0])['frags']
+    single_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = ingest_logs(pathnames, workers=workers, report=lambda line: None)
+    batch_seconds = time.perf_counter() - start
+    frag_counts = {result['log_file_pathname']: result['frags'] for result in results}
+    return byte_count, single_seconds, batch_seconds, [frag_counts[pathname] for pathname in pathnames], frags
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logs', type=int, default=8, help='number of logs of the batch')
+    parser.add_argument('--size', default='4MB', help='size of each plain text log: 4MB, 100MB...')
+    parser.add_argument('--players', type=int, default=8, help='number of players of each match')
+    parser.add_argument('--workers', type=int, default=None, help='number of parsing processes (default: all cores)')
+    parser.add_argument('--formats', default='plain,gzip,bz2,xz', help='formats to compare')
+    parser.add_argument('--level', type=int, default=6, help='compression level of the codecs')
+    args = parser.parse_args(argv)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        plain_pathnames = generate_logs(directory, args.logs, args.players, parse_size(args.size))
+        plain_byte_count = sum(os.path.getsize(pathname) for pathname in plain_pathnames)
+
+        print('%-6s %10s %7s %10s %10s %12s' % ('format', 'disk MB', 'ratio', 'one log s', 'batch s', 'batch MB/s'))
+        reference = None
+        for format_name in args.formats.split(','):
+            pathnames = [write_format(pathname, format_name, args.level) for pathname in plain_pathnames]
+            byte_count, single_seconds, batch_seconds, frag_counts, frags = run_format(pathnames, args.workers)
+            # Throughput in bytes of text, whatever the format they are stored in
+            print('%-6s %10.1f %7.2f %10.3f %10.3f %12.1f' % (
+                format_name, byte_count / 1e6, plain_byte_count / byte_count, single_seconds, batch_seconds,
+                plain_byte_count / 1e6 / batch_seconds))
+            if reference is None:
+                reference = frag_counts, frags
+            elif (frag_counts, frags) != reference:
+                print('%s: the frags differ from the ones of the first format' % format_name)
+                failed = True
+            if format_name != 'plain':
+                for pathname in pathnames:
+                    os.remove(pathname)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+Load test of ingestion_server.py: many game servers stream the lines of their log at the same time,
+while others upload whole log files. The latency of every request and the throughput of the service
+are reported.
+
+    python -m benchmarks.ingestion_load_test --servers 50 --uploads 10 --size 1MB --chunk-lines 200
+    python -m benchmarks.ingestion_load_test --url 127.0.0.1:8080 --servers 20 --interval 0.5
+
+Without --url, a service is started on a temporary SQLite database, and the frags it committed are
+compared with the frags written by benchmarks.log_generator. The exit status is 1 when a request
+fails or when frags are missing.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.log_generator import generate_log, parse_size
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class HttpClient:
+    """
+    Keep-alive HTTP/1.1 connection to the service, see ingestion_server.write_response
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def request(self, method, path, body=b''):
+        """
+        :return: a tuple (HTTP status, JSON payload) of the response
+        """
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        self._writer.write(('%s %s HTTP/1.1\r\nHost: %s\r\nContent-Length: %d\r\n\r\n'
+                            % (method, path, self.host, len(body))).encode('latin-1') + body)
+        await self._writer.drain()
+
+        status = int((await self._reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self._reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        payload = json.loads(await self._reader.readexactly(int(headers['content-length'])))
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, payload
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def iter_chunks(data, chunk_lines):
+    """
+    :return: a generator of the chunks of chunk_lines lines of data, the last one may end in the middle of a line
+    """
+    start = 0
+    while start < len(data):
+        end = start
+        for _ in range(chunk_lines):
+            end = data.find(b'\n', end) + 1
+            if not end:
+                end = len(data)
+                break
+        yield data[start:end]
+        start = end
+
+
+async def timed_request(client, latencies, kind, method, path, body=b''):
+    start = time.perf_counter()
+    status, payload = await client.request(method, path, body)
+    latencies.setdefault(kind, []).append(time.perf_counter() - start)
+    if status >= 400:
+        raise RuntimeError('%s %s: %d %s' % (method, path, status, payload.get('error')))
+    return payload
+
+
+async def stream_log(host, port, server_id, log_file_pathname, chunk_lines, interval, latencies):
+    """
+    Stream a log as a game server writing it would, then end its match
+    :return: number of frags found by the service
+    """
+    client = HttpClient(host, port)
+    try:
+        with open(log_file_pathname, 'rb') as log_file:
+            data = log_file.read()
+        for chunk in iter_chunks(data, chunk_lines):
+            await timed_request(client, latencies, 'stream chunk', 'POST', '/streams/%s' % server_id, chunk)
+            if interval:
+                await asyncio.sleep(interval)
+        payload = await timed_request(client, latencies, 'stream end', 'DELETE', '/streams/%s' % server_id)
+        return payload['frags']
+    finally:
+        client.close()
+
+
+async def upload_log(host, port, log_file_pathname, latencies):
+    """
+    :return: number of frags found by the service
+    """
+    client = HttpClient(host, port)
+    try:
+        with open(log_file_pathname, 'rb') as log_file:
+            payload = await timed_request(client, latencies, 'upload', 'POST', '/logs', log_file.read())
+        return payload['frags']
+    finally:
+        client.close()
+
+
+async def run_load(host, port, stream_pathnames, upload_pathnames, chunk_lines, interval):
+    """
+    :return: a tuple (frags found for each log, in the order of stream_pathnames + upload_pathnames,
+             {kind of request: [latency in seconds, ...]}, elapsed seconds, list of the errors)
+    """
+    latencies = {}
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[stream_log(host, port, 'load-test-%d' % index, log_file_pathname, chunk_lines, interval, latencies)
+          for index, log_file_pathname in enumerate(stream_pathnames)],
+        *[upload_log(host, port, log_file_pathname, latencies) for log_file_pathname in upload_pathnames],
+        return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    errors = [result for result in results if isinstance(result, Exception)]
+    return results, latencies, elapsed, errors
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def print_report(latencies, elapsed, frag_count, byte_count):
+    print('%-14s %8s %10s %10s %10s %10s' % ('request', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for kind, values in sorted(latencies.items()):
+        print('%-14s %8d %10.1f %10.1f %10.1f %10.1f' % (
+            kind, len(values), percentile(values, 0.5) * 1000, percentile(values, 0.95) * 1000,
+            percentile(values, 0.99) * 1000, max(values) * 1000))
+    request_count = sum(len(values) for values in latencies.values())
+    print('%d requests, %d frags, %.1f MB in %.2fs: %.0f requests/s, %.0f frags/s, %.2f MB/s' % (
+        request_count, frag_count, byte_count / 1e6, elapsed, request_count / elapsed, frag_count / elapsed,
+        byte_count / 1e6 / elapsed))
+
+
+def start_server(sqlite_pathname, workers, extra_arguments=()):
+    """
+    :return: a tuple (process of the service, port it listens on)
+    """
+    command = [sys.executable, os.path.join(ROOT_DIRECTORY, 'ingestion_server.py'), '--sqlite', sqlite_pathname,
+               '--port', '0'] + (['--workers', str(workers)] if workers else []) + list(extra_arguments)
+    process = subprocess.Popen(command, cwd=ROOT_DIRECTORY, stdout=subprocess.PIPE, universal_newlines=True)
+    line = process.stdout.readline()
+    if not line.startswith('Listening on'):
+        process.kill()
+        raise RuntimeError('The service did not start: %r' % line)
+    return process, int(line.rsplit(':', 1)[1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='host:port of a running service, one is started if missing')
+    parser.add_argument('--servers', type=int, default=20, help='number of game servers streaming their log')
+    parser.add_argument('--uploads', type=int, default=5, help='number of log files uploaded')
+    parser.add_argument('--size', default='256KB', help='size of each log: 256KB, 10MB...')
+    parser.add_argument('--players', type=int, default=8, help='number of players of each match')
+    parser.add_argument('--chunk-lines', type=int, default=100, help='number of lines sent in each stream request')
+    parser.add_argument('--interval', type=float, default=0.0, help='seconds between two requests of a stream')
+    parser.add_argument('--workers', type=int, default=None, help='number of parsing processes of the service')
+    parser.add_argument('--max-pending', type=int, default=None, help='size of the write queue of the service')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        descriptions = []
+        pathnames = []
+        for index in range(args.servers + args.uploads):
+            log_file_pathname = os.path.join(directory, 'log%03d.txt' % index)
+            # Every match starts at another time, or the service would take them for the same match
+            descriptions.append(generate_log(log_file_pathname, args.players, size=parse_size(args.size), seed=index,
+                                             start_time=datetime(2019, 3, 1, 16, 0, 0) + timedelta(hours=index)))
+            pathnames.append(log_file_pathname)
+        byte_count = sum(description['size'] for description in descriptions)
+        expected_frag_count = sum(description['frag_count'] for description in descriptions)
+
+        process = None
+        sqlite_pathname = os.path.join(directory, 'farcry.db')
+        if args.url:
+            host, port = args.url.rsplit(':', 1)
+            port = int(port)
+        else:
+            host = '127.0.0.1'
+            process, port = start_server(sqlite_pathname, args.workers,
+                                         ['--max-pending', str(args.max_pending)] if args.max_pending else [])
+        try:
+            results, latencies, elapsed, errors = asyncio.run(run_load(
+                host, port, pathnames[:args.servers], pathnames[args.servers:], args.chunk_lines, args.interval))
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+        print_report(latencies, elapsed, expected_frag_count, byte_count)
+        for error in errors:
+            print('ERROR %r' % error)
+        failed = bool(errors)
+        for log_file_pathname, description, frag_count in zip(pathnames, descriptions, results):
+            if not isinstance(frag_count, Exception) and frag_count != description['frag_count']:
+                print('%s: %d frags parsed, %d generated' % (log_file_pathname, frag_count, description['frag_count']))
+                failed = True
+        if process is not None:
+            connection = sqlite3.connect(sqlite_pathname)
+            committed_frag_count = connection.execute('SELECT COUNT(*) FROM match_frag').fetchone()[0]
+            connection.close()
+            if committed_frag_count != expected_frag_count:
+                print('%d frags committed, %d generated' % (committed_frag_count, expected_frag_count))
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
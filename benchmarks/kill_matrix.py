@@ -0,0 +1,87 @@
+"""
+Compare the favorite victim and worst enemy queries (sql_queries/WP50.sql and WP51.sql) with the
+answers of a KillMatrix built from the same frags, and time the other answers of the matrix.
+
+Synthetic logs of benchmarks.log_generator are ingested into a temporary SQLite database:
+    python -m benchmarks.kill_matrix --logs 40 --size 4MB --players 16 --repeat 20
+
+The exit status is 1 when the matrix and the queries disagree. Players tied for the first place
+may be picked differently by the queries, only their kill counts have to be the same.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+
+from benchmarks.log_generator import generate_logs, parse_size
+from benchmarks.suite import best_time
+from farcry_data_science import ingest_logs
+from kill_matrix import load_kill_matrix
+from utilities.query_cache import load_query
+
+
+def compare_rows(kill_matrix, query_rows, matrix_rows, transpose):
+    """
+    :param query_rows: rows (match_id, player_name, other_player_name, kill_count) of the query
+    :param matrix_rows: rows of favorite_victims or worst_enemies
+    :param transpose: True if other_player_name is the killer, as in WP51
+    :return: list of the rows of the query the matrix disagrees with
+    """
+    matrix_rows = {row[1]: row for row in matrix_rows}
+    differences = []
+    for row in query_rows:
+        match_id, player_name, other_player_name, kill_count = row
+        killer_name, victim_name = (other_player_name, player_name) if transpose else (player_name, other_player_name)
+        matrix_row = matrix_rows.pop(player_name, None)
+        if matrix_row is None or matrix_row[3] != kill_count or \
+                kill_matrix.head_to_head(killer_name, victim_name, match_id)[0] != kill_count:
+            differences.append(row)
+    return differences + list(matrix_rows.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logs', type=int, default=20, help='number of matches')
+    parser.add_argument('--size', default='2MB', help='size of each log: 2MB, 10MB...')
+    parser.add_argument('--players', type=int, default=16, help='number of players of each match')
+    parser.add_argument('--repeat', type=int, default=10, help='number of times each answer is timed')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        pathnames = generate_logs(directory, args.logs, args.players, parse_size(args.size))
+        sqlite_pathname = os.path.join(directory, 'farcry.db')
+        ingest_logs(pathnames, sqlite_pathname, report=lambda line: None)
+
+        connection = sqlite3.connect(sqlite_pathname)
+        frag_count = connection.execute('SELECT COUNT(*) FROM match_frag').fetchone()[0]
+        kill_matrix, build_seconds = best_time(lambda: load_kill_matrix(connection), 1)
+        player_name = kill_matrix.names[0]
+        opponent_name = kill_matrix.names[1]
+        print('%d frags, %d kills, %d players, matrix built in %.3fs' % (
+            frag_count, kill_matrix.kill_count, len(kill_matrix.names), build_seconds))
+
+        failed = False
+        print('%-22s %12s %12s' % ('answer', 'query ms', 'matrix ms'))
+        for query_file_name, answer, transpose in (('WP50.sql', kill_matrix.favorite_victims, False),
+                                                   ('WP51.sql', kill_matrix.worst_enemies, True)):
+            query = load_query(query_file_name)
+            query_rows, query_seconds = best_time(lambda: connection.execute(query).fetchall(), args.repeat)
+            matrix_rows, matrix_seconds = best_time(answer, args.repeat)
+            print('%-22s %12.3f %12.3f' % (query_file_name, query_seconds * 1000, matrix_seconds * 1000))
+            for row in compare_rows(kill_matrix, query_rows, matrix_rows, transpose):
+                print('%s: different row %s' % (query_file_name, row))
+                failed = True
+
+        for name, answer in (('top_victims(k=5)', lambda: kill_matrix.top_victims(player_name, 5)),
+                             ('top_enemies(k=5)', lambda: kill_matrix.top_enemies(player_name, 5)),
+                             ('head_to_head', lambda: kill_matrix.head_to_head(player_name, opponent_name)),
+                             ('weapon_breakdown', lambda: kill_matrix.weapon_breakdown(player_name))):
+            _, matrix_seconds = best_time(answer, args.repeat)
+            print('%-22s %12s %12.3f' % (name, '', matrix_seconds * 1000))
+        connection.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""
+Generate synthetic Far Cry server logs, from a few kilobytes to gigabytes, with the lines the parser
+of farcry_data_science reads: 'Log Started at', '(g_timezone,...)', 'Loading level Levels/..., mission ...',
+'Precaching level ... done', '<MM:SS> <Lua> X killed Y with W' and '== Statistics'.
+
+    python -m benchmarks.log_generator /tmp/big.txt --size 1GB --players 32 --minutes 50
+"""
+import argparse
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+PLAYER_NAMES = ('cyap', 'papazark', 'lamonthe', 'theprophete', 'cynthia', 'Jack The Ripper', 'BlackStar',
+                'Ahmed', 'Killer', 'Rambo', 'Hitman', 'Ghost')
+
+WEAPON_CODES = ('AG36', 'AG36Grenade', 'Boat', 'Env', 'Falcon', 'HandGrenade', 'M249', 'M4', 'Machete', 'MG',
+                'MP5', 'OICW', 'OICWGrenade', 'P90', 'Rocket', 'Shotgun', 'SniperRifle', 'VehicleMountedRocketMG',
+                'VehicleRocket')
+
+MAPS = (('mp_surf', 'FFA'), ('mp_airstrip', 'ASSAULT'), ('mp_beach', 'TDM'))
+
+# Lines of the real logs written between the frags, which the parser has to skip
+NOISE_LINES = ('CPhysicalEntity:SetParams(pe_params_pos): ({0} @ 983.0,982.5,15.5) Validation Error: '
+               'position is out of bounds',
+               'Loading ...ercenaries\\merc_rear\\merc_rear_mp.cgf',
+               'Lua cvar: (cl_display_hud,1)')
+
+SIZE_UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3}
+
+
+def parse_size(size):
+    """
+    :param size: a number of bytes, with an optional unit: '512', '64KB', '10MB', '2GB'
+    :return: the number of bytes
+    """
+    size = size.strip().upper()
+    for unit, factor in SIZE_UNITS.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(size)
+
+
+def get_player_names(player_count):
+    """
+    :param player_count: number of players of the match
+    :return: list of player names, names of the sample logs first then numbered ones
+    """
+    names = list(PLAYER_NAMES[:player_count])
+    names.extend('player%d' % index for index in range(len(names), player_count))
+    return names
+
+
+def format_line_time(time):
+    return '<%s>' % time.strftime('%M:%S')
+
+
+def build_frag_line(rng, player_names, suicide_ratio):
+    """
+    :return: the text of a frag line without its time: '<Lua> cyap killed lamonthe with AG36'
+    """
+    killer_name = rng.choice(player_names)
+    if rng.random() < suicide_ratio:
+        return '<Lua> %s killed itself' % killer_name
+    victim_name = rng.choice(player_names)
+    while victim_name == killer_name:
+        victim_name = rng.choice(player_names)
+    return '<Lua> %s killed %s with %s' % (killer_name, victim_name, rng.choice(WEAPON_CODES))
+
+
+def estimate_frag_count(size, player_names, suicide_ratio, noise_ratio, seed):
+    """
+    :return: the number of frags of a log of about size bytes, from the average length of sample frag lines
+    """
+    rng = random.Random(seed)
+    sample_count = 1000
+    sample_size = sum(len(build_frag_line(rng, player_names, suicide_ratio)) + 10 for _ in range(sample_count))
+    noise_size = sum(len(line) + 10 for line in NOISE_LINES) / len(NOISE_LINES)
+    frag_size = sample_size / sample_count + noise_ratio * noise_size
+    return max(1, int((size - 1024) / frag_size))
+
+
+def generate_log(log_file_pathname, player_count=8, match_minutes=30, frag_count=None, size=None,
+                 suicide_ratio=0.02, noise_ratio=1.0, map_name='mp_surf', game_mode='FFA', time_zone=-5,
+                 start_time=datetime(2019, 3, 1, 16, 0, 0), seed=0):
+    """
+    Write a synthetic log of one match. The frags are spread evenly over the match, so the gap between
+    two frags must stay under an hour for the parser to find their hour (the logs only have minutes and seconds).
+    :param log_file_pathname: path of the log file to write
+    :param player_count: number of players of the match
+    :param match_minutes: length of the match, in minutes
+    :param frag_count: number of frags of the match, computed from size if None
+    :param size: approximate size of the log in bytes, used when frag_count is None
+    :param suicide_ratio: probability of a frag to be a suicide
+    :param noise_ratio: average number of other lines written after each frag
+    :param map_name: map of the match
+    :param game_mode: mode of the match
+    :param time_zone: time zone of the server, in hours
+    :param start_time: naive datetime, local time of the server, when the log starts
+    :param seed: seed of the random generator, the same arguments write the same log
+    :return: dictionary describing the generated log:
+             {'frag_count': ..., 'suicide_count': ..., 'first_frag_time': ..., 'last_frag_time': ..., 'size': ...}
+             where the times are datetime objects with time zone, as returned by parse_frags
+    """
+    if player_count < 2:
+        raise ValueError('A match needs at least 2 players')
+    player_names = get_player_names(player_count)
+    if frag_count is None:
+        if size is None:
+            raise ValueError('frag_count or size is required')
+        frag_count = estimate_frag_count(size, player_names, suicide_ratio, noise_ratio, seed)
+
+    rng = random.Random(seed)
+    tzinfo = timezone(timedelta(hours=time_zone))
+    loading_time = start_time + timedelta(seconds=105)
+    match_start_time = loading_time + timedelta(seconds=17)
+    match_seconds = match_minutes * 60
+    match_end_time = match_start_time + timedelta(seconds=match_seconds + 8)
+
+    suicide_count = 0
+    size = 0
+    with open(log_file_pathname, 'w', newline='\r\n', buffering=1024 * 1024) as log_file:
+        header = ['Log Started at %s' % start_time.strftime('%A, %B %d, %Y %H:%M:%S'),
+                  'FileVersion: 1.1.3.1395',
+                  'ProductVersion: 1.1.3.1395',
+                  '',
+                  '%s Lua cvar: (g_timezone,%d)' % (format_line_time(start_time + timedelta(seconds=2)), time_zone),
+                  '%s ---------------------- Loading level Levels/%s, mission %s ----------------------'
+                  % (format_line_time(loading_time), map_name, game_mode),
+                  '%s Precaching level ... %s done' % (format_line_time(match_start_time),
+                                                       format_line_time(match_start_time))]
+        text = '\n'.join(header) + '\n'
+        log_file.write(text)
+        size += len(text) + len(header)
+
+        line_time = None
+        last_second = None
+        for index in range(frag_count):
+            second = match_seconds * (index + 1) // (frag_count + 1)
+            if second != last_second:
+                line_time = format_line_time(match_start_time + timedelta(seconds=second))
+                last_second = second
+            frag_line = build_frag_line(rng, player_names, suicide_ratio)
+            if frag_line.endswith('itself'):
+                suicide_count += 1
+            text = '%s %s\n' % (line_time, frag_line)
+            noise_count = int(noise_ratio) + (rng.random() < noise_ratio - int(noise_ratio))
+            for _ in range(noise_count):
+                text += '%s %s\n' % (line_time, rng.choice(NOISE_LINES).format(rng.choice(player_names)))
+            log_file.write(text)
+            size += len(text) + text.count('\n')
+
+        end_line_time = format_line_time(match_end_time)
+        footer = ['%s ================================================================================' % end_line_time,
+                  '%s == Statistics                                                                 ==' % end_line_time,
+                  '%s ================================================================================' % end_line_time,
+                  '%s <Lua> Map: %s (%s)' % (end_line_time, map_name, game_mode),
+                  '%s System Shutdown' % format_line_time(match_end_time + timedelta(seconds=20))]
+        text = '\n'.join(footer) + '\n'
+        log_file.write(text)
+        size += len(text) + len(footer)
+
+    first_second = match_seconds // (frag_count + 1)
+    last_second = match_seconds * frag_count // (frag_count + 1)
+    return {
+        'frag_count': frag_count,
+        'suicide_count': suicide_count,
+        'first_frag_time': (match_start_time + timedelta(seconds=first_second)).replace(tzinfo=tzinfo),
+        'last_frag_time': (match_start_time + timedelta(seconds=last_second)).replace(tzinfo=tzinfo),
+        'size': size,
+    }
+
+
+def generate_logs(directory, count, player_count=8, size=None, start_time=datetime(2019, 3, 1, 16, 0, 0),
+                  step=timedelta(hours=1)):
+    """
+    Write the synthetic logs of several matches, log000.txt, log001.txt... with the seeds 0, 1...
+    :param directory: directory of the log files
+    :param count: number of logs
+    :param player_count: number of players of each match
+    :param size: approximate size of each log in bytes, see generate_log
+    :param start_time: naive datetime, local time of the server, when the first log starts
+    :param step: time between the starts of two logs, they must differ or the logs hold the same match
+    :return: list of the paths of the log files
+    """
+    log_file_pathnames = []
+    for index in range(count):
+        log_file_pathname = os.path.join(directory, 'log%03d.txt' % index)
+        generate_log(log_file_pathname, player_count, size=size, start_time=start_time + index * step, seed=index)
+        log_file_pathnames.append(log_file_pathname)
+    return log_file_pathnames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='log file to write')
+    parser.add_argument('--size', default='1MB', help='approximate size of the log: 512KB, 10MB, 2GB...')
+    parser.add_argument('--frags', type=int, help='number of frags, instead of --size')
+    parser.add_argument('--players', type=int, default=8)
+    parser.add_argument('--minutes', type=int, default=30, help='length of the match')
+    parser.add_argument('--suicide-ratio', type=float, default=0.02)
+    parser.add_argument('--noise-ratio', type=float, default=1.0, help='other lines written after each frag')
+    parser.add_argument('--map', default='mp_surf:FFA', help='map and mode of the match, example: mp_airstrip:ASSAULT')
+    parser.add_argument('--timezone', type=int, default=-5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    map_name, game_mode = args.map.split(':')
+    description = generate_log(args.path, args.players, args.minutes, frag_count=args.frags,
+                               size=parse_size(args.size), suicide_ratio=args.suicide_ratio,
+                               noise_ratio=args.noise_ratio, map_name=map_name, game_mode=game_mode,
+                               time_zone=args.timezone, seed=args.seed)
+    print('%s: %d bytes, %d frags (%d suicides) from %s to %s'
+          % (args.path, description['size'], description['frag_count'], description['suicide_count'],
+             description['first_frag_time'], description['last_frag_time']))
+
+
+if __name__ == '__main__':
+    main()
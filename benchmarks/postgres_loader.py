@@ -0,0 +1,85 @@
+"""
+Compare the throughput of the ways frags can be sent to PostgreSQL.
+
+Run it against a throwaway database, the inserted matches are deleted at the end:
+    python -m benchmarks.postgres_loader --host localhost --database farcry_bench \\
+        --user postgres --password postgres --setup --repeat 20
+"""
+import argparse
+import glob
+import time
+
+from farcry_data_science import parse_log_file, parse_record_game_session_times
+from utilities.migrations import migrate
+from utilities.postgres_util import create_postgres_connection, insert_match_and_frags_postgres
+
+
+def load_matches(log_pattern):
+    """
+    :param log_pattern: glob pattern of the log files to parse
+    :return: a list of tuples (match, frags) ready to be inserted
+    """
+    matches = []
+    for log_file_pathname in sorted(glob.glob(log_pattern)):
+        record = parse_log_file(log_file_pathname)
+        start_time, end_time = parse_record_game_session_times(record)
+        matches.append(((start_time, end_time, record['game_mode'], record['map_name']), record['frags']))
+    return matches
+
+
+def run_method(connection, matches, method, repeat):
+    """
+    :param connection: connection object of postgresql database
+    :param matches: a list of tuples (match, frags)
+    :param method: insert method, see insert_match_and_frags_postgres
+    :param repeat: number of times every match is inserted
+    :return: a tuple (frag_count, elapsed_seconds, match_ids)
+    """
+    match_ids = []
+    frag_count = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for match, frags in matches:
+            match_ids.append(insert_match_and_frags_postgres(connection, match, frags, method))
+            frag_count += len(frags)
+    return frag_count, time.perf_counter() - start, match_ids
+
+
+def delete_matches(connection, match_ids):
+    """
+    Remove the matches inserted by the benchmark
+    """
+    cur = connection.cursor()
+    cur.execute('DELETE FROM match_frag WHERE match_id = ANY(%s::uuid[])', ([str(m) for m in match_ids],))
+    cur.execute('DELETE FROM match WHERE match_id = ANY(%s::uuid[])', ([str(m) for m in match_ids],))
+    connection.commit()
+    cur.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--database', default='farcry')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--logs', default='./logs/*.txt', help='glob pattern of the logs to insert')
+    parser.add_argument('--repeat', type=int, default=10, help='number of times each log is inserted')
+    parser.add_argument('--methods', default='row,values,copy')
+    parser.add_argument('--setup', action='store_true', help='create or upgrade the tables, see utilities.migrations')
+    args = parser.parse_args()
+
+    connection = create_postgres_connection((args.host, args.database, args.user, args.password))
+    if args.setup:
+        migrate(connection, 'postgres')
+
+    matches = load_matches(args.logs)
+    print('%-8s %10s %10s %14s' % ('method', 'frags', 'seconds', 'frags/second'))
+    for method in args.methods.split(','):
+        frag_count, elapsed, match_ids = run_method(connection, matches, method, args.repeat)
+        print('%-8s %10d %10.3f %14.0f' % (method, frag_count, elapsed, frag_count / elapsed))
+        delete_matches(connection, match_ids)
+    connection.close()
+
+
+if __name__ == '__main__':
+    main()
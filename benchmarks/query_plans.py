@@ -0,0 +1,145 @@
+"""
+Report the query plans and timings of the SELECT queries of sql_queries/ before and after the
+schema migrations (see utilities.migrations).
+
+The SQLite database is copied to a temporary file first, the original database is left untouched:
+    python -m benchmarks.query_plans --sqlite ./farcry.db --repeat 20
+
+With --postgres, the migrations are applied in a transaction which is rolled back at the end:
+    python -m benchmarks.query_plans --postgres localhost,farcry,postgres,postgres
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import tempfile
+import time
+
+from utilities.migrations import MIGRATIONS, get_schema_version, migrate
+
+
+def load_select_queries(query_pattern):
+    """
+    :param query_pattern: glob pattern of the SQL files
+    :return: a list of tuples (file_name, query) of the files holding a single SELECT query
+    """
+    queries = []
+    for query_pathname in sorted(glob.glob(query_pattern), key=str.lower):
+        with open(query_pathname) as query_file:
+            query = query_file.read().strip().rstrip(';')
+        if query.upper().startswith(('SELECT', 'WITH')) and ';' not in query:
+            queries.append((os.path.basename(query_pathname), query))
+    return queries
+
+
+def time_query(cur, query, repeat):
+    """
+    :param cur: cursor of the sqlite or postgresql database
+    :param query: SELECT query
+    :param repeat: number of times the query is run
+    :return: the best time of the runs, in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cur.execute(query)
+        cur.fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def explain_query(cur, query, backend):
+    """
+    :return: the query plan as a list of lines
+    """
+    if backend == 'sqlite':
+        cur.execute('EXPLAIN QUERY PLAN ' + query)
+        return [row[-1] for row in cur.fetchall()]
+    cur.execute('EXPLAIN ' + query)
+    return [row[0] for row in cur.fetchall()]
+
+
+def report(connection, backend, queries, repeat):
+    """
+    :return: dictionary of the plan and best time of each query: {file_name: (plan, seconds), ...}
+    """
+    results = {}
+    cur = connection.cursor()
+    for file_name, query in queries:
+        results[file_name] = explain_query(cur, query, backend), time_query(cur, query, repeat)
+    cur.close()
+    return results
+
+
+def print_comparison(before, after):
+    for file_name in before:
+        plan_before, seconds_before = before[file_name]
+        plan_after, seconds_after = after[file_name]
+        print('%-12s %10.3f ms %10.3f ms %7.1fx' % (file_name, seconds_before * 1000, seconds_after * 1000,
+                                                   seconds_before / seconds_after if seconds_after else 0))
+        if plan_before != plan_after:
+            for line in plan_before:
+                print('    - ' + line)
+            for line in plan_after:
+                print('    + ' + line)
+
+
+def compare_sqlite(sqlite_pathname, queries, repeat):
+    source = sqlite3.connect(sqlite_pathname)
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, 'farcry.db'))
+        source.backup(connection)
+        source.close()
+
+        version = get_schema_version(connection, 'sqlite')
+        before = report(connection, 'sqlite', queries, repeat)
+        applied_versions = migrate(connection, 'sqlite')
+        connection.execute('ANALYZE')
+        after = report(connection, 'sqlite', queries, repeat)
+        connection.close()
+
+    print('SQLite schema version %d -> %d (applied: %s)' % (version, MIGRATIONS[-1][0], applied_versions or 'none'))
+    print_comparison(before, after)
+
+
+def compare_postgres(properties, queries, repeat):
+    from utilities.postgres_util import create_postgres_connection
+
+    connection = create_postgres_connection(properties)
+    try:
+        version = get_schema_version(connection, 'postgres')
+        before = report(connection, 'postgres', queries, repeat)
+        applied_versions = migrate(connection, 'postgres', commit=False)
+        cur = connection.cursor()
+        cur.execute('ANALYZE match_frag')
+        cur.close()
+        after = report(connection, 'postgres', queries, repeat)
+    finally:
+        connection.rollback()
+        connection.close()
+
+    print('PostgreSQL schema version %d -> %d (applied: %s, rolled back)'
+          % (version, MIGRATIONS[-1][0], applied_versions or 'none'))
+    print_comparison(before, after)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sqlite', help='SQLite database, copied before being migrated')
+    parser.add_argument('--postgres', help='PostgreSQL connection properties: hostname,database,username,password')
+    parser.add_argument('--queries', default='./sql_queries/*.sql', help='glob pattern of the SQL files')
+    parser.add_argument('--repeat', type=int, default=10, help='number of runs of each query, the best is reported')
+    args = parser.parse_args()
+    if not args.sqlite and not args.postgres:
+        parser.error('--sqlite or --postgres is required')
+
+    queries = load_select_queries(args.queries)
+    if args.sqlite:
+        compare_sqlite(args.sqlite, queries, args.repeat)
+    if args.postgres:
+        compare_postgres(tuple(args.postgres.split(',')), queries, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Compare the serial killers and losers of many matches computed match by match with calculate_serial_killers
+and calculate_serial_losers, with the ones of calculate_serial_killers_by_match and
+calculate_serial_losers_by_match over a single FragTable of all the matches: walked in Python, and with
+the array operations of numpy when it is installed (see utilities.streak_util).
+
+Synthetic logs of benchmarks.log_generator are parsed first, only the computation of the series is timed:
+    python -m benchmarks.serial_streaks --logs 100 --size 2MB --players 16 --repeat 3
+
+The exit status is 1 when a result differs from the one of the per-match functions.
+"""
+import argparse
+import sys
+import tempfile
+
+from benchmarks.log_generator import generate_logs, parse_size
+from benchmarks.suite import best_time
+from farcry_data_science import calculate_serial_killers, calculate_serial_losers, \
+    calculate_serial_killers_by_match, calculate_serial_losers_by_match, parse_log_file
+from frag_table import FragTable
+from utilities import streak_util
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logs', type=int, default=50, help='number of matches')
+    parser.add_argument('--size', default='1MB', help='size of each log: 1MB, 10MB...')
+    parser.add_argument('--players', type=int, default=16, help='number of players of each match')
+    parser.add_argument('--repeat', type=int, default=3, help='number of times each computation is timed')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        matches = [(match_id, parse_log_file(log_file_pathname)['frags']) for match_id, log_file_pathname
+                   in enumerate(generate_logs(directory, args.logs, args.players, parse_size(args.size)))]
+    frag_table = FragTable()
+    for match_id, frags in matches:
+        frag_table.extend(frags, match_id)
+    print('%d matches, %d frags' % (len(matches), len(frag_table)))
+
+    numpy = streak_util.import_numpy()
+    implementations = [('walk', lambda losers: streak_util.walk_longest_series(frag_table, losers))]
+    if numpy is not None:
+        implementations.append(('numpy', lambda losers: streak_util.vectorize_longest_series(numpy, frag_table,
+                                                                                            losers)))
+    else:
+        print('numpy is not installed, only the Python walk is timed')
+
+    failed = False
+    print('%-8s %-16s %12s %12s' % ('series', 'implementation', 'series s', 'with tuples s'))
+    for name, calculate, calculate_by_match, losers in (
+            ('killers', calculate_serial_killers, calculate_serial_killers_by_match, False),
+            ('losers', calculate_serial_losers, calculate_serial_losers_by_match, True)):
+        expected, seconds = best_time(lambda: {match_id: calculate(frags) for match_id, frags in matches},
+                                      args.repeat)
+        print('%-8s %-16s %12s %12.3f' % (name, 'per match', '', seconds))
+        reference = None
+        for implementation, find_longest_series in implementations:
+            series, series_seconds = best_time(lambda: find_longest_series(losers), args.repeat)
+            if reference is None:
+                reference = series
+            elif series != reference:
+                print('%s: the %s series differ from the ones of the walk' % (name, implementation))
+                failed = True
+            # calculate_*_by_match picks numpy when it is installed, the walk otherwise
+            result, seconds = best_time(lambda: calculate_by_match(frag_table), args.repeat) \
+                if implementation == implementations[-1][0] else (None, None)
+            print('%-8s %-16s %12.3f %12s' % (name, implementation, series_seconds,
+                                               '%.3f' % seconds if seconds is not None else ''))
+            if result is not None and result != expected:
+                print('%s: the results differ from the ones of the per-match function' % name)
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
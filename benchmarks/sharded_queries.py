@@ -0,0 +1,135 @@
+"""
+Compare analytics queries on a single SQLite database with the same queries fanned out to the databases
+of each month (see utilities.shard_util), in a pool of threads and in a pool of processes.
+
+Synthetic logs of benchmarks.log_generator, spread over several months, are ingested into a temporary
+single database, which is split with split_database. The same logs are also ingested directly into
+month databases, which must hold the same matches:
+    python -m benchmarks.sharded_queries --logs 48 --months 12 --size 2MB --repeat 5
+
+The exit status is 1 when a merged result differs from the one of the single database. Players tied
+for the first place may be picked differently, only their kill counts have to be the same.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+from benchmarks.log_generator import generate_logs, parse_size
+from benchmarks.suite import best_time
+from farcry_data_science import ingest_logs
+from utilities.backends import open_backend
+from utilities.query_cache import load_query
+from utilities.shard_util import find_shards, run_sharded_query, get_sharded_frag_rollups, split_database, \
+    merge_aggregates, concat_shard_rows, top_rows
+from utilities.sqlite_util import get_frag_rollups
+
+# Queries run on the single database and on the month databases: (name, query, function merging
+# the rows of the months, True if the query is restricted to the time range of --range-months)
+QUERIES = (
+    ('kills by killer',
+     ''' SELECT killer_name, COUNT(victim_name), MIN(frag_time), MAX(frag_time) FROM match_frag
+         GROUP BY killer_name ORDER BY killer_name ''',
+     lambda shard_rows: sorted(merge_aggregates(shard_rows, (0,), {1: 'sum', 2: 'min', 3: 'max'})), False),
+    ('frags in range',
+     ''' SELECT COUNT(*) FROM match_frag WHERE frag_time >= ? AND frag_time < ? ''',
+     partial(merge_aggregates, key_columns=(), aggregates={0: 'sum'}), True),
+    ('WP44.sql', load_query('WP44.sql'), lambda shard_rows: sorted(concat_shard_rows(shard_rows)), False),
+    ('WP50.sql', load_query('WP50.sql'),
+     lambda shard_rows: sorted(top_rows(concat_shard_rows(shard_rows), 1, 3, (1,)), key=lambda row: row[1]), False),
+)
+
+
+def normalize_rows(name, rows):
+    """
+    :return: the rows of a query in the form they are compared in: favorite victims without the victim
+             and the match, which are arbitrary between ties
+    """
+    if name == 'WP50.sql':
+        return sorted((row[1], row[3]) for row in rows)
+    return sorted(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logs', type=int, default=24, help='number of matches')
+    parser.add_argument('--months', type=int, default=6, help='number of months the matches are spread over')
+    parser.add_argument('--range-months', type=int, default=2, help='number of months of the time range queries')
+    parser.add_argument('--size', default='1MB', help='size of each log: 1MB, 10MB...')
+    parser.add_argument('--players', type=int, default=16, help='number of players of each match')
+    parser.add_argument('--workers', type=int, default=None, help='number of threads or processes of the fan-out')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times each query is timed')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        pathnames = generate_logs(directory, args.logs, args.players, parse_size(args.size),
+                                  datetime(2019, 1, 1, 16, 0, 0), timedelta(days=args.months * 30 / args.logs))
+        sqlite_pathname = os.path.join(directory, 'farcry.db')
+        split_directory = os.path.join(directory, 'split')
+        ingested_directory = os.path.join(directory, 'ingested')
+
+        start = time.perf_counter()
+        ingest_logs(pathnames, sqlite_pathname, report=lambda line: None)
+        print('single database ingested in %.3fs' % (time.perf_counter() - start))
+        start = time.perf_counter()
+        split_database(sqlite_pathname, split_directory, report=lambda line: None)
+        print('split into %d month databases in %.3fs' % (len(find_shards(split_directory)),
+                                                          time.perf_counter() - start))
+        start = time.perf_counter()
+        with open_backend('sharded_sqlite', ingested_directory) as backend:
+            ingest_logs(pathnames, report=lambda line: None, backend=backend)
+        print('month databases ingested in %.3fs' % (time.perf_counter() - start))
+
+        failed = False
+        connection = sqlite3.connect(sqlite_pathname)
+        # The same matches, with other ids, must be in the split and in the ingested month databases
+        match_query = ''' SELECT start_time, end_time, game_mode, map_name, COUNT(*) FROM match
+                          JOIN match_frag USING (match_id) GROUP BY match_id '''
+        if sorted(connection.execute(match_query).fetchall()) != \
+                sorted(run_sharded_query(ingested_directory, match_query)):
+            print('the month databases ingested directly hold other matches than the single database')
+            failed = True
+
+        range_start = datetime(2019, 2, 1, tzinfo=timezone.utc)
+        range_end = datetime(2019 + (1 + args.range_months) // 12, (1 + args.range_months) % 12 + 1, 1,
+                             tzinfo=timezone.utc)
+        range_parameters = (int(range_start.timestamp()), int(range_end.timestamp()))
+        print('%-16s %7s %11s %11s %11s' % ('query', 'months', 'single ms', 'threads ms', 'processes ms'))
+        for name, query, merge, in_range in QUERIES:
+            parameters = range_parameters if in_range else ()
+            start_time, end_time = (range_start, range_end) if in_range else (None, None)
+            single_rows, single_seconds = best_time(lambda: connection.execute(query, parameters).fetchall(),
+                                                    args.repeat)
+            thread_rows, thread_seconds = best_time(lambda: run_sharded_query(
+                split_directory, query, parameters, start_time, end_time, merge, args.workers), args.repeat)
+            process_rows, process_seconds = best_time(lambda: run_sharded_query(
+                split_directory, query, parameters, start_time, end_time, merge, args.workers, processes=True),
+                args.repeat)
+            print('%-16s %7d %11.3f %11.3f %11.3f' % (
+                name, len(find_shards(split_directory, start_time, end_time)), single_seconds * 1000,
+                thread_seconds * 1000, process_seconds * 1000))
+            for rows in (thread_rows, process_rows):
+                if normalize_rows(name, rows) != normalize_rows(name, single_rows):
+                    print('%s: the merged rows differ from the ones of the single database' % name)
+                    failed = True
+
+        rollup_rows, single_seconds = best_time(lambda: get_frag_rollups(
+            connection, 'week', range_start, range_end, group_by=('weapon_class',)), args.repeat)
+        sharded_rollup_rows, thread_seconds = best_time(lambda: get_sharded_frag_rollups(
+            split_directory, 'week', range_start, range_end, group_by=('weapon_class',), workers=args.workers),
+            args.repeat)
+        print('%-16s %7d %11.3f %11.3f' % ('weekly rollups', len(find_shards(split_directory, range_start, range_end)),
+                                           single_seconds * 1000, thread_seconds * 1000))
+        if rollup_rows != sharded_rollup_rows:
+            print('weekly rollups: the merged rows differ from the ones of the single database')
+            failed = True
+        connection.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
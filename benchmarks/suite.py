@@ -0,0 +1,286 @@
+"""
+Time every stage of the processing of Far Cry logs, check the parsed frags against the reference
+outputs of frags/*.csv and compare the timings with a stored baseline to catch regressions.
+
+The logs are the sample logs of logs/ plus synthetic logs of benchmarks.log_generator:
+    python -m benchmarks.suite --size 10MB --size 100MB --players 16 --save-baseline
+    python -m benchmarks.suite --size 10MB --size 100MB --players 16 --tolerance 0.25
+
+The peak resident memory of the readers of a log (read_log_file, streamed parse_log_file and
+map_log_file) is measured in a fresh process for each synthetic log.
+
+The exit status is 1 when a stage is slower or a reader uses more memory than its baseline beyond
+the tolerance, or when the frags differ from the reference outputs differently than when the
+baseline was saved.
+"""
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.log_generator import generate_log, parse_size
+from farcry_data_science import (calculate_serial_killers, calculate_serial_losers, insert_match_to_sqlite,
+                                 parse_frags, parse_game_session_start_and_end_times, parse_match_mode_and_map,
+                                 read_log_file)
+from utilities.sqlite_util import create_connection
+
+STAGES = ('read_log_file', 'parse_frags', 'parse_game_session_start_and_end_times', 'calculate_serial_killers',
+          'calculate_serial_losers', 'insert_match_to_sqlite')
+
+DEFAULT_BASELINE_PATHNAME = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Ways of reading and parsing a whole log, their peak memory is measured in a fresh process
+READERS = {
+    'read_log_file': 'parse_frags(read_log_file(log_file_pathname))',
+    'parse_log_file': 'parse_log_record(iter_log_lines(log_file_pathname))',
+    'map_log_file': 'with map_log_file(log_file_pathname) as mapped_log: parse_frags(mapped_log)',
+}
+
+# The peak is read from VmHWM: ru_maxrss is kept across execve, the child would report the peak of the suite
+PEAK_MEMORY_SCRIPT = '''
+import re, resource, sys
+from farcry_data_science import *
+log_file_pathname = sys.argv[1]
+%s
+try:
+    with open('/proc/self/status') as status_file:
+        print(re.search(r'VmHWM:\\s*(\\d+)', status_file.read()).group(1))
+except OSError:
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+# Differences under this number of seconds are timer noise, not regressions
+MINIMUM_REGRESSION_SECONDS = 0.005
+
+
+def best_time(function, repeat):
+    """
+    :param function: function called without argument
+    :param repeat: number of calls
+    :return: a tuple (result of the last call, best time of the calls in seconds)
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def time_stages(log_file_pathname, directory, repeat):
+    """
+    :param log_file_pathname: log to process
+    :param directory: directory of the temporary SQLite databases
+    :param repeat: number of runs of each stage, the best is kept
+    :return: a tuple (frags, {stage: seconds, ...})
+    """
+    timings = {}
+    log_data, timings['read_log_file'] = best_time(lambda: read_log_file(log_file_pathname), repeat)
+    frags, timings['parse_frags'] = best_time(lambda: parse_frags(log_data), repeat)
+    (start_time, end_time), timings['parse_game_session_start_and_end_times'] = best_time(
+        lambda: parse_game_session_start_and_end_times(log_data, frags), repeat)
+    _, timings['calculate_serial_killers'] = best_time(lambda: calculate_serial_killers(frags), repeat)
+    _, timings['calculate_serial_losers'] = best_time(lambda: calculate_serial_losers(frags), repeat)
+
+    game_mode, map_name = parse_match_mode_and_map(log_data)
+    best = None
+    for run in range(repeat):
+        sqlite_pathname = os.path.join(directory, '%s-%d.db' % (os.path.basename(log_file_pathname), run))
+        create_connection(sqlite_pathname).close()
+        start = time.perf_counter()
+        insert_match_to_sqlite(sqlite_pathname, start_time, end_time, game_mode, map_name, frags)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        os.remove(sqlite_pathname)
+    timings['insert_match_to_sqlite'] = best
+    return frags, timings
+
+
+def measure_peak_memory(log_file_pathname, reader):
+    """
+    :param log_file_pathname: log to parse
+    :param reader: name of the reader, see READERS
+    :return: peak resident memory in kilobytes of a fresh process parsing the log with the reader
+    """
+    output = subprocess.run([sys.executable, '-c', PEAK_MEMORY_SCRIPT % READERS[reader], log_file_pathname],
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return int(output.split()[-1])
+
+
+def format_frags_csv(frags):
+    """
+    :return: the frags as written by write_frag_csv_file
+    """
+    output = io.StringIO()
+    filewriter = csv.writer(output, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL)
+    for frag in frags:
+        filewriter.writerow(frag)
+    return output.getvalue()
+
+
+def compare_with_reference(frags, reference_pathname):
+    """
+    :param frags: frags parsed from a sample log
+    :param reference_pathname: reference output of the log, example: './frags/frags00.csv'
+    :return: list of the differing rows: [(parsed_row, reference_row), ...], where a missing row is None
+    """
+    with open(reference_pathname, newline='') as reference_file:
+        reference_rows = reference_file.read().splitlines()
+    rows = format_frags_csv(frags).splitlines()
+    differences = [(row, reference_row) for row, reference_row in zip(rows, reference_rows) if row != reference_row]
+    differences.extend((row, None) for row in rows[len(reference_rows):])
+    differences.extend((None, reference_row) for reference_row in reference_rows[len(rows):])
+    return differences
+
+
+def run_suite(log_pattern, reference_directory, synthetic_logs, repeat, report=print):
+    """
+    :param log_pattern: glob pattern of the sample logs, checked against the reference outputs
+    :param reference_directory: directory of the reference outputs frags*.csv
+    :param synthetic_logs: list of keyword arguments of generate_log, one per synthetic log
+    :param repeat: number of runs of each stage
+    :param report: function called with the progress messages
+    :return: dictionary of the results: {'timings': {dataset: {stage: seconds}},
+             'peak_memory': {dataset: {reader: kilobytes}}, 'reference_differences': {log: count}}
+    """
+    results = {'timings': {}, 'peak_memory': {}, 'reference_differences': {}}
+    with tempfile.TemporaryDirectory() as directory:
+        sample_timings = dict.fromkeys(STAGES, 0.0)
+        for log_file_pathname in sorted(glob.glob(log_pattern)):
+            frags, timings = time_stages(log_file_pathname, directory, repeat)
+            for stage, seconds in timings.items():
+                sample_timings[stage] += seconds
+
+            log_name = os.path.basename(log_file_pathname)
+            reference_pathname = os.path.join(reference_directory, log_name.replace('log', 'frags')
+                                              .replace('.txt', '.csv'))
+            if os.path.exists(reference_pathname):
+                differences = compare_with_reference(frags, reference_pathname)
+                results['reference_differences'][log_name] = len(differences)
+                for row, reference_row in differences:
+                    report('%s: parsed %s, reference %s' % (log_name, row, reference_row))
+        results['timings']['samples'] = sample_timings
+
+        for generator_arguments in synthetic_logs:
+            dataset = 'synthetic-%(size)d-%(player_count)dp-%(match_minutes)dm' % generator_arguments
+            log_file_pathname = os.path.join(directory, dataset + '.txt')
+            description = generate_log(log_file_pathname, **generator_arguments)
+            frags, timings = time_stages(log_file_pathname, directory, repeat)
+            results['peak_memory'][dataset] = {reader: measure_peak_memory(log_file_pathname, reader)
+                                               for reader in READERS}
+            os.remove(log_file_pathname)
+
+            # The generator knows what it wrote: the parser must find all of it
+            suicide_count = sum(len(frag) == 2 for frag in frags)
+            if (len(frags), suicide_count, frags[0][0], frags[-1][0]) != (
+                    description['frag_count'], description['suicide_count'],
+                    description['first_frag_time'], description['last_frag_time']):
+                raise AssertionError('%s: parsed %d frags (%d suicides), generated %d (%d suicides)'
+                                     % (dataset, len(frags), suicide_count, description['frag_count'],
+                                        description['suicide_count']))
+            report('%s: %d bytes, %d frags' % (dataset, description['size'], len(frags)))
+            results['timings'][dataset] = timings
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    :param results: results of run_suite
+    :param baseline: results of a previous run_suite
+    :param tolerance: allowed slowdown, 0.25 for 25%
+    :return: list of the regressions, as messages
+    """
+    regressions = []
+    for dataset, timings in results['timings'].items():
+        baseline_timings = baseline['timings'].get(dataset)
+        if baseline_timings is None:
+            continue
+        for stage, seconds in timings.items():
+            baseline_seconds = baseline_timings.get(stage)
+            if (baseline_seconds is not None and seconds > baseline_seconds * (1 + tolerance)
+                    and seconds - baseline_seconds > MINIMUM_REGRESSION_SECONDS):
+                regressions.append('%s %s: %.3fs, baseline %.3fs' % (dataset, stage, seconds, baseline_seconds))
+    for dataset, peak_memory in results.get('peak_memory', {}).items():
+        baseline_peak_memory = baseline.get('peak_memory', {}).get(dataset, {})
+        for reader, kilobytes in peak_memory.items():
+            baseline_kilobytes = baseline_peak_memory.get(reader)
+            if baseline_kilobytes is not None and kilobytes > baseline_kilobytes * (1 + tolerance):
+                regressions.append('%s %s: %d KB peak memory, baseline %d KB'
+                                   % (dataset, reader, kilobytes, baseline_kilobytes))
+    for log_name, count in results['reference_differences'].items():
+        baseline_count = baseline['reference_differences'].get(log_name)
+        if baseline_count is not None and count != baseline_count:
+            regressions.append('%s: %d rows differ from the reference output, %d in the baseline'
+                               % (log_name, count, baseline_count))
+    return regressions
+
+
+def print_timings(results, baseline=None):
+    print('%-36s %-40s %10s %10s' % ('dataset', 'stage', 'seconds', 'baseline'))
+    for dataset, timings in results['timings'].items():
+        baseline_timings = (baseline or {}).get('timings', {}).get(dataset, {})
+        for stage in STAGES:
+            baseline_seconds = baseline_timings.get(stage)
+            print('%-36s %-40s %10.4f %10s' % (dataset, stage, timings[stage],
+                                               '%.4f' % baseline_seconds if baseline_seconds is not None else '-'))
+    if results.get('peak_memory'):
+        print()
+        print('%-36s %-40s %10s %10s' % ('dataset', 'reader', 'peak KB', 'baseline'))
+    for dataset, peak_memory in results.get('peak_memory', {}).items():
+        baseline_peak_memory = (baseline or {}).get('peak_memory', {}).get(dataset, {})
+        for reader in READERS:
+            baseline_kilobytes = baseline_peak_memory.get(reader)
+            print('%-36s %-40s %10d %10s' % (dataset, reader, peak_memory[reader],
+                                             baseline_kilobytes if baseline_kilobytes is not None else '-'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logs', default='./logs/*.txt', help='glob pattern of the sample logs')
+    parser.add_argument('--references', default='./frags', help='directory of the reference outputs')
+    parser.add_argument('--size', action='append', default=[],
+                        help='size of a synthetic log: 10MB, 1GB..., can be repeated')
+    parser.add_argument('--players', type=int, default=8, help='number of players of the synthetic logs')
+    parser.add_argument('--minutes', type=int, default=30, help='length of the matches of the synthetic logs')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs of each stage, the best is kept')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATHNAME, help='JSON file of the baseline')
+    parser.add_argument('--save-baseline', action='store_true', help='store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown over the baseline')
+    args = parser.parse_args(argv)
+
+    synthetic_logs = [{'size': parse_size(size), 'player_count': args.players, 'match_minutes': args.minutes}
+                      for size in args.size]
+    results = run_suite(args.logs, args.references, synthetic_logs, args.repeat)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    print_timings(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print('Baseline saved to %s' % args.baseline)
+        return 0
+    if baseline is None:
+        print('No baseline in %s, run with --save-baseline first' % args.baseline)
+        return 0
+
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION ' + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
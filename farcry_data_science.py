@@ -1,13 +1,118 @@
 from datetime import datetime, timezone, timedelta
+from itertools import islice
+import argparse
+import bz2
+import glob
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
 import re
 import csv
-from utilities.sqlite_util import create_connection, insert_match, insert_frag
-from utilities.postgres_util import create_postgres_connection, insert_match_postgres, insert_frag_postgres
+import sys
+import time
+from frag_table import FragTable
+from mapped_log import MappedLog
+from utilities import metrics
+from utilities.parquet_util import import_pyarrow, export_match_parquet, get_exported_log_hashes
+from utilities.query_cache import invalidate_match
+from utilities.streak_util import find_longest_series
+from utilities.backends import open_backend
+from utilities.sqlite_util import create_connection, insert_frags, build_full_frags, insert_match_row, \
+    update_match_times, create_log_checkpoint_table, get_log_checkpoint, save_log_checkpoint, create_ingested_log_table, \
+    find_ingested_match, insert_ingested_log, create_match_statistics_table, update_match_statistics, FRAG_BATCH_SIZE, \
+    migrate_database
+
+
+# Line patterns of the log file. Every pattern only matches inside a single line,
+# so the log can be scanned line by line instead of as one big string.
+LOG_START_PATTERN = re.compile(r"Log Started at (.+)")
+TIMEZONE_PATTERN = re.compile(r"\(g_timezone,(.*)\)")
+MODE_AND_MAP_PATTERN = re.compile(r"-* Loading level Levels/(\w+), mission (\w+) -*")
+START_TIME_MATCH_PATTERN = re.compile(r"Precaching level ... <(.+?)> done")
+END_TIME_MATCH_PATTERN = re.compile(r"<(.+?)> == Statistics")
+FRAG_PATTERN = re.compile(r"<(.+?)> <Lua> (.+) killed (?:itself|(.+) with (.+))")
+LINE_TIME_PATTERN = re.compile(r"^<(.{5})>")
+
+# Maximum number of lines of a followed log file parsed and committed at once
+FOLLOW_CHUNK_LINES = 10000
+
+# Icons of the prettyfied frags, see iter_pretty_frags
+WEAPON_ICON = {}
+WEAPON_ICON.update(dict.fromkeys(['Vehicle'], '🚙'))
+WEAPON_ICON.update(dict.fromkeys([
+    'Falcon', 'Shotgun', 'P90', 'MP5', 'M4', 'AG36',
+    'OICW', 'SniperRifle', 'M249', 'VehicleMountedAutoMG', 'VehicleMountedMG', 'MG'], '🔫'))
+WEAPON_ICON.update(dict.fromkeys(
+    ['HandGrenade', 'AG36Grenade', 'OICWGrenade', 'StickyExplosive'], '💣'))
+WEAPON_ICON.update(dict.fromkeys(
+    ['Rocket', 'VehicleMountedRocketMG', 'VehicleRocket'], '🚀'))
+WEAPON_ICON.update(dict.fromkeys(['Machete'], '🔪'))
+WEAPON_ICON.update(dict.fromkeys(['Boat'], '🚤'))
+UNKNOWN_WEAPON_ICON = '❓'
+
+KILLER_ICON = '😛'
+VICTIM_ICON = '😦'
+SUICIDE_ICON = '☠'
+
+# Number of prettyfied frags written at once by write_pretty_frags
+PRETTY_FRAG_CHUNK_LINES = 1000
+
+# Content hashes of the logs already in the database, set in each ingestion worker process
+INGESTED_LOG_HASHES = frozenset()
+
+# Codecs of the compressed logs: (compression, first bytes of the compressed files, function opening them).
+# A compressed log is recognized by its first bytes, whatever its extension, and decompressed while it is read.
+LOG_COMPRESSIONS = (
+    ('gzip', b'\x1f\x8b', gzip.open),
+    ('bz2', b'BZh', bz2.open),
+    ('xz', b'\xfd7zXZ\x00', lzma.open),
+)
+
+# Log files looked for in the directories given to find_log_files
+LOG_FILE_PATTERNS = ('*.txt', '*.txt.gz', '*.txt.bz2', '*.txt.xz')
+
+# Logs of at least this number of bytes are mapped in memory and scanned with bytes regexes by
+# parse_log_file, instead of being read line by line, see MappedLog
+MMAP_MIN_FILE_SIZE = 16 * 1024 * 1024
+
+
+def get_log_compression(log_file_pathname):
+    """
+    :param log_file_pathname: relative or absolute path to the log file
+    :return: compression of the log file, see LOG_COMPRESSIONS, or None if it is plain text
+    """
+    with open(log_file_pathname, 'rb') as file:
+        magic = file.read(6)
+    for compression, prefix, _ in LOG_COMPRESSIONS:
+        if magic.startswith(prefix):
+            return compression
+    return None
 
 
-def read_log_file(log_file_pathname):
+def open_log_file(log_file_pathname, mode='r'):
     """
+    Open a log file, plain text or compressed with gzip, bz2 or xz. A compressed log is decompressed
+    while it is read, it is never decompressed on disk or in memory as a whole.
     :param log_file_pathname: relative or absolute path to the log file
+    :param mode: 'r' to read the text of the log, 'rb' to read its bytes
+    :return: a file object reading the decompressed content of the log
+    """
+    compression = get_log_compression(log_file_pathname)
+    for name, _, open_compressed in LOG_COMPRESSIONS:
+        if name == compression:
+            metrics.increment('logs_decompressed', compression=compression)
+            return open_compressed(log_file_pathname, 'rt' if mode == 'r' else mode)
+    return open(log_file_pathname, mode)
+
+
+@metrics.timed('read_log_file')
+def read_log_file(log_file_pathname):
+    """
+    :param log_file_pathname: relative or absolute path to the log file, plain text or compressed
+                              (see open_log_file)
     :return: a string of file content
         example:
         >>>read_log_file('./log00.txt')
@@ -17,35 +122,378 @@ def read_log_file(log_file_pathname):
     """
 
     try:
-        with open(log_file_pathname, 'r') as file:
+        with open_log_file(log_file_pathname) as file:
             file_content = file.read()
+            if metrics.is_enabled():
+                # Size of the file on disk, the compressed size for a compressed log
+                metrics.increment('bytes_read', os.fstat(file.fileno()).st_size)
         return file_content
 
     # this is not finished, need to add more exception to handle: reading permission denied....
     except PermissionError:
+        metrics.increment('errors', stage='read_log_file')
         print('Reading permission denied: please add reading mode to the file')
 
 
-def get_timezone(log_data):
+def iter_log_lines(log_file_pathname):
     """
-    :param log_data: string content of log file
-    :return: the number of time zone in string format
+    :param log_file_pathname: relative or absolute path to the log file, plain text or compressed
+                              (see open_log_file)
+    :return: a generator of the lines of the log file, without the trailing new line.
+        The file is read lazily, and decompressed on the fly, so only one line is kept in memory at a time.
         example:
-            >>>get_timezone(log_data)
-            -5
+        >>>next(iter_log_lines('./log00.txt'))
+        'Log Started at Friday, November 09, 2018 12:22:07'
     """
-    try:
+    with open_log_file(log_file_pathname) as file:
+        if metrics.is_enabled():
+            metrics.increment('bytes_read', os.fstat(file.fileno()).st_size)
+        for line in file:
+            yield line.rstrip('\n')
+
+
+@metrics.timed('map_log_file')
+def map_log_file(log_file_pathname):
+    """
+    Map a log file in memory instead of reading it, see read_log_file. The functions taking the string
+    content of a log also accept the mapped log, they scan it with bytes regexes and only decode
+    the fields they need, so the content of the log is never copied into a string.
+    :param log_file_pathname: relative or absolute path to the log file
+    :return: a MappedLog object, to be closed when it is not needed anymore
+        example:
+        >>>with map_log_file('./log00.txt') as log_data:
+        ...    frags = parse_frags(log_data)
+    """
+    mapped_log = MappedLog(log_file_pathname)
+    metrics.increment('bytes_mapped', mapped_log.size)
+    return mapped_log
+
+
+def iter_log_data_lines(log_data):
+    """
+    :param log_data: string content of log file, or a MappedLog
+    :return: a generator of the lines of log_data, without building a list of all the lines
+    """
+    if isinstance(log_data, MappedLog):
+        return log_data.iter_lines()
+    return (line.rstrip('\n') for line in io.StringIO(log_data))
+
+
+def iter_log_events(lines, scanner_state=None):
+    """
+    Scan the lines of a log file once and yield everything the parser is interested in.
+    Header events (log start time, timezone, mode and map, start and end time of the match)
+    are only yielded for their first occurrence, frags are yielded for every occurrence.
+
+    :param lines: an iterable of lines of a log file, as returned by iter_log_lines
+    :param scanner_state: optional dictionary {'found': set of header events already yielded,
+                          'after_frag': True if the previous line was a frag}, updated while
+                          scanning so that the scan can be resumed with the next lines of the log
+    :return: a generator of tuples (event, value) in the order they appear in the log:
+        ('log_start_time', 'Friday, November 09, 2018 12:22:07')
+        ('timezone', '-5')
+        ('mode_and_map', ('FFA', 'mp_surf'))
+        ('start_time_match', '25:18')
+        ('frag', ('26:32', 'papazark', 'lamonthe', 'AG36')) or ('frag', ('27:18', 'theprophete'))
+        ('time_after_frag', '26:33'): time of the line that follows a frag
+        ('end_time_match', '53:17')
+    """
+    if scanner_state is None:
+        scanner_state = {'found': set(), 'after_frag': False}
+    found = scanner_state['found']
+
+    for line in lines:
+        if scanner_state['after_frag']:
+            scanner_state['after_frag'] = False
+            line_time = LINE_TIME_PATTERN.findall(line)
+            if line_time:
+                yield 'time_after_frag', line_time[0]
+
+        if '<Lua>' in line:
+            for frag in FRAG_PATTERN.findall(line):
+                # Suicides don't have victim and weapon, remove the empty groups
+                scanner_state['after_frag'] = True
+                yield 'frag', tuple(elem for elem in frag if elem)
+
+        # Header lines are only searched until their first occurrence has been found
+        if len(found) == 5:
+            continue
+
+        if 'log_start_time' not in found and 'Log Started at' in line:
+            match = LOG_START_PATTERN.search(line)
+            if match:
+                found.add('log_start_time')
+                yield 'log_start_time', match.group(1)
+
         # the timezone is stored in log file in the format:
         # (g_timezone,-5) or (g_timezone,0).
+        if 'timezone' not in found and 'g_timezone' in line:
+            match = TIMEZONE_PATTERN.search(line)
+            if match:
+                found.add('timezone')
+                yield 'timezone', match.group(1)
+
+        if 'mode_and_map' not in found and 'Loading level' in line:
+            match = MODE_AND_MAP_PATTERN.search(line)
+            if match:
+                found.add('mode_and_map')
+                yield 'mode_and_map', match.groups()[::-1]
+
+        if 'start_time_match' not in found and 'Precaching level' in line:
+            match = START_TIME_MATCH_PATTERN.search(line)
+            if match:
+                found.add('start_time_match')
+                yield 'start_time_match', match.group(1)
+
+        if 'end_time_match' not in found and '== Statistics' in line:
+            match = END_TIME_MATCH_PATTERN.search(line)
+            if match:
+                found.add('end_time_match')
+                yield 'end_time_match', match.group(1)
+
+
+def new_log_record():
+    """
+    :return: an empty record of a log file, see parse_log_record
+    """
+    return {
+        'log_start_time': None,
+        'timezone': None,
+        'game_mode': None,
+        'map_name': None,
+        'start_time_match': None,
+        'end_time_match': None,
+        'time_after_last_frag': None,
+        'frags': [],
+    }
+
+
+def new_parser_state():
+    """
+    :return: the state of the parser before the first line of a log file, see feed_log_record
+    """
+    return {
+        # state of iter_log_events
+        'found': set(),
+        'after_frag': False,
+        'log_start_time_string': None,
+        # Frags found before the header can't be timestamped yet, they are kept aside until then
+        'pending_frags': [],
+        # hour of the last frag and its minute, to detect when the minutes wrap to the next hour
+        'frag_start_time': None,
+        'last_frag_minute': 0,
+    }
+
+
+def feed_log_record(record, parser_state, lines):
+    """
+    Parse the next lines of a log file. The header fields of the record and the parser state are
+    updated in place, the frags are yielded instead of being appended to the record.
+    :param record: record of the log file being parsed, see new_log_record
+    :param parser_state: state of the parser after the previous lines, see new_parser_state
+    :param lines: an iterable of the next lines of the log file
+    :return: a generator of the frags found in these lines, in the format returned by parse_frags
+    """
+    return apply_log_events(record, parser_state, iter_log_events(lines, parser_state))
+
+
+def apply_log_events(record, parser_state, events):
+    """
+    :param record: record of the log file being parsed, see new_log_record
+    :param parser_state: state of the parser, see new_parser_state
+    :param events: an iterable of the events of the log file, see iter_log_events and MappedLog.scan_events
+    :return: a generator of the frags of these events, see feed_log_record
+    """
+    for event, value in events:
+        if event == 'frag':
+            record['time_after_last_frag'] = None
+            if parser_state['frag_start_time'] is None:
+                parser_state['pending_frags'].append(value)
+                continue
+            frag, parser_state['frag_start_time'], parser_state['last_frag_minute'] = stamp_frag(
+                value, parser_state['frag_start_time'], parser_state['last_frag_minute'])
+            yield frag
+        elif event == 'time_after_frag':
+            record['time_after_last_frag'] = value
+        elif event == 'log_start_time':
+            parser_state['log_start_time_string'] = value
+        elif event == 'timezone':
+            record['timezone'] = convert_timezone(value)
+        elif event == 'mode_and_map':
+            record['game_mode'], record['map_name'] = value
+        else:
+            record[event] = value
+
+        if (parser_state['frag_start_time'] is None and parser_state['log_start_time_string']
+                and record['timezone'] is not None):
+            record['log_start_time'] = convert_log_start_time(
+                parser_state['log_start_time_string'], record['timezone'])
+            parser_state['frag_start_time'] = record['log_start_time']
+            for pending_frag in parser_state['pending_frags']:
+                frag, parser_state['frag_start_time'], parser_state['last_frag_minute'] = stamp_frag(
+                    pending_frag, parser_state['frag_start_time'], parser_state['last_frag_minute'])
+                yield frag
+            parser_state['pending_frags'] = []
+
+
+@metrics.timed('parse_log_record')
+def parse_log_record(lines):
+    """
+    Parse a log file in a single pass over its lines.
+    :param lines: an iterable of lines of a log file, as returned by iter_log_lines
+    :return: dictionary describing the match of the log file:
+        {
+            'log_start_time': datetime object with timezone when the log file is created,
+            'timezone': -5,
+            'game_mode': 'FFA',
+            'map_name': 'mp_surf',
+            'start_time_match': '25:18' or None if the game doesn't start,
+            'end_time_match': '53:17' or None if the end of the match is not logged,
+            'time_after_last_frag': '53:19' or None,
+            'frags': list of frags in the format returned by parse_frags
+        }
+    """
+    record = new_log_record()
+    parser_state = new_parser_state()
+    record['frags'] = list(feed_log_record(record, parser_state, metrics.count_items('lines_scanned', lines)))
+    metrics.increment('frags_parsed', len(record['frags']))
+
+    if parser_state['pending_frags']:
+        raise ValueError('Cannot find the log start time and the timezone in the log file')
+
+    return record
+
+
+def parse_log_file(log_file_pathname):
+    """
+    :param log_file_pathname: relative or absolute path to the log file
+    :return: dictionary describing the match of the log file, see parse_log_record.
+        The file is streamed line by line, or mapped in memory and scanned with bytes regexes
+        if it is plain text and has at least MMAP_MIN_FILE_SIZE bytes. It is never loaded in memory
+        as a whole. A compressed log is always streamed, see open_log_file.
+    """
+    if is_mappable_log_file(log_file_pathname):
+        with MappedLog(log_file_pathname) as mapped_log:
+            return parse_mapped_log(mapped_log)
+    return parse_log_record(iter_log_lines(log_file_pathname))
+
+
+def is_mappable_log_file(log_file_pathname):
+    """
+    :param log_file_pathname: relative or absolute path to the log file
+    :return: True if the log is big enough to be mapped in memory rather than streamed, and isn't compressed
+    """
+    return os.path.getsize(log_file_pathname) >= MMAP_MIN_FILE_SIZE and get_log_compression(log_file_pathname) is None
+
+
+@metrics.timed('parse_mapped_log')
+def parse_mapped_log(mapped_log):
+    """
+    Parse a log file mapped in memory with bytes regexes, only the fields of the matched lines are decoded.
+    :param mapped_log: a MappedLog, see map_log_file
+    :return: dictionary describing the match of the log file, see parse_log_record
+    """
+    record = new_log_record()
+    parser_state = new_parser_state()
+    record['frags'] = list(apply_log_events(record, parser_state, mapped_log.scan_events()))
+    metrics.increment('frags_parsed', len(record['frags']))
 
-        pattern = r"\(g_timezone,(.*)\)"
-        timezone = re.findall(pattern, log_data)[0]
+    if parser_state['pending_frags']:
+        raise ValueError('Cannot find the log start time and the timezone in the log file')
 
-        return int(timezone)
-    except ValueError:
+    return record
+
+
+@metrics.timed('parse_log_frag_table')
+def parse_log_frag_table(log_file_pathname, frag_table=None, match_id=None):
+    """
+    Stream the frags of a log file into a columnar FragTable, without building the list of frag tuples.
+    :param log_file_pathname: relative or absolute path to the log file
+    :param frag_table: the FragTable to append the frags to, a new one if None
+    :param match_id: identifier of the match of the log in the table, defaults to log_file_pathname
+    :return: a tuple (record, frag_table) where record is the record of the log file without its frags,
+             see parse_log_record
+    """
+    if frag_table is None:
+        frag_table = FragTable()
+    if match_id is None:
+        match_id = log_file_pathname
+
+    record = new_log_record()
+    parser_state = new_parser_state()
+    frag_count = len(frag_table)
+    if is_mappable_log_file(log_file_pathname):
+        with MappedLog(log_file_pathname) as mapped_log:
+            frag_table.extend(apply_log_events(record, parser_state, mapped_log.scan_events()), match_id)
+    else:
+        lines = metrics.count_items('lines_scanned', iter_log_lines(log_file_pathname))
+        frag_table.extend(feed_log_record(record, parser_state, lines), match_id)
+    metrics.increment('frags_parsed', len(frag_table) - frag_count)
+
+    if parser_state['pending_frags']:
+        raise ValueError('Cannot find the log start time and the timezone in the log file')
+
+    return record, frag_table
+
+
+def find_log_events(log_data, event_names):
+    """
+    :param log_data: string content of log file, or a MappedLog
+    :param event_names: names of the header events to look for, see iter_log_events
+    :return: dictionary of the value of the first occurrence of each event found.
+        The scan stops as soon as all the events have been found.
+    """
+    if isinstance(log_data, MappedLog):
+        return log_data.find_header_events(event_names)
+    values = {}
+    lines = metrics.count_items('lines_scanned', iter_log_data_lines(log_data))
+    for event, value in iter_log_events(lines):
+        if event in event_names and event not in values:
+            values[event] = value
+            if len(values) == len(event_names):
+                break
+    return values
+
+
+def convert_timezone(timezone_string):
+    """
+    :param timezone_string: the timezone as written in the log file, example: '-5'
+    :return: the number of the time zone, or None if it is not a number
+    """
+    try:
+        return int(timezone_string)
+    except (TypeError, ValueError):
+        metrics.increment('errors', stage='convert_timezone')
         print('Can not find the timezone in log file')
 
 
+def convert_log_start_time(time_string, time_zone):
+    """
+    :param time_string: log start time as written in the log file: 'Friday, November 09, 2018 12:22:07'
+    :param time_zone: the number of the time zone
+    :return: a datetime object with timezone
+    """
+    if time_string is None:
+        raise ValueError('Cannot find the log start time in the log file')
+
+    format_time = '%A, %B %d, %Y %H:%M:%S'
+    timestamp = datetime.strptime(time_string, format_time)
+
+    # Update timestamp with timezone and return
+    return timestamp.replace(tzinfo=timezone(timedelta(hours=time_zone)))
+
+
+def get_timezone(log_data):
+    """
+    :param log_data: string content of log file
+    :return: the number of time zone in string format
+        example:
+            >>>get_timezone(log_data)
+            -5
+    """
+    return convert_timezone(find_log_events(log_data, {'timezone'}).get('timezone'))
+
+
 def parse_log_start_time(log_data):
     """
     :param log_data: String content read from log file
@@ -55,17 +503,8 @@ def parse_log_start_time(log_data):
         datetime.datetime(2019, 5, 15, 17, 19, 51, 502927,
                           tzinfo=datetime.timezone(datetime.timedelta(-1, 68400)))
     """
-
-    pattern = r"Log Started at (.+)"
-    time_string = re.findall(pattern, log_data)[0]
-
-    format_time = '%A, %B %d, %Y %H:%M:%S'
-    timestamp = datetime.strptime(time_string, format_time)
-
-    time_zone = get_timezone(log_data)
-
-    # Update timestamp with timezone and return
-    return timestamp.replace(tzinfo=timezone(timedelta(hours=time_zone)))
+    events = find_log_events(log_data, {'log_start_time', 'timezone'})
+    return convert_log_start_time(events.get('log_start_time'), convert_timezone(events.get('timezone')))
 
 
 def parse_match_mode_and_map(log_data):
@@ -74,10 +513,9 @@ def parse_match_mode_and_map(log_data):
     :return: a tuple of mode and map of the game session:
         example: (mode, map) = ('FFA', 'mp_surf')
     """
-    pattern = r"-* Loading level Levels/(\w+), mission (\w+) -*"
-    matches = re.findall(pattern, log_data)
-    if matches:
-        return matches[0][::-1]
+    events = find_log_events(log_data, {'mode_and_map'})
+    if events:
+        return events['mode_and_map']
     raise ValueError('Cannot find mode and map in the log file')
 
 
@@ -124,24 +562,36 @@ def add_timezone_to_frag(frags, start_time):
     timezone_frags = []
     last_frag_minute = 0
     for frag in frags:
-        frag_minute, frag_second = list(map(int, frag[0].split(':')))
+        timezone_frag, start_time, last_frag_minute = stamp_frag(frag, start_time, last_frag_minute)
+        timezone_frags.append(timezone_frag)
+
+    return timezone_frags
 
-        # increase time by 1 hour if the minute of timestamp of next frag is smaller than last one.
-        if frag_minute < last_frag_minute:
-            start_time = start_time + timedelta(hours=1)
 
-        # update the last frag minute to compare to next one
-        last_frag_minute = frag_minute
+def stamp_frag(frag, start_time, last_frag_minute):
+    """
+    :param frag: a tupple in format (frag_time, frager_name, victim_name, weapon_code) or (frag_time, frager_name)
+                 where frag_time is a string 'MM:SS'
+    :param start_time: a datetime object of the hour the frag happens in
+    :param last_frag_minute: the minute of the previous frag
+    :return: a tuple (timezone_frag, start_time, last_frag_minute) where timezone_frag is the frag
+             with a datetime object with timezone, and start_time and last_frag_minute are to be
+             passed to the next call.
+    """
+    frag_minute, frag_second = list(map(int, frag[0].split(':')))
 
-        # update string timestamp by datetime object
-        frag_time = start_time.replace(minute=frag_minute, second=frag_second)
-        timezone_frag = [frag_time] + list(frag[1:])
+    # increase time by 1 hour if the minute of timestamp of next frag is smaller than last one.
+    if frag_minute < last_frag_minute:
+        start_time = start_time + timedelta(hours=1)
 
-        timezone_frags.append(tuple(timezone_frag))
+    # update string timestamp by datetime object
+    frag_time = start_time.replace(minute=frag_minute, second=frag_second)
+    timezone_frag = (frag_time,) + tuple(frag[1:])
 
-    return timezone_frags
+    return timezone_frag, start_time, frag_minute
 
 
+@metrics.timed('parse_frags')
 def parse_frags(log_data):
     """
     :param log_data: String content read from log file
@@ -154,12 +604,30 @@ def parse_frags(log_data):
                      tzinfo=datetime.timezone(datetime.timedelta(-1, 68400))),
                      'cyap', 'papazark', 'AG36')]
     """
-    pattern = r"<(.+?)> <Lua> (.+) killed (?:itself|(.+) with (.+))"
-    frags = re.findall(pattern, log_data)
-    clean_frags = remove_empty_elem(frags)
-    start_time = parse_log_start_time(log_data)
-    timezone_frags = add_timezone_to_frag(clean_frags, start_time)
-    return timezone_frags
+    if isinstance(log_data, MappedLog):
+        return parse_mapped_log(log_data)['frags']
+    return parse_log_record(iter_log_data_lines(log_data))['frags']
+
+
+def iter_pretty_frags(frags):
+    """
+    :param frags: an iterable of frags in the format returned by parse_frags, it is only iterated once
+    :return: a generator of the prettyfied frags, in the format returned by prettify_frags.
+             A weapon without icon is rendered with UNKNOWN_WEAPON_ICON.
+    """
+    # Frags come in chronological order and several of them often share the same second:
+    # the timestamp is only formatted again when the time changes
+    frag_time = None
+    timestamp = None
+    for frag in frags:
+        if frag[0] != frag_time or frag[0].tzinfo is not frag_time.tzinfo:
+            frag_time = frag[0]
+            timestamp = '[' + frag_time.isoformat(' ') + ']'
+        if len(frag) > 2:
+            yield ' '.join([timestamp, KILLER_ICON, frag[1], WEAPON_ICON.get(frag[3], UNKNOWN_WEAPON_ICON),
+                            VICTIM_ICON, frag[2]])
+        else:
+            yield ' '.join([timestamp, VICTIM_ICON, frag[1], SUICIDE_ICON])
 
 
 def prettify_frags(frags):
@@ -180,37 +648,47 @@ def prettify_frags(frags):
                  '[2019-03-01 16:24:48-05:00] 😛 cynthia 🔫 😦 cyap',
                  '[2019-03-01 16:25:06-05:00] 😛 cyap 🔫 😦 cynthia',
                 ]
+        For the frags of a whole season, see iter_pretty_frags and write_pretty_frags.
     """
+    return list(iter_pretty_frags(frags))
 
-    WEAPON_ICON = {}
-    WEAPON_ICON.update(dict.fromkeys(['Vehicle'], '🚙'))
-    WEAPON_ICON.update(dict.fromkeys([
-        'Falcon', 'Shotgun', 'P90', 'MP5', 'M4', 'AG36',
-        'OICW', 'SniperRifle', 'M249', 'VehicleMountedAutoMG', 'VehicleMountedMG', 'MG'], '🔫'))
-    WEAPON_ICON.update(dict.fromkeys(
-        ['HandGrenade', 'AG36Grenade', 'OICWGrenade', 'StickyExplosive'], '💣'))
-    WEAPON_ICON.update(dict.fromkeys(
-        ['Rocket', 'VehicleMountedRocketMG', 'VehicleRocket'], '🚀'))
-    WEAPON_ICON.update(dict.fromkeys(['Machete'], '🔪'))
-    WEAPON_ICON.update(dict.fromkeys(['Boat'], '🚤'))
 
-    KILLER_ICON = '😛'
-    VICTIM_ICON = '😦'
-    SUICIDE_ICON = '☠'
+def iter_pretty_frag_chunks(frags, chunk_lines=PRETTY_FRAG_CHUNK_LINES):
+    """
+    :param frags: an iterable of frags in the format returned by parse_frags
+    :param chunk_lines: number of prettyfied frags per chunk
+    :return: a generator of strings of at most chunk_lines prettyfied frags, each one followed by a new line
+    """
+    lines = iter_pretty_frags(frags)
+    while True:
+        chunk = list(islice(lines, chunk_lines))
+        if not chunk:
+            return
+        chunk.append('')
+        yield '\n'.join(chunk)
 
-    pretty_frags = []
 
-    for frag in frags:
-        timestamp = '[' + frag[0].isoformat(' ') + ']'
-        if len(frag) > 2:
-            frag_string = ' '.join(
-                [timestamp, KILLER_ICON, frag[1], WEAPON_ICON[frag[3]], VICTIM_ICON, frag[2]])
+def write_pretty_frags(frags, output, chunk_lines=PRETTY_FRAG_CHUNK_LINES, encoding='utf-8'):
+    """
+    Write the prettyfied frags, one per line, without building the list of all of them.
+    :param frags: an iterable of frags in the format returned by parse_frags
+    :param output: a text file, a binary file or a socket
+    :param chunk_lines: number of prettyfied frags written at once
+    :param encoding: encoding of the prettyfied frags written to binary files and sockets
+    :return: number of frags written
+    """
+    is_socket = hasattr(output, 'sendall')
+    encode = is_socket or not isinstance(output, io.TextIOBase)
+
+    frag_count = 0
+    for chunk in iter_pretty_frag_chunks(frags, chunk_lines):
+        data = chunk.encode(encoding) if encode else chunk
+        if is_socket:
+            output.sendall(data)
         else:
-            frag_string = ' '.join(
-                [timestamp, VICTIM_ICON, frag[1], SUICIDE_ICON])
-        pretty_frags.append(frag_string)
-
-    return pretty_frags
+            output.write(data)
+        frag_count += chunk.count('\n')
+    return frag_count
 
 
 def get_time_after_last_frag(log_data, last_frag):
@@ -221,21 +699,19 @@ def get_time_after_last_frag(log_data, last_frag):
                      weapon_code) or (frag_time, frager_name)
     :return: time after last frag in string format: '00:09'
     """
-    list_log_data = log_data.split('\n')
+    lines = iter_log_data_lines(log_data)
 
     last_frag_time = ':'.join(
         list(map(str, [last_frag[0].minute, last_frag[0].second])))
     last_frag_frager = last_frag[1]
 
-    i = 0
-    # Determine index of last frag in log data
-    for line in list_log_data:
+    # Determine the line of last frag in log data
+    for line in lines:
         if last_frag_time in line and last_frag_frager in line:
             break
-        i += 1
 
     # Get time after last frag
-    time_after_last_frag = re.findall(r"^<(.{5})>", list_log_data[i+1])[0]
+    time_after_last_frag = LINE_TIME_PATTERN.findall(next(lines, ''))[0]
 
     return time_after_last_frag
 
@@ -245,10 +721,7 @@ def get_start_time_match(log_data):
     :param log_data: String content read from log file
     :return: Start time in format of: 'HH:MM'. Ex: '24:19'
     """
-    try:
-        return re.findall(r"Precaching level ... <(.+?)> done", log_data)[0]
-    except IndexError:
-        return 'Start time not found'
+    return find_log_events(log_data, {'start_time_match'}).get('start_time_match', 'Start time not found')
 
 
 def get_end_time_match(log_data):
@@ -256,12 +729,10 @@ def get_end_time_match(log_data):
     :param log_data: String content read from log file
     :return: End time in format of: 'HH:MM'. Ex: '24:19'
     """
-    try:
-        return re.findall(r"<(.+?)> == Statistics", log_data)[0]
-    except IndexError:
-        return 'End time not found'
+    return find_log_events(log_data, {'end_time_match'}).get('end_time_match', 'End time not found')
 
 
+@metrics.timed('parse_game_session_start_and_end_times')
 def parse_game_session_start_and_end_times(log_data, frags):
     """
     :param log_data: String content read of log file
@@ -281,17 +752,45 @@ def parse_game_session_start_and_end_times(log_data, frags):
                 (datetime.datetime(2018, 11, 9, 13, 53, 19, tzinfo=datetime.timezone(datetime.timedelta(-1, 68400)))
     """
 
-    start_time_match = get_start_time_match(log_data)
+    events = find_log_events(log_data, {'start_time_match', 'end_time_match'})
     # If Start time cannot be found, log file don't have game session time data
-    if 'Start time not found' in start_time_match:
+    if 'start_time_match' not in events:
         return "game doesn't start"
-    start_time_minute, start_time_second = list(
-        map(int, start_time_match.split(':')))
 
-    end_time_match = get_end_time_match(log_data)
+    end_time_match = events.get('end_time_match')
     # If cannot find the time when the match end, use the time after the last frags instead
-    if 'End time not found' in end_time_match:
+    if end_time_match is None:
         end_time_match = get_time_after_last_frag(log_data, frags[-1])
+
+    return calculate_game_session_times(events['start_time_match'], end_time_match, frags)
+
+
+def parse_record_game_session_times(record):
+    """
+    :param record: dictionary describing the match of a log file, as returned by parse_log_record
+    :return: start and end time of game session in datetime object format, see
+             parse_game_session_start_and_end_times
+    """
+    if record['start_time_match'] is None:
+        return "game doesn't start"
+
+    end_time_match = record['end_time_match']
+    # If cannot find the time when the match end, use the time after the last frags instead
+    if end_time_match is None:
+        end_time_match = record['time_after_last_frag']
+
+    return calculate_game_session_times(record['start_time_match'], end_time_match, record['frags'])
+
+
+def calculate_game_session_times(start_time_match, end_time_match, frags):
+    """
+    :param start_time_match: start time of the match in format 'MM:SS'
+    :param end_time_match: end time of the match in format 'MM:SS'
+    :param frags: List of tupple of frags of the game session, see parse_frags
+    :return: start and end time of game session in datetime object format
+    """
+    start_time_minute, start_time_second = list(
+        map(int, start_time_match.split(':')))
     end_time_minute, end_time_second = list(
         map(int, end_time_match.split(':')))
 
@@ -338,7 +837,10 @@ def write_frag_csv_file(log_file_pathname, frags):
         raise
 
 
-def insert_match_to_sqlite(file_pathname, start_time, end_time, game_mode, map_name, frags):
+@metrics.timed('insert_match_to_sqlite')
+def insert_match_to_sqlite(file_pathname, start_time, end_time, game_mode, map_name, frags,
+                           batch_size=FRAG_BATCH_SIZE, journal_mode=None, synchronous=None,
+                           content_hash=None, log_file_pathname=None, on_duplicate='skip'):
     """
     :param file_pathname:  the path and name of the Far Cry's SQLite database
     :param start_time: a datetime.datetime object with time zone information corresponding to the start of the game session.
@@ -357,32 +859,43 @@ def insert_match_to_sqlite(file_pathname, start_time, end_time, game_mode, map_n
                 killer_name (required): username of the player who fragged another or killed himself;
                 victim_name (optional): username of the player who has been fragged;
                 weapon_code (optional): code of the weapon that was used to frag.
+    :param batch_size: number of frags sent to the database in each executemany call.
+    :param journal_mode: optional sqlite journal mode to set before inserting, example: 'WAL'.
+    :param synchronous: optional sqlite synchronous setting to set before inserting, example: 'NORMAL'.
+    :param content_hash: optional hash of the log file of the match, see hash_log_file.
+    :param log_file_pathname: optional path of the log file of the match.
+    :param on_duplicate: what to do when the match has already been ingested, from a log with the same
+                    content hash or with the same start time, game mode and map:
+                    - 'skip': keep the match in the database and return its identifier;
+                    - 'replace': delete it and its frags and insert this one, for corrected logs.
     :return: the identifier of the match that has been inserted.
     """
-    connection = create_connection(file_pathname)
-    match = (start_time, end_time, game_mode, map_name)
-    match_id = insert_match(connection, match)
-    insert_frags_to_sqlite(connection, match_id, frags)
-    connection.close()
-    return match_id
+    with open_backend('sqlite', file_pathname, batch_size=batch_size, journal_mode=journal_mode,
+                      synchronous=synchronous) as backend:
+        # The match and all its frags are committed in a single transaction
+        return backend.insert_match((start_time, end_time, game_mode, map_name), frags, content_hash,
+                                    log_file_pathname, on_duplicate)
 
 
-def insert_frags_to_sqlite(connection, match_id, frags):
+def insert_frags_to_sqlite(connection, match_id, frags, batch_size=FRAG_BATCH_SIZE):
     """
-    Insert a new frag into the match_frag table
+    Insert the frags of a match into the match_frag table in a single transaction
     :param connection: a sqlite3 Connection object
     :param match_id: the identifier of a match
     :param frags: a list of frags, as passed to the function insert_match_to_sqlite, that occurred during this match.
+    :param batch_size: number of frags sent to the database in each executemany call.
     :return: No return
     """
-    for frag in frags:
-        full_frag = (match_id,) + frag
-        if len(full_frag) < 5:
-            full_frag = full_frag + (None, None,)
-        insert_frag(connection, full_frag)
+    create_match_statistics_table(connection)
+    with connection:
+        insert_frags(connection, build_full_frags(match_id, frags), batch_size)
+        update_match_statistics(connection, match_id, frags)
+    invalidate_match(match_id)
 
 
-def insert_match_to_postgresql(properties, start_time, end_time, game_mode, map_name, frags):
+@metrics.timed('insert_match_to_postgresql')
+def insert_match_to_postgresql(properties, start_time, end_time, game_mode, map_name, frags, method='copy',
+                               content_hash=None, log_file_pathname=None, on_duplicate='skip'):
     """
     :param properties: a tuple of the following form: (hostname, database_name, username, password). Where:
         hostname: hostname of the PosgtreSQL server to connect to;
@@ -398,15 +911,20 @@ def insert_match_to_postgresql(properties, start_time, end_time, game_mode, map_
         killer_name (required): username of the player who fragged another or killed himself;
         victim_name (optional): username of the player who has been fragged;
         weapon_code (optional): code of the weapon that was used to frag.
+    :param method: how frags are sent to the server: 'copy' (COPY FROM STDIN), 'values' (execute_values)
+        or 'row' (one INSERT per frag).
+    :param content_hash: optional hash of the log file of the match, see hash_log_file.
+    :param log_file_pathname: optional path of the log file of the match.
+    :param on_duplicate: 'skip' or 'replace' the match if it has already been ingested, see insert_match_to_sqlite.
+    :return: the uuid identifier of the match that has been inserted.
     """
-    connection = create_postgres_connection(properties)
-    match = (start_time, end_time, game_mode, map_name)
-    match_id = insert_match_postgres(connection, match)
-    insert_frag_postgres(connection, match_id, frags)
-    connection.close()
-    return match_id
+    # Connections are borrowed from a pool shared by all the matches inserted with these properties
+    with open_backend('postgres', properties, method=method) as backend:
+        return backend.insert_match((start_time, end_time, game_mode, map_name), frags, content_hash,
+                                    log_file_pathname, on_duplicate)
 
 
+@metrics.timed('calculate_serial_killers')
 def calculate_serial_killers(frags):
     """
     :param frags: A list of tuple in format of:
@@ -447,6 +965,7 @@ def calculate_serial_killers(frags):
     return serial_killers
 
 
+@metrics.timed('calculate_serial_losers')
 def calculate_serial_losers(frags):
     """
     :param frags: A list of tuple in format of:
@@ -487,23 +1006,624 @@ def calculate_serial_losers(frags):
     return serial_losers
 
 
+@metrics.timed('calculate_lucky_luke_killers')
+def calculate_lucky_luke_killers(frags, min_kill_count=3, max_time_between_kills=10):
+    """
+    Lucky Luke killers kill faster than their shadow: a series of kills of a player lasts as long as
+    each kill comes at most max_time_between_kills seconds after the previous kill of the player.
+    The frags are walked once, only the current and the longest series of each player are kept.
+    :param frags: A list of tuple in format of:
+        [(frag_time_datetime_object, frager_name, victim_name,
+          weapon_code) or (frag_time, frager_name),...] sorted by frag time. Suicides are not kills.
+    :param min_kill_count: minimum number of kills of the longest series of a player
+    :param max_time_between_kills: maximum number of seconds between two kills of the same series
+    :return: dictionary of the players whose longest series has at least min_kill_count kills,
+             with the kills of this series (the first one if several are as long). The length of each
+             series is the kill_count of utilities.statistics_util.LUCKY_LUKE_QUERY for the match:
+        {
+            player_name: [
+                (frag_time, victim_name, weapon_code),
+                ...
+            ],
+            ...
+        }
+    """
+    current_series = {}
+    longest_series = {}
+    for frag in frags:
+        if len(frag) < 4:
+            continue
+        frag_time, killer_name, victim_name, weapon_code = frag
+        series = current_series.get(killer_name)
+        if series is None or (frag_time - series[-1][0]).total_seconds() > max_time_between_kills:
+            series = current_series[killer_name] = []
+        series.append((frag_time, victim_name, weapon_code))
+        if len(series) > len(longest_series.get(killer_name, ())):
+            longest_series[killer_name] = series
+    return {killer_name: series for killer_name, series in longest_series.items()
+            if len(series) >= min_kill_count}
+
+
+def calculate_serial_killers_by_match(frag_table):
+    """
+    Same as calculate_serial_killers, for all the matches of a FragTable at once. With numpy installed,
+    the series are found with array operations over the whole table, otherwise the frags are walked once
+    through its integer columns, see utilities.streak_util.find_longest_series.
+    Only the longest series are built as tuples.
+    :param frag_table: a FragTable of the frags of one or many matches
+    :return: dictionary of the serial killers of each match:
+        {
+            match_id: {
+                player_name: [(frag_time, victim_name, weapon_code), ...],
+                ...
+            },
+            ...
+        }
+    """
+    serial_killers_by_match = {}
+    for match_id, longest_series in find_longest_series(frag_table).items():
+        serial_killers_by_match[match_id] = {
+            frag_table.names[killer_code]: [
+                (frag_table.frag_datetime(index), frag_table.names[frag_table.victim_codes[index]],
+                 frag_table.weapons[frag_table.weapon_codes[index]])
+                for index in indices
+            ]
+            for killer_code, indices in longest_series.items()
+        }
+    return serial_killers_by_match
+
+
+def calculate_serial_losers_by_match(frag_table):
+    """
+    Same as calculate_serial_losers, for all the matches of a FragTable at once, see
+    calculate_serial_killers_by_match.
+    :param frag_table: a FragTable of the frags of one or many matches
+    :return: dictionary of the serial losers of each match:
+        {
+            match_id: {
+                player_name: [(frag_time, killer_name, weapon_code), ...],
+                ...
+            },
+            ...
+        }
+    """
+    serial_losers_by_match = {}
+    for match_id, longest_series in find_longest_series(frag_table, losers=True).items():
+        serial_losers = {}
+        for victim_code, indices in longest_series.items():
+            lose_series = []
+            for index in indices:
+                if frag_table.suicides[index]:
+                    # A suicide starts the series it belongs to, as in calculate_serial_losers
+                    lose_series.append((frag_table.frag_datetime(index), frag_table.names[victim_code]))
+                else:
+                    lose_series.append((frag_table.frag_datetime(index),
+                                        frag_table.names[frag_table.killer_codes[index]],
+                                        frag_table.weapons[frag_table.weapon_codes[index]]))
+            serial_losers[frag_table.names[victim_code]] = lose_series
+        serial_losers_by_match[match_id] = serial_losers
+    return serial_losers_by_match
+
+
+def find_log_files(paths):
+    """
+    :param paths: list of log files, directories of log files or glob patterns.
+                  example: ['./logs', './archive/2019-*/log*.txt.gz']
+    :return: sorted list of the log files pathnames, without duplicates. The log files of a directory
+             are its plain text and compressed logs, see LOG_FILE_PATTERNS
+    """
+    log_file_pathnames = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in LOG_FILE_PATTERNS:
+                log_file_pathnames.update(glob.glob(os.path.join(path, pattern)))
+        elif os.path.isfile(path):
+            log_file_pathnames.add(path)
+        else:
+            log_file_pathnames.update(glob.glob(path))
+    return sorted(log_file_pathnames)
+
+
+def hash_log_file(log_file_pathname, block_size=1 << 20):
+    """
+    :param log_file_pathname: relative or absolute path to the log file
+    :param block_size: number of bytes read at once
+    :return: the SHA-256 hex digest of the content of the log file. The decompressed content of a compressed
+             log is hashed, so a log and its compressed archive have the same hash and are ingested once
+    """
+    digest = hashlib.sha256()
+    with open_log_file(log_file_pathname, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def init_ingestion_worker(ingested_log_hashes, metrics_enabled=False):
+    """
+    Initialize an ingestion worker process with the content hashes of the logs already ingested
+    :param ingested_log_hashes: set of content hashes, see hash_log_file
+    :param metrics_enabled: True to record the metrics of the parsing in the worker, they are
+                            sent back to the writer with each result, see parse_log_for_ingestion
+    """
+    global INGESTED_LOG_HASHES
+    INGESTED_LOG_HASHES = frozenset(ingested_log_hashes)
+    if metrics_enabled:
+        metrics.enable_metrics()
+
+
+def parse_log_for_ingestion(log_file_pathname):
+    """
+    Parse a log file in a worker process. Logs whose content hash is in INGESTED_LOG_HASHES
+    are not parsed at all.
+    :param log_file_pathname: relative or absolute path to the log file
+    :return: dictionary of the parsed match:
+        {
+            'log_file_pathname': log_file_pathname,
+            'content_hash': hash of the content of the log file,
+            'skipped': True if the log has already been ingested,
+            'match': (start_time, end_time, game_mode, map_name) or None if the log can't be parsed,
+            'frags': list of frags,
+            'parse_seconds': time spent parsing the log,
+            'error': None or the description of the error that prevented parsing the log,
+            'metrics': metrics recorded while parsing the log, see metrics.collect, or None if disabled
+        }
+    """
+    start = time.perf_counter()
+    result = {'log_file_pathname': log_file_pathname, 'content_hash': None, 'skipped': False,
+              'match': None, 'frags': [], 'error': None}
+    try:
+        result['content_hash'] = hash_log_file(log_file_pathname)
+        if result['content_hash'] in INGESTED_LOG_HASHES:
+            result['skipped'] = True
+            result['parse_seconds'] = time.perf_counter() - start
+            result['metrics'] = metrics.collect() if metrics.is_enabled() else None
+            return result
+        record = parse_log_file(log_file_pathname)
+        session_times = parse_record_game_session_times(record)
+        if isinstance(session_times, str):
+            raise ValueError(session_times)
+        result['match'] = session_times + (record['game_mode'], record['map_name'])
+        result['frags'] = record['frags']
+    except Exception as error:
+        metrics.increment('errors', stage='parse_log_for_ingestion')
+        result['error'] = repr(error)
+    result['parse_seconds'] = time.perf_counter() - start
+    result['metrics'] = metrics.collect() if metrics.is_enabled() else None
+    return result
+
+
+def ingest_logs(log_file_pathnames, sqlite_pathname=None, postgres_properties=None, workers=None,
+                batch_size=None, journal_mode=None, synchronous=None, on_duplicate='skip',
+                report=print, parquet_directory=None, backend=None):
+    """
+    Parse log files in parallel worker processes and insert their matches from a single writer,
+    so the database is never written by two processes at the same time.
+    :param log_file_pathnames: list of log files pathnames, see find_log_files
+    :param sqlite_pathname: the path and name of the Far Cry's SQLite database to write into
+    :param postgres_properties: a tuple (hostname, database_name, username, password) of the
+                                PostgreSQL database to write into
+    :param workers: number of worker processes, defaults to the number of cores of the host
+    :param batch_size: number of frags sent to the database in each statement, the default of the backend if None
+    :param journal_mode: optional sqlite journal mode, see insert_match_to_sqlite
+    :param synchronous: optional sqlite synchronous setting, see insert_match_to_sqlite
+    :param on_duplicate: 'skip' the logs already ingested without parsing them again,
+                         or 'replace' their matches, see insert_match_to_sqlite
+    :param report: function called with a line of text for each ingested or failed log and each new attempt
+    :param parquet_directory: directory where the frags and matches are also exported as Parquet files,
+                              see export_match_parquet. Without database, the logs already exported
+                              are the ones skipped.
+    :param backend: an opened StorageBackend to write into instead of the SQLite or PostgreSQL database,
+                    example: open_backend('memory'), see utilities.backends. It is left open.
+    :return: list of the results of parse_log_for_ingestion, each one with two more keys:
+             'match_id' (None if the match hasn't been inserted) and 'insert_seconds'.
+             'skipped' is also True when the database already holds the match of a log with another hash,
+             'match_id' is then the one of that match. 'frags' is replaced by the number of frags written,
+             0 for the skipped and failed logs.
+    """
+    # Only imported by the runs ingesting logs: multiprocessing takes a large part of the import of this module
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    opened_backend = None
+    if backend is None and sqlite_pathname:
+        backend = opened_backend = open_backend('sqlite', sqlite_pathname, batch_size=batch_size,
+                                                journal_mode=journal_mode, synchronous=synchronous)
+    elif backend is None and postgres_properties is not None:
+        backend = opened_backend = open_backend('postgres', postgres_properties, batch_size=batch_size)
+
+    ingested_log_hashes = set()
+    if on_duplicate == 'skip':
+        if backend is not None:
+            ingested_log_hashes = backend.get_ingested_log_hashes()
+        elif parquet_directory is not None:
+            ingested_log_hashes = get_exported_log_hashes(parquet_directory)
+
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=init_ingestion_worker,
+                                 initargs=(ingested_log_hashes, metrics.is_enabled())) as executor:
+            futures = [executor.submit(parse_log_for_ingestion, log_file_pathname)
+                       for log_file_pathname in log_file_pathnames]
+            for future in as_completed(futures):
+                result = future.result()
+                metrics.merge(result.pop('metrics'))
+                result['match_id'] = None
+                start = time.perf_counter()
+                try:
+                    if result['skipped'] or result['error'] is not None:
+                        pass
+                    elif backend is not None:
+                        # A log with another hash may still hold a match already ingested, with the same
+                        # start time, game mode and map: the database skips it then
+                        result['match_id'], status = backend.ingest_match(
+                            result['match'], result['frags'], result['content_hash'], result['log_file_pathname'],
+                            on_duplicate, report)
+                        if status == 'skipped':
+                            result['skipped'] = True
+                        elif status == 'failed':
+                            result['error'] = 'the database rejected the match'
+                    if parquet_directory is not None and not result['skipped'] and result['error'] is None:
+                        export_match_parquet(parquet_directory, result['content_hash'], result['match'],
+                                             result['frags'], result['match_id'], result['log_file_pathname'])
+                except Exception as error:
+                    result['error'] = repr(error)
+                result['insert_seconds'] = time.perf_counter() - start
+                metrics.increment('logs_ingested', status='skipped' if result['skipped'] else
+                                  'failed' if result['error'] is not None else 'parsed')
+
+                if result['skipped']:
+                    report('%s: already ingested, skipped' % result['log_file_pathname'])
+                elif result['error'] is None:
+                    report('%s: %d frags, parsed in %.3fs, inserted in %.3fs, match_id %s' % (
+                        result['log_file_pathname'], len(result['frags']), result['parse_seconds'],
+                        result['insert_seconds'], result['match_id']))
+                else:
+                    report('%s: failed after %.3fs: %s' % (
+                        result['log_file_pathname'], result['parse_seconds'] + result['insert_seconds'],
+                        result['error']))
+                # The frags are in the database now, don't keep them for the whole run. Only the ones written
+                # are counted: the frags of a log skipped or rejected by the database are not
+                written = not result['skipped'] and result['error'] is None
+                result['frags'] = len(result['frags']) if written else 0
+                results.append(result)
+    finally:
+        if opened_backend is not None:
+            opened_backend.close()
+
+    return results
+
+
+def new_follow_state():
+    """
+    :return: the state of a followed log file before its first line, see follow_log_file
+    """
+    return {
+        'offset': 0,
+        'match_id': None,
+        'first_frag_time': None,
+        'last_frag_time': None,
+        'record': new_log_record(),
+        'parser': new_parser_state(),
+    }
+
+
+def dump_follow_state(state):
+    """
+    :param state: state of a followed log file, see new_follow_state
+    :return: the state in JSON format, to be saved as checkpoint
+    """
+    def dump_time(value):
+        return value.isoformat() if value is not None else None
+
+    record = dict(state['record'], frags=[], log_start_time=dump_time(state['record']['log_start_time']))
+    parser = dict(state['parser'], found=sorted(state['parser']['found']),
+                  frag_start_time=dump_time(state['parser']['frag_start_time']))
+    return json.dumps(dict(state, record=record, parser=parser,
+                           first_frag_time=dump_time(state['first_frag_time']),
+                           last_frag_time=dump_time(state['last_frag_time'])))
+
+
+def load_follow_state(checkpoint):
+    """
+    :param checkpoint: state of a followed log file in JSON format, as returned by dump_follow_state
+    :return: the state of the followed log file
+    """
+    def load_time(value):
+        return datetime.fromisoformat(value) if value is not None else None
+
+    state = json.loads(checkpoint)
+    state['first_frag_time'] = load_time(state['first_frag_time'])
+    state['last_frag_time'] = load_time(state['last_frag_time'])
+    state['record']['log_start_time'] = load_time(state['record']['log_start_time'])
+    state['parser']['found'] = set(state['parser']['found'])
+    state['parser']['frag_start_time'] = load_time(state['parser']['frag_start_time'])
+    state['parser']['pending_frags'] = [tuple(frag) for frag in state['parser']['pending_frags']]
+    return state
+
+
+def iter_appended_log_lines(log_file_pathname, state, max_lines=FOLLOW_CHUNK_LINES):
+    """
+    :param log_file_pathname: path of the followed log file
+    :param state: state of the followed log file, its offset is moved past every line read
+    :param max_lines: maximum number of lines read
+    :return: a generator of the complete lines appended to the log file after the offset of the state.
+             A last line without its new line is still being written by the server, it is left for later.
+    """
+    with open(log_file_pathname, 'rb') as file:
+        file.seek(state['offset'])
+        for _ in range(max_lines):
+            raw_line = file.readline()
+            if not raw_line.endswith(b'\n'):
+                break
+            state['offset'] += len(raw_line)
+            yield from split_raw_log_line(raw_line)
+
+
+def split_raw_log_line(raw_line):
+    """
+    :param raw_line: bytes of a line of a log file, ending with its new line
+    :return: list of the lines it holds, decoded and without their new line. Same as reading the file
+             in text mode: a lone carriage return also ends a line
+    """
+    line = raw_line.decode()
+    line = line[:-2] if line.endswith('\r\n') else line[:-1]
+    return line.split('\r')
+
+
+def calculate_follow_match_times(state):
+    """
+    :param state: state of a followed log file that has frags
+    :return: start and end time of the game session so far. Until the end of the match is logged,
+             the end time is the time after the last frag, as for parse_record_game_session_times.
+    """
+    record = state['record']
+    start_time_match = record['start_time_match'] or state['first_frag_time'].strftime('%M:%S')
+    end_time_match = (record['end_time_match'] or record['time_after_last_frag']
+                      or state['last_frag_time'].strftime('%M:%S'))
+    frags = [(state['first_frag_time'],), (state['last_frag_time'],)]
+    return calculate_game_session_times(start_time_match, end_time_match, frags)
+
+
+def write_follow_frags(connection, state, frags, log_file_pathname, batch_size=FRAG_BATCH_SIZE):
+    """
+    Commit the frags parsed from the lines appended to a followed log file, the match times and
+    the checkpoint of the log file in the same transaction. The match is created with the first frags.
+    :param connection: connection object of sqlite database, see create_log_checkpoint_table
+    :param state: state of the followed log file after these lines, see new_follow_state
+    :param frags: the frags parsed from these lines
+    :param log_file_pathname: path of the followed log file, key of its checkpoint
+    :param batch_size: number of frags sent to the database in each executemany call
+    """
+    with connection:
+        if frags:
+            state['first_frag_time'] = state['first_frag_time'] or frags[0][0]
+            state['last_frag_time'] = frags[-1][0]
+        if state['first_frag_time'] is not None:
+            start_time, end_time = calculate_follow_match_times(state)
+            if state['match_id'] is None:
+                match = (start_time, end_time, state['record']['game_mode'], state['record']['map_name'])
+                ingested_match_id = find_ingested_match(connection, match)
+                if ingested_match_id is not None:
+                    raise ValueError('%s has already been ingested as match %s' % (
+                        log_file_pathname, ingested_match_id))
+                state['match_id'] = insert_match_row(connection, match)
+                insert_ingested_log(connection, state['match_id'], match,
+                                    log_file_pathname=log_file_pathname)
+            else:
+                update_match_times(connection, state['match_id'], start_time, end_time)
+            insert_frags(connection, build_full_frags(state['match_id'], frags), batch_size)
+            update_match_statistics(connection, state['match_id'], frags)
+        save_log_checkpoint(connection, log_file_pathname, dump_follow_state(state))
+    invalidate_match(state['match_id'])
+
+
+def follow_log_file(log_file_pathname, sqlite_pathname, poll_interval=1.0, idle_timeout=None,
+                    batch_size=FRAG_BATCH_SIZE):
+    """
+    Ingest a log file while the game server is still writing it. Only the lines appended since the
+    last poll are parsed. The frags, the match times and the checkpoint of the log file (byte offset
+    and parser state) are committed in the same transaction, so a follower restarted on the same
+    log resumes where it stopped without inserting any frag twice.
+    :param log_file_pathname: path of the log file to follow
+    :param sqlite_pathname: the path and name of the Far Cry's SQLite database
+    :param poll_interval: seconds to wait before looking for new lines when the end of the log is reached
+    :param idle_timeout: stop after that many seconds without new lines, None to follow forever
+    :param batch_size: number of frags sent to the database in each executemany call
+    :return: a generator of the frags, in the format returned by parse_frags, as soon as they are committed
+    """
+    # The offsets of the checkpoints are positions in the file, a compressed log isn't written line by line anyway
+    if os.path.isfile(log_file_pathname) and get_log_compression(log_file_pathname) is not None:
+        raise ValueError('%s is compressed, only plain text logs can be followed' % log_file_pathname)
+    connection = create_connection(sqlite_pathname)
+    if connection is None:
+        raise ValueError('Cannot open the SQLite database %s' % sqlite_pathname)
+    create_log_checkpoint_table(connection)
+    create_ingested_log_table(connection)
+    create_match_statistics_table(connection)
+    checkpoint = get_log_checkpoint(connection, log_file_pathname)
+    state = load_follow_state(checkpoint) if checkpoint else new_follow_state()
+    idle_since = time.monotonic()
+
+    try:
+        while True:
+            # The log has been truncated or replaced by a new one: this is a new match
+            if os.path.getsize(log_file_pathname) < state['offset']:
+                state = new_follow_state()
+
+            offset = state['offset']
+            lines = metrics.count_items('lines_scanned', iter_appended_log_lines(log_file_pathname, state))
+            frags = list(feed_log_record(state['record'], state['parser'], lines))
+            metrics.increment('bytes_read', state['offset'] - offset)
+            metrics.increment('frags_parsed', len(frags))
+
+            if state['offset'] == offset:
+                if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                    return
+                time.sleep(poll_interval)
+                continue
+            idle_since = time.monotonic()
+
+            write_follow_frags(connection, state, frags, log_file_pathname, batch_size)
+            for frag in frags:
+                yield frag
+    finally:
+        connection.close()
+
+
+def maintain_match_statistics(sqlite_pathname=None, postgres_properties=None, rebuild=False, check=True,
+                              shard_directory=None):
+    """
+    Rebuild and/or check the materialized match statistics, the player index and the frag rollups of a database.
+    :param sqlite_pathname: the path and name of the Far Cry's SQLite database
+    :param postgres_properties: a tuple (hostname, database_name, username, password) of the PostgreSQL database
+    :param rebuild: compute again the statistics of all the matches, the player index and the rollups
+    :param check: compare the statistics with the ones computed by the match_statistics query,
+                  and the player index and the rollups with the rows computed from the frags
+    :param shard_directory: directory of the SQLite databases of each month, see utilities.shard_util,
+                            all of them are rebuilt and/or checked
+    :return: 0 if the statistics are consistent, 1 otherwise
+    """
+    if shard_directory:
+        backend = open_backend('sharded_sqlite', shard_directory)
+    elif sqlite_pathname:
+        backend = open_backend('sqlite', sqlite_pathname)
+    else:
+        backend = open_backend('postgres', postgres_properties)
+    with backend:
+        if rebuild:
+            backend.rebuild_statistics()
+        missing_rows, unexpected_rows = backend.check_statistics() if check else ([], [])
+
+    for row in missing_rows:
+        print('missing: %s' % (row,))
+    for row in unexpected_rows:
+        print('unexpected: %s' % (row,))
+    if check:
+        print('%d missing and %d unexpected statistics rows' % (len(missing_rows), len(unexpected_rows)))
+    return 1 if missing_rows or unexpected_rows else 0
+
+
+def main(argv=None):
+    """
+    Command line entry point: parse log files in parallel and insert them into a database.
+        example:
+        python farcry_data_science.py ./logs --sqlite farcry.db
+        python farcry_data_science.py './archive/*.txt' --postgres localhost,farcry,postgres,secret
+        python farcry_data_science.py ./server/log.txt --sqlite farcry.db --follow
+        python farcry_data_science.py ./logs --sqlite farcry.db --parquet ./export
+        python farcry_data_science.py --sqlite farcry.db --check-statistics
+        python farcry_data_science.py ./logs --shards ./shards
+        python farcry_data_science.py --sqlite farcry.db --shards ./shards --split-database
+    :param argv: list of command line arguments, defaults to sys.argv[1:]
+    :return: exit status, 1 if at least one log failed or if the statistics are not consistent
+    """
+    parser = argparse.ArgumentParser(description='Ingest Far Cry server logs into a database.')
+    parser.add_argument('paths', nargs='*', help='log files, directories of log files or glob patterns')
+    parser.add_argument('--sqlite', help='path of the SQLite database to insert into')
+    parser.add_argument('--postgres', help='hostname,database_name,username,password of the PostgreSQL database')
+    parser.add_argument('--shards', help='directory of the SQLite databases of each month of the matches '
+                                         'to insert into, instead of a single database')
+    parser.add_argument('--split-database', action='store_true',
+                        help='copy the matches of the --sqlite database into the --shards databases of their month')
+    parser.add_argument('--migrate', action='store_true',
+                        help='upgrade the schema of the --sqlite database to the last version, after copying it')
+    parser.add_argument('--workers', type=int, default=None, help='number of parsing processes (default: all cores)')
+    parser.add_argument('--batch-size', type=int, default=None,
+                        help='number of frags sent to the database in each statement (default: per database)')
+    parser.add_argument('--journal-mode', default=None, help='SQLite journal mode, example: WAL')
+    parser.add_argument('--synchronous', default=None, help='SQLite synchronous setting, example: NORMAL')
+    parser.add_argument('--replace', action='store_true',
+                        help='replace the matches of logs already ingested instead of skipping them')
+    parser.add_argument('--follow', action='store_true',
+                        help='follow a single log file while the server writes it (requires --sqlite)')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds between two polls in follow mode')
+    parser.add_argument('--rebuild-statistics', action='store_true',
+                        help='compute again the materialized statistics, player index and rollups from all the frags')
+    parser.add_argument('--check-statistics', action='store_true',
+                        help='compare the materialized statistics, player index and rollups with the frags')
+    parser.add_argument('--parquet', help='directory where the frags and matches are also written as Parquet '
+                                          'files partitioned by match date and map (requires pyarrow)')
+    parser.add_argument('--metrics', action='append', default=[],
+                        help='record the timings and counters of the pipeline and write them at the end: '
+                             'log (stderr), json:PATH or prometheus:PATH, can be repeated')
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        try:
+            metrics.enable_metrics(*[metrics.create_sink(sink) for sink in args.metrics])
+        except ValueError as error:
+            parser.error(str(error))
+    try:
+        return run_command(parser, args)
+    finally:
+        if metrics.is_enabled():
+            metrics.flush_metrics()
+
+
+def run_command(parser, args):
+    """
+    :param parser: parser of the command line, to report usage errors
+    :param args: parsed command line arguments, see main
+    :return: exit status, see main
+    """
+    if args.migrate:
+        if not args.sqlite:
+            parser.error('--migrate needs --sqlite')
+        applied_versions, backup_pathname = migrate_database(args.sqlite)
+        if backup_pathname is not None:
+            print('%s copied to %s' % (args.sqlite, backup_pathname))
+        print('%s: %s' % (args.sqlite, 'migrations %s applied' % ', '.join(map(str, applied_versions))
+                          if applied_versions else 'already at the last version of the schema'))
+        return 0
+    if args.split_database:
+        if not args.sqlite or not args.shards:
+            parser.error('--split-database needs --sqlite and --shards')
+        from utilities.shard_util import split_database
+        split_database(args.sqlite, args.shards)
+        return 0
+    if args.rebuild_statistics or args.check_statistics:
+        return maintain_match_statistics(args.sqlite, tuple(args.postgres.split(',')) if args.postgres else None,
+                                         args.rebuild_statistics, args.check_statistics, args.shards)
+    if not args.paths:
+        parser.error('at least one log file, directory or glob pattern is required')
+
+    if args.follow:
+        if not args.sqlite or len(args.paths) != 1:
+            parser.error('--follow needs exactly one log file and --sqlite')
+        frags = follow_log_file(args.paths[0], args.sqlite, args.poll_interval,
+                                batch_size=args.batch_size or FRAG_BATCH_SIZE)
+        for pretty_frag in iter_pretty_frags(frags):
+            print(pretty_frag)
+        return 0
+
+    if args.parquet:
+        try:
+            import_pyarrow()
+        except ImportError as error:
+            parser.error(str(error))
+
+    postgres_properties = tuple(args.postgres.split(',')) if args.postgres else None
+    log_file_pathnames = find_log_files(args.paths)
+
+    start = time.perf_counter()
+    backend = None
+    if args.shards:
+        if args.sqlite or args.postgres:
+            parser.error('--shards replaces --sqlite and --postgres, use --split-database to split a database')
+        backend = open_backend('sharded_sqlite', args.shards, batch_size=args.batch_size,
+                               journal_mode=args.journal_mode, synchronous=args.synchronous)
+    try:
+        results = ingest_logs(log_file_pathnames, args.sqlite, postgres_properties, args.workers,
+                              args.batch_size, args.journal_mode, args.synchronous,
+                              'replace' if args.replace else 'skip', parquet_directory=args.parquet, backend=backend)
+    finally:
+        if backend is not None:
+            backend.close()
+    failures = [result for result in results if result['error'] is not None]
+    print('%d logs, %d frags, %d failures in %.3fs' % (
+        len(results), sum(result['frags'] for result in results), len(failures),
+        time.perf_counter() - start))
+    return 1 if failures else 0
+
+
 if __name__ == '__main__':
-    log_file_content = read_log_file('./logs/log00.txt')
-    frags = parse_frags(log_file_content)
-    # start_time, end_time = parse_game_session_start_and_end_times(
-    #     log_file_content, frags)
-    # game_mode, map_name = parse_match_mode_and_map(log_file_content)
-    # properties = ('localhost', 'farcry', 'postgres', 'linh3lan')
-    # match_id = insert_match_to_postgresql(
-    #     properties, start_time, end_time, game_mode, map_name, frags)
-    # print(match_id)
-    # serial_killers = calculate_serial_killers(frags)
-    # for player_name, kill_series in serial_killers.items():
-    #     print('[%s]' % player_name)
-    #     print('\n'.join([', '.join(([str(e) for e in kill]))
-    #         for kill in kill_series]))
-    serial_losers = calculate_serial_losers(frags)
-    for player_name, lose_series in serial_losers.items():
-        print('[%s]' % player_name)
-        print('\n'.join([', '.join(([str(e) for e in kill]))
-            for kill in lose_series]))
+    sys.exit(main())
@@ -0,0 +1,193 @@
+from array import array
+from itertools import chain, groupby
+from datetime import datetime, timezone, timedelta
+
+
+class FragTable:
+    """
+    Columnar store of frags. Every frag takes a few bytes in typed arrays instead of a tuple
+    holding a datetime object and its own strings:
+        - frag_times: frag time in seconds since the epoch (int64);
+        - utc_offsets: time zone of the frag time in minutes (int16);
+        - match_codes: code of the match of the frag (int32), see match_ids;
+        - killer_codes, victim_codes: codes of the players (int32), see names;
+        - weapon_codes: code of the weapon (int32), see weapons;
+        - suicides: 1 if the killer killed himself, then victim and weapon codes are NO_CODE (int8).
+    Player names, weapon codes and match ids are interned once in their dictionaries.
+    """
+
+    NO_CODE = -1
+
+    def __init__(self):
+        self.frag_times = array('q')
+        self.utc_offsets = array('h')
+        self.match_codes = array('i')
+        self.killer_codes = array('i')
+        self.victim_codes = array('i')
+        self.weapon_codes = array('i')
+        self.suicides = array('b')
+
+        self.names = []
+        self.weapons = []
+        self.match_ids = []
+        self._name_codes = {}
+        self._weapon_codes = {}
+        self._match_codes = {}
+        self._timezones = {}
+
+    @classmethod
+    def from_frags(cls, frags, match_id=None):
+        """
+        :param frags: an iterable of tuples (frag_time, killer_name[, victim_name, weapon_code]), as returned by parse_frags
+        :param match_id: identifier of the match of the frags
+        :return: a new FragTable of these frags
+        """
+        frag_table = cls()
+        frag_table.extend(frags, match_id)
+        return frag_table
+
+    def __len__(self):
+        return len(self.frag_times)
+
+    def __iter__(self):
+        return self.iter_frags()
+
+    @staticmethod
+    def _intern(value, values, codes):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    def name_code(self, name):
+        """
+        :param name: name of a player
+        :return: code of the player, or NO_CODE if there is no frag of this player
+        """
+        return self._name_codes.get(name, self.NO_CODE)
+
+    def weapon_code(self, weapon):
+        """
+        :param weapon: code of a weapon, example: 'AG36'
+        :return: code of the weapon in the table, or NO_CODE if no frag has been made with it
+        """
+        return self._weapon_codes.get(weapon, self.NO_CODE)
+
+    def match_code(self, match_id):
+        """
+        :param match_id: identifier of a match
+        :return: code of the match in the table, or NO_CODE if there is no frag of this match
+        """
+        return self._match_codes.get(match_id, self.NO_CODE)
+
+    def append(self, frag, match_id=None):
+        """
+        :param frag: a tuple (frag_time, killer_name[, victim_name, weapon_code])
+        :param match_id: identifier of the match of the frag
+        """
+        frag_time = frag[0]
+        self.frag_times.append(int(frag_time.timestamp()))
+        self.utc_offsets.append(int(frag_time.utcoffset().total_seconds()) // 60)
+        self.match_codes.append(self._intern(match_id, self.match_ids, self._match_codes))
+        self.killer_codes.append(self._intern(frag[1], self.names, self._name_codes))
+        if len(frag) > 2:
+            self.victim_codes.append(self._intern(frag[2], self.names, self._name_codes))
+            self.weapon_codes.append(self._intern(frag[3], self.weapons, self._weapon_codes))
+            self.suicides.append(0)
+        else:
+            self.victim_codes.append(self.NO_CODE)
+            self.weapon_codes.append(self.NO_CODE)
+            self.suicides.append(1)
+
+    def extend(self, frags, match_id=None):
+        """
+        :param frags: an iterable of tuples (frag_time, killer_name[, victim_name, weapon_code])
+        :param match_id: identifier of the match of the frags
+        """
+        for frag in frags:
+            self.append(frag, match_id)
+
+    def frag_datetime(self, index):
+        """
+        :param index: index of a frag in the table
+        :return: the frag time as a datetime object with time zone
+        """
+        utc_offset = self.utc_offsets[index]
+        tzinfo = self._timezones.get(utc_offset)
+        if tzinfo is None:
+            tzinfo = self._timezones[utc_offset] = timezone(timedelta(minutes=utc_offset))
+        return datetime.fromtimestamp(self.frag_times[index], tzinfo)
+
+    def frag(self, index):
+        """
+        :param index: index of a frag in the table
+        :return: the frag in the tuple form: (frag_time, killer_name, victim_name, weapon_code)
+                 or (frag_time, killer_name) for a suicide
+        """
+        frag_time = self.frag_datetime(index)
+        if self.suicides[index]:
+            return frag_time, self.names[self.killer_codes[index]]
+        return (frag_time, self.names[self.killer_codes[index]], self.names[self.victim_codes[index]],
+                self.weapons[self.weapon_codes[index]])
+
+    def iter_frags(self, match_id=None):
+        """
+        :param match_id: only yield the frags of this match, or all the frags if None
+        :return: a generator of the frags in the tuple form, in the order they have been added
+        """
+        if match_id is None:
+            for index in range(len(self)):
+                yield self.frag(index)
+            return
+        match_code = self.match_code(match_id)
+        for index, code in enumerate(self.match_codes):
+            if code == match_code:
+                yield self.frag(index)
+
+    def match_indices(self):
+        """
+        :return: dictionary of the indices of the frags of each match, in the order they have been added:
+                 {match_id: indices, ...}, where indices is a range when the frags of the match are
+                 contiguous in the table, as when logs are loaded one after the other, or an array otherwise
+        """
+        runs = {}
+        start = 0
+        for match_code, run in groupby(self.match_codes):
+            end = start + len(list(run))
+            runs.setdefault(match_code, []).append(range(start, end))
+            start = end
+
+        indices = {}
+        for match_code, match_runs in runs.items():
+            if len(match_runs) == 1:
+                indices[self.match_ids[match_code]] = match_runs[0]
+            else:
+                indices[self.match_ids[match_code]] = array('i', chain.from_iterable(match_runs))
+        return indices
+
+    @staticmethod
+    def take(column, indices):
+        """
+        :param column: a column of the table, example: frag_table.killer_codes
+        :param indices: a range or an iterable of indices, see match_indices
+        :return: an array of the values of the column at these indices
+        """
+        if isinstance(indices, range) and indices.step == 1:
+            return column[indices.start:indices.stop]
+        return array(column.typecode, (column[index] for index in indices))
+
+    def to_frags(self, match_id=None):
+        """
+        :param match_id: only return the frags of this match, or all the frags if None
+        :return: list of the frags in the tuple form, as returned by parse_frags
+        """
+        return list(self.iter_frags(match_id))
+
+    def nbytes(self):
+        """
+        :return: number of bytes used by the columns of the table, without the dictionaries
+        """
+        columns = (self.frag_times, self.utc_offsets, self.match_codes, self.killer_codes,
+                   self.victim_codes, self.weapon_codes, self.suicides)
+        return sum(column.itemsize * len(column) for column in columns)
@@ -0,0 +1,621 @@
+"""
+Ingestion service: game servers upload their log files, or stream the lines of the log they are
+writing, over HTTP. The logs are parsed in worker processes, off the event loop, and written by a
+single database writer thread that handles the queued writes in batches.
+
+    python ingestion_server.py --sqlite farcry.db --port 8080 --workers 4
+    python ingestion_server.py --postgres localhost,farcry,postgres,secret --port 8080
+
+Endpoints:
+    POST /logs                   body: a whole log file, optional header X-Log-File: name of the log.
+                                 Answers once the match is committed:
+                                 {"match_id": 12, "frags": 155, "content_hash": "..."}
+    POST /streams/<server_id>    body: the bytes appended to the log since the previous request.
+                                 Answers once the complete lines are parsed and queued for writing:
+                                 {"accepted_offset": 5120, "committed_offset": 4096, "frags": 3, "match_id": 12}
+    GET /streams/<server_id>     {"accepted_offset": ..., "committed_offset": ..., "match_id": ...}.
+                                 After a restart of the service, a game server resumes from committed_offset.
+    DELETE /streams/<server_id>  end of the match: the last line is parsed and everything is committed,
+                                 the next lines of the stream start a new match
+    GET /status                  state of the queues of the service
+
+Streams need a SQLite database, as the --follow mode of farcry_data_science.py.
+When the database falls behind, the queue of the writer fills up and the requests wait for a free
+slot before being answered, so the game servers slow down instead of the service buffering everything.
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import os
+import signal
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import unquote
+
+from farcry_data_science import feed_log_record, parse_log_record, parse_record_game_session_times, \
+    split_raw_log_line, new_follow_state, load_follow_state, dump_follow_state, write_follow_frags, \
+    insert_match_to_postgresql
+from utilities import metrics
+from utilities.sqlite_util import create_connection, set_pragmas, insert_match_and_frags, \
+    create_log_checkpoint_table, create_ingested_log_table, create_match_statistics_table, get_log_checkpoint, \
+    save_log_checkpoint, FRAG_BATCH_SIZE
+
+# Uploads and stream chunks larger than that are refused
+MAX_BODY_BYTES = 256 * 1024 * 1024
+
+# Number of writes queued for the database before the requests wait for a free slot
+MAX_PENDING_WRITES = 64
+
+# Maximum number of queued writes handled by the writer at once
+MAX_WRITE_BATCH = 32
+
+# Checkpoints and ingested logs of the streams are named after their server: 'stream:<server_id>'
+STREAM_PREFIX = 'stream:'
+
+HTTP_REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                409: 'Conflict', 411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def parse_uploaded_log(data):
+    """
+    Parse a whole log file in a worker process
+    :param data: bytes of the log file
+    :return: dictionary of the parsed match:
+        {
+            'content_hash': SHA-256 hex digest of the log file, as computed by hash_log_file,
+            'match': (start_time, end_time, game_mode, map_name),
+            'frags': list of frags,
+            'error': None or the description of the error that prevented parsing the log
+        }
+    """
+    result = {'content_hash': hashlib.sha256(data).hexdigest(), 'match': None, 'frags': [], 'error': None}
+    try:
+        # Same lines as when the file is read in text mode, see iter_log_lines
+        lines = (line.rstrip('\n') for line in io.TextIOWrapper(io.BytesIO(data), encoding='utf-8'))
+        record = parse_log_record(lines)
+        session_times = parse_record_game_session_times(record)
+        if isinstance(session_times, str):
+            raise ValueError(session_times)
+        result['match'] = session_times + (record['game_mode'], record['map_name'])
+        result['frags'] = record['frags']
+    except Exception as error:
+        result['error'] = repr(error)
+    return result
+
+
+def parse_stream_lines(record, parser_state, data):
+    """
+    Parse the next lines of a streamed log in a worker process
+    :param record: record of the streamed log, see new_log_record
+    :param parser_state: state of the parser after the previous lines, see new_parser_state
+    :param data: bytes of complete lines, each one ending with a new line
+    :return: a tuple (record, parser_state, frags) after these lines, see feed_log_record
+    """
+    lines = (line for raw_line in io.BytesIO(data) for line in split_raw_log_line(raw_line))
+    frags = list(feed_log_record(record, parser_state, lines))
+    return record, parser_state, frags
+
+
+class DatabaseSink:
+    """
+    Single writer of the database, running in its own thread so the event loop never waits for the database.
+    Writes are queued and handled in batches: everything queued while the previous batch was being written
+    is handled at once, and the chunks of a stream found in the same batch are committed in a single
+    transaction. When MAX_PENDING_WRITES writes are queued, submit waits for the writer to catch up.
+    """
+
+    def __init__(self, sqlite_pathname=None, postgres_properties=None, max_pending=MAX_PENDING_WRITES,
+                 max_batch=MAX_WRITE_BATCH, batch_size=FRAG_BATCH_SIZE, journal_mode=None, synchronous=None,
+                 on_duplicate='skip'):
+        self.sqlite_pathname = sqlite_pathname
+        self.postgres_properties = postgres_properties
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.batch_size = batch_size
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.on_duplicate = on_duplicate
+        self.batch_count = 0
+        self.write_count = 0
+        self._queue = None
+        self._task = None
+        self._connection = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='farcry-writer')
+        # {stream name: state of the stream as committed, see new_follow_state}, only used by the writer thread
+        self._streams = {}
+
+    @property
+    def pending_count(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        self._queue = asyncio.Queue(self.max_pending)
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._open)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close)
+        self._executor.shutdown()
+
+    async def submit(self, kind, *arguments):
+        """
+        Queue a write, waiting for a free slot if the queue is full
+        :param kind: 'match' with arguments (match, frags, content_hash, log_file_pathname), see write_match,
+                     'stream' with arguments (stream name, parse state, frags, end), see write_stream,
+                     or 'reset' with argument (stream name), see reset_stream
+        :return: a future of the result of the write, set once it is committed
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((kind, arguments, future))
+        return future
+
+    async def get_stream_state(self, name):
+        """
+        :param name: name of the stream
+        :return: the state of the stream as committed, see new_follow_state
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._get_stream_state, name)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if batch[-1] is None:
+                batch.pop()
+                closing = True
+            if not batch:
+                continue
+            results = await loop.run_in_executor(self._executor, self._write_batch, batch)
+            for (_, _, future), (result, error) in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    def _open(self):
+        if self.sqlite_pathname:
+            self._connection = create_connection(self.sqlite_pathname)
+            if self._connection is None:
+                raise ValueError('Cannot open the SQLite database %s' % self.sqlite_pathname)
+            set_pragmas(self._connection, self.journal_mode, self.synchronous)
+            create_log_checkpoint_table(self._connection)
+            create_ingested_log_table(self._connection)
+            create_match_statistics_table(self._connection)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _get_stream_state(self, name):
+        state = self._streams.get(name)
+        if state is None:
+            if self._connection is None:
+                raise HttpError(400, 'Streams need a SQLite database')
+            checkpoint = get_log_checkpoint(self._connection, name)
+            state = self._streams[name] = load_follow_state(checkpoint) if checkpoint else new_follow_state()
+        return state
+
+    def _write_batch(self, batch):
+        """
+        :param batch: list of the queued writes (kind, arguments, future)
+        :return: list of tuples (result, exception) of the writes, in the same order
+        """
+        start = time.perf_counter()
+        results = [None] * len(batch)
+        # The chunks of a stream are written together, with the frags of all of them and the last parse state
+        streams = {}
+        for index, (kind, arguments, _) in enumerate(batch):
+            if kind == 'stream':
+                streams.setdefault(arguments[0], []).append(index)
+            elif kind == 'reset':
+                results[index] = self._write(self.reset_stream, *arguments)
+            else:
+                results[index] = self._write(self.write_match, *arguments)
+
+        for name, indexes in streams.items():
+            frags = [frag for index in indexes for frag in batch[index][1][2]]
+            _, parse_state, _, end = batch[indexes[-1]][1]
+            result = self._write(self.write_stream, name, parse_state, frags, end)
+            for index in indexes:
+                results[index] = result
+
+        self.batch_count += 1
+        self.write_count += len(batch)
+        metrics.increment('sink_batches')
+        metrics.increment('sink_writes', len(batch))
+        metrics.observe('write_batch', time.perf_counter() - start)
+        return results
+
+    @staticmethod
+    def _write(function, *arguments):
+        try:
+            return function(*arguments), None
+        except Exception as error:
+            metrics.increment('errors', stage='database_sink')
+            return None, error
+
+    def write_match(self, match, frags, content_hash, log_file_pathname):
+        """
+        :return: the id of the match, the one already ingested if the log is a duplicate
+        """
+        if self._connection is not None:
+            return insert_match_and_frags(self._connection, match, frags, self.batch_size, content_hash,
+                                          log_file_pathname, self.on_duplicate)
+        return insert_match_to_postgresql(self.postgres_properties, *match, frags, content_hash=content_hash,
+                                          log_file_pathname=log_file_pathname, on_duplicate=self.on_duplicate)
+
+    def write_stream(self, name, parse_state, frags, end):
+        """
+        Commit the frags of the next lines of a stream, see write_follow_frags
+        :param name: name of the stream
+        :param parse_state: dictionary of the stream after these lines: {'offset', 'record', 'parser'}
+        :param frags: the frags of these lines
+        :param end: True if these are the last lines of the match, the stream is reset once they are committed
+        :return: dictionary {'match_id': ..., 'committed_offset': ...}
+        """
+        state = dict(self._get_stream_state(name), **parse_state)
+        write_follow_frags(self._connection, state, frags, name, self.batch_size)
+        if end:
+            self.reset_stream(name)
+        else:
+            self._streams[name] = state
+        return {'match_id': state['match_id'], 'committed_offset': state['offset']}
+
+    def reset_stream(self, name):
+        """
+        Forget the state of a stream, its next lines start a new match
+        :param name: name of the stream
+        """
+        with self._connection:
+            save_log_checkpoint(self._connection, name, dump_follow_state(new_follow_state()))
+        self._streams.pop(name, None)
+
+
+class IngestionServer:
+    """
+    HTTP/1.1 front of the service, see the endpoints in the documentation of the module.
+    Parsing runs in a pool of worker processes, at most twice as many parses as workers are in flight.
+    """
+
+    def __init__(self, sink, workers=None, max_body_bytes=MAX_BODY_BYTES):
+        self.sink = sink
+        self.workers = workers or os.cpu_count()
+        self.max_body_bytes = max_body_bytes
+        self._pool = ProcessPoolExecutor(self.workers)
+        self._parse_slots = None
+        self._parse_count = 0
+        # {stream name: {'lock', 'state', 'pending', 'frags', 'committed_offset', 'match_id', 'error'}}
+        self._streams = {}
+
+    def close(self):
+        self._pool.shutdown()
+
+    async def parse(self, function, *arguments):
+        if self._parse_slots is None:
+            self._parse_slots = asyncio.Semaphore(self.workers * 2)
+        async with self._parse_slots:
+            self._parse_count += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._pool, function, *arguments)
+            finally:
+                self._parse_count -= 1
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answer the requests of a connection until the client closes it
+        """
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body_bytes)
+                except HttpError as error:
+                    write_response(writer, error.status, {'error': error.message}, keep_alive=False)
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, path, headers, body, keep_alive = request
+
+                start = time.perf_counter()
+                try:
+                    status, payload = await self.dispatch(method, path, headers, body)
+                except HttpError as error:
+                    status, payload = error.status, {'error': error.message}
+                except Exception as error:
+                    metrics.increment('errors', stage='ingestion_server')
+                    status, payload = 500, {'error': repr(error)}
+                metrics.increment('http_requests', method=method, status=status)
+                metrics.observe('http_%s' % method.lower(), time.perf_counter() - start)
+
+                write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, headers, body):
+        """
+        :return: a tuple (HTTP status, JSON payload) of the request
+        """
+        parts = [unquote(part) for part in path.split('?', 1)[0].strip('/').split('/')]
+        if parts == ['logs']:
+            if method != 'POST':
+                raise HttpError(405, 'Use POST to upload a log file')
+            return await self.upload_log(body, headers.get('x-log-file'))
+        if len(parts) == 2 and parts[0] == 'streams' and parts[1]:
+            name = STREAM_PREFIX + parts[1]
+            if method == 'POST':
+                return await self.feed_stream(name, body)
+            if method == 'GET':
+                return await self.get_stream(name)
+            if method == 'DELETE':
+                return await self.end_stream(name)
+            raise HttpError(405, 'Use POST, GET or DELETE on a stream')
+        if parts == ['status'] and method == 'GET':
+            return 200, {
+                'pending_writes': self.sink.pending_count,
+                'max_pending_writes': self.sink.max_pending,
+                'write_batches': self.sink.batch_count,
+                'writes': self.sink.write_count,
+                'parsing': self._parse_count,
+                'streams': len(self._streams),
+            }
+        raise HttpError(404, 'Unknown endpoint: %s %s' % (method, path))
+
+    async def upload_log(self, data, log_file_pathname=None):
+        if not data:
+            raise HttpError(400, 'The log file is empty')
+        result = await self.parse(parse_uploaded_log, data)
+        if result['error'] is not None:
+            raise HttpError(400, result['error'])
+        future = await self.sink.submit('match', result['match'], result['frags'], result['content_hash'],
+                                        log_file_pathname)
+        match_id = await future
+        return 200, {'match_id': match_id, 'frags': len(result['frags']), 'content_hash': result['content_hash']}
+
+    @contextlib.asynccontextmanager
+    async def _lock_stream(self, name):
+        """
+        :param name: name of the stream
+        :return: context manager holding the lock of the stream, its state is loaded from its checkpoint on first use
+        """
+        while True:
+            stream = self._streams.get(name)
+            if stream is None:
+                stream = self._streams[name] = {'lock': asyncio.Lock(), 'state': None, 'pending': b'', 'frags': 0,
+                                                'committed_offset': 0, 'match_id': None, 'error': None}
+            await stream['lock'].acquire()
+            # The stream has been ended while waiting for its lock
+            if self._streams.get(name) is stream:
+                break
+            stream['lock'].release()
+        try:
+            if stream['state'] is None:
+                try:
+                    state = await self.sink.get_stream_state(name)
+                except Exception:
+                    del self._streams[name]
+                    raise
+                stream['state'] = {'offset': state['offset'], 'record': state['record'], 'parser': state['parser']}
+                stream['committed_offset'] = state['offset']
+                stream['match_id'] = state['match_id']
+            yield stream
+        finally:
+            stream['lock'].release()
+
+    @staticmethod
+    def _on_stream_written(stream, future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            stream['error'] = repr(error)
+        else:
+            stream['committed_offset'] = max(stream['committed_offset'], future.result()['committed_offset'])
+            stream['match_id'] = future.result()['match_id']
+
+    def _describe_stream(self, stream):
+        return {'accepted_offset': stream['state']['offset'] + len(stream['pending']),
+                'committed_offset': stream['committed_offset'], 'match_id': stream['match_id']}
+
+    def _fail_stream(self, name, stream):
+        """
+        Forget a stream whose lines couldn't be committed: the next request starts again from the state
+        committed, the game server has to send its lines again from committed_offset
+        """
+        del self._streams[name]
+        raise HttpError(409, 'The stream failed, send the lines again from committed_offset or end it: %s'
+                        % stream['error'])
+
+    async def _parse_stream(self, stream, data):
+        """
+        :param data: bytes of complete lines of the stream
+        :return: the frags of these lines, the state of the stream is moved past them
+        """
+        state = stream['state']
+        record, parser_state, frags = await self.parse(parse_stream_lines, state['record'], state['parser'], data)
+        stream['state'] = {'offset': state['offset'] + len(data), 'record': record, 'parser': parser_state}
+        stream['frags'] += len(frags)
+        return frags
+
+    async def feed_stream(self, name, data):
+        async with self._lock_stream(name) as stream:
+            if stream['error'] is not None:
+                self._fail_stream(name, stream)
+            data = stream['pending'] + data
+            # A last line without its new line is still being written by the game server, it is kept for later
+            end = data.rfind(b'\n') + 1
+            stream['pending'] = data[end:]
+            frags = []
+            if end:
+                frags = await self._parse_stream(stream, data[:end])
+                future = await self.sink.submit('stream', name, stream['state'], frags, False)
+                future.add_done_callback(lambda written: self._on_stream_written(stream, written))
+            return 202, dict(self._describe_stream(stream), frags=len(frags))
+
+    async def get_stream(self, name):
+        async with self._lock_stream(name) as stream:
+            return 200, dict(self._describe_stream(stream), error=stream['error'])
+
+    async def end_stream(self, name):
+        async with self._lock_stream(name) as stream:
+            try:
+                if stream['error'] is not None:
+                    # The lines not committed are dropped, the next lines of the stream start a new match
+                    await (await self.sink.submit('reset', name))
+                    return 200, {'match_id': stream['match_id'], 'frags': None, 'error': stream['error']}
+                frags = []
+                if stream['pending']:
+                    frags = await self._parse_stream(stream, stream['pending'] + b'\n')
+                    stream['pending'] = b''
+                result = await (await self.sink.submit('stream', name, stream['state'], frags, True))
+                return 200, {'match_id': result['match_id'], 'frags': stream['frags']}
+            finally:
+                del self._streams[name]
+
+
+async def read_request(reader, max_body_bytes=MAX_BODY_BYTES):
+    """
+    :param reader: asyncio.StreamReader of the connection
+    :param max_body_bytes: size of the largest body accepted
+    :return: a tuple (method, path, headers, body, keep_alive) of the next request of the connection,
+             or None if the client closed it. The names of the headers are lower case.
+    """
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, path, version = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, 'Malformed request line')
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise HttpError(411, 'Send a Content-Length instead of a chunked body')
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HttpError(400, 'Malformed Content-Length')
+    if length > max_body_bytes:
+        raise HttpError(413, 'The body is larger than %d bytes' % max_body_bytes)
+    body = await reader.readexactly(length) if length else b''
+
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+    return method.upper(), path, headers, body, keep_alive
+
+
+def write_response(writer, status, payload, keep_alive=True):
+    """
+    :param writer: asyncio.StreamWriter of the connection
+    :param status: HTTP status of the response
+    :param payload: JSON payload of the response
+    :param keep_alive: False to tell the client the connection is closed after this response
+    """
+    body = json.dumps(payload, default=str).encode()
+    writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n'
+                  % (status, HTTP_REASONS.get(status, ''), len(body), 'keep-alive' if keep_alive else 'close'))
+                 .encode('latin-1') + body)
+
+
+async def serve(host, port, sink, workers=None, report=print):
+    """
+    Run the service until it is cancelled or receives SIGTERM
+    :param host: address to listen on
+    :param port: port to listen on, 0 for any free port
+    :param sink: the DatabaseSink the matches are written through
+    :param workers: number of parsing processes, defaults to the number of cores of the host
+    :param report: function called with the address the service listens on
+    """
+    await sink.start()
+    ingestion_server = IngestionServer(sink, workers)
+    try:
+        server = await asyncio.start_server(ingestion_server.handle_connection, host, port)
+        task = asyncio.current_task()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel)
+        report('Listening on %s:%d' % server.sockets[0].getsockname()[:2])
+        async with server:
+            try:
+                await server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+    finally:
+        await sink.close()
+        ingestion_server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on, 0 for any free port')
+    parser.add_argument('--sqlite', help='path of the SQLite database to write into')
+    parser.add_argument('--postgres', help='hostname,database_name,username,password of the PostgreSQL database')
+    parser.add_argument('--workers', type=int, default=None, help='number of parsing processes (default: all cores)')
+    parser.add_argument('--max-pending', type=int, default=MAX_PENDING_WRITES,
+                        help='number of writes queued before the requests wait for the database')
+    parser.add_argument('--max-batch', type=int, default=MAX_WRITE_BATCH,
+                        help='maximum number of queued writes handled at once')
+    parser.add_argument('--batch-size', type=int, default=FRAG_BATCH_SIZE)
+    parser.add_argument('--journal-mode', default='WAL', help='SQLite journal mode')
+    parser.add_argument('--synchronous', default='NORMAL', help='SQLite synchronous setting')
+    parser.add_argument('--replace', action='store_true',
+                        help='replace the matches of logs already ingested instead of skipping them')
+    parser.add_argument('--metrics', action='append', default=[],
+                        help='record the timings and counters of the service and write them when it stops: '
+                             'log (stderr), json:PATH or prometheus:PATH, can be repeated')
+    args = parser.parse_args(argv)
+    if not args.sqlite and not args.postgres:
+        parser.error('--sqlite or --postgres is required')
+
+    if args.metrics:
+        try:
+            metrics.enable_metrics(*[metrics.create_sink(sink) for sink in args.metrics])
+        except ValueError as error:
+            parser.error(str(error))
+    sink = DatabaseSink(args.sqlite, tuple(args.postgres.split(',')) if args.postgres and not args.sqlite else None,
+                        args.max_pending, args.max_batch, args.batch_size,
+                        args.journal_mode if args.sqlite else None, args.synchronous if args.sqlite else None,
+                        'replace' if args.replace else 'skip')
+    try:
+        asyncio.run(serve(args.host, args.port, sink, args.workers, lambda line: print(line, flush=True)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if metrics.is_enabled():
+            metrics.flush_metrics()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,258 @@
+import heapq
+
+
+class KillMatrix:
+    """
+    Sparse killer x victim matrix of kill counts, over all the matches and per match, with the kill counts
+    of every weapon in each cell. Rows are the killers and columns the victims, both are kept as dictionaries
+    of their non-zero cells, so a row (the victims of a killer) or a column (the enemies of a victim) is sliced
+    in the time of its number of cells, whatever the number of frags:
+        - favorite_victims, worst_enemies: same answers as sql_queries/WP50.sql and WP51.sql;
+        - top_victims, top_enemies: top k of a row or of a column, in a match or over all the matches;
+        - head_to_head: the two symmetric cells of a pair of players;
+        - weapon_breakdown: weapons of a cell or of a whole row.
+    Matches are added as they arrive (add_frags) and removed when they are replaced (remove_match).
+    Suicides have no victim, they are not counted. Player names, weapons and match ids are interned
+    as in FragTable.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.weapons = []
+        self.match_ids = []
+        self._name_codes = {}
+        self._weapon_codes = {}
+        self._match_codes = {}
+
+        # {killer code: {victim code: kill count}} and its transpose {victim code: {killer code: kill count}}
+        self._rows = {}
+        self._columns = {}
+        # {(killer code, victim code): {weapon code: kill count}}
+        self._cell_weapons = {}
+        # The same three dictionaries for each match: {match code: dictionary}
+        self._match_rows = {}
+        self._match_columns = {}
+        self._match_cell_weapons = {}
+        self.kill_count = 0
+
+    @classmethod
+    def from_frags(cls, frags, match_id=None):
+        """
+        :param frags: an iterable of tuples (frag_time, killer_name[, victim_name, weapon_code]), as returned by parse_frags
+        :param match_id: identifier of the match of the frags
+        :return: a new KillMatrix of these frags
+        """
+        kill_matrix = cls()
+        kill_matrix.add_frags(frags, match_id)
+        return kill_matrix
+
+    @staticmethod
+    def _intern(value, values, codes):
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+
+    @staticmethod
+    def _add_count(counts, key, count):
+        """
+        Add count to counts[key], the key is removed when its count drops to 0 so the matrix stays sparse
+        """
+        count += counts.get(key, 0)
+        if count:
+            counts[key] = count
+        else:
+            del counts[key]
+
+    def _add_cell(self, match_code, killer_code, victim_code, weapon_code, count=1):
+        for rows, columns, cell_weapons in ((self._rows, self._columns, self._cell_weapons),
+                                            (self._match_rows.setdefault(match_code, {}),
+                                             self._match_columns.setdefault(match_code, {}),
+                                             self._match_cell_weapons.setdefault(match_code, {}))):
+            self._add_count(rows.setdefault(killer_code, {}), victim_code, count)
+            self._add_count(columns.setdefault(victim_code, {}), killer_code, count)
+            self._add_count(cell_weapons.setdefault((killer_code, victim_code), {}), weapon_code, count)
+            if not rows[killer_code]:
+                del rows[killer_code]
+            if not columns[victim_code]:
+                del columns[victim_code]
+            if not cell_weapons[killer_code, victim_code]:
+                del cell_weapons[killer_code, victim_code]
+        self.kill_count += count
+
+    def add_kill(self, killer_name, victim_name, weapon_code, match_id=None):
+        """
+        :param killer_name: name of the killer
+        :param victim_name: name of the victim
+        :param weapon_code: code of the weapon, example: 'AG36'
+        :param match_id: identifier of the match of the kill
+        """
+        self._add_cell(self._intern(match_id, self.match_ids, self._match_codes),
+                       self._intern(killer_name, self.names, self._name_codes),
+                       self._intern(victim_name, self.names, self._name_codes),
+                       self._intern(weapon_code, self.weapons, self._weapon_codes))
+
+    def add_frags(self, frags, match_id=None):
+        """
+        :param frags: an iterable of tuples (frag_time, killer_name[, victim_name, weapon_code])
+        :param match_id: identifier of the match of the frags
+        """
+        for frag in frags:
+            if len(frag) > 2 and frag[2] is not None:
+                self.add_kill(frag[1], frag[2], frag[3], match_id)
+
+    def add_frag_rows(self, rows):
+        """
+        :param rows: an iterable of rows (match_id, killer_name, victim_name, weapon_code) of the match_frag table
+        """
+        for match_id, killer_name, victim_name, weapon_code in rows:
+            if victim_name is not None:
+                self.add_kill(killer_name, victim_name, weapon_code, match_id)
+
+    def add_frag_table(self, frag_table):
+        """
+        :param frag_table: a FragTable, its frags are added with the match ids of the table
+        """
+        for match_code, killer_code, victim_code, weapon_code, suicide in zip(
+                frag_table.match_codes, frag_table.killer_codes, frag_table.victim_codes, frag_table.weapon_codes,
+                frag_table.suicides):
+            if not suicide:
+                self.add_kill(frag_table.names[killer_code], frag_table.names[victim_code],
+                              frag_table.weapons[weapon_code], frag_table.match_ids[match_code])
+
+    def remove_match(self, match_id):
+        """
+        Subtract the kills of a match from the matrix, when the match has been deleted or replaced
+        :param match_id: identifier of the match
+        :return: number of kills removed
+        """
+        match_code = self._match_codes.get(match_id)
+        if match_code is None or match_code not in self._match_cell_weapons:
+            return 0
+        kill_count = self.kill_count
+        for (killer_code, victim_code), weapon_counts in list(self._match_cell_weapons[match_code].items()):
+            for weapon_code, count in list(weapon_counts.items()):
+                self._add_cell(match_code, killer_code, victim_code, weapon_code, -count)
+        del self._match_rows[match_code], self._match_columns[match_code], self._match_cell_weapons[match_code]
+        return kill_count - self.kill_count
+
+    def _slice(self, matrix, match_matrix, player_name, match_id):
+        """
+        :return: dictionary {player code: kill count} of the row or column of a player, empty if it has no kill
+        """
+        if match_id is not None:
+            matrix = match_matrix.get(self._match_codes.get(match_id), {})
+        return matrix.get(self._name_codes.get(player_name), {})
+
+    def _top(self, counts, k, names):
+        """
+        :param counts: dictionary {code: count}
+        :param k: number of items returned, all of them if None
+        :param names: the values of the codes
+        :return: list of tuples (value, count) by descending count then value
+        """
+        def key(item):
+            return -item[1], names[item[0]]
+
+        items = sorted(counts.items(), key=key) if k is None else heapq.nsmallest(k, counts.items(), key=key)
+        return [(names[code], count) for code, count in items]
+
+    def top_victims(self, player_name, k=1, match_id=None):
+        """
+        :param player_name: name of the killer
+        :param k: number of victims returned, all of them if None
+        :param match_id: only count the kills of this match, or of all the matches if None
+        :return: list of tuples (victim_name, kill_count) of the players killed most by player_name
+        """
+        return self._top(self._slice(self._rows, self._match_rows, player_name, match_id), k, self.names)
+
+    def top_enemies(self, player_name, k=1, match_id=None):
+        """
+        :param player_name: name of the victim
+        :param k: number of enemies returned, all of them if None
+        :param match_id: only count the kills of this match, or of all the matches if None
+        :return: list of tuples (killer_name, kill_count) of the players who killed player_name most
+        """
+        return self._top(self._slice(self._columns, self._match_columns, player_name, match_id), k, self.names)
+
+    def head_to_head(self, player_name, opponent_name, match_id=None):
+        """
+        :param match_id: only count the kills of this match, or of all the matches if None
+        :return: a tuple (kill_count, death_count, ratio): number of times player_name killed opponent_name,
+                 number of times opponent_name killed player_name and kill_count / death_count,
+                 None if opponent_name never killed player_name
+        """
+        kill_count = self._slice(self._rows, self._match_rows, player_name, match_id).get(
+            self._name_codes.get(opponent_name), 0)
+        death_count = self._slice(self._columns, self._match_columns, player_name, match_id).get(
+            self._name_codes.get(opponent_name), 0)
+        return kill_count, death_count, kill_count / death_count if death_count else None
+
+    def weapon_breakdown(self, killer_name, victim_name=None, match_id=None):
+        """
+        :param killer_name: name of the killer
+        :param victim_name: only count the kills of this victim, or of all the victims of killer_name if None
+        :param match_id: only count the kills of this match, or of all the matches if None
+        :return: list of tuples (weapon_code, kill_count) by descending kill count
+        """
+        cell_weapons = self._cell_weapons
+        if match_id is not None:
+            cell_weapons = self._match_cell_weapons.get(self._match_codes.get(match_id), {})
+        killer_code = self._name_codes.get(killer_name)
+        if victim_name is not None:
+            return self._top(cell_weapons.get((killer_code, self._name_codes.get(victim_name)), {}), None,
+                             self.weapons)
+
+        weapon_counts = {}
+        for victim_code in self._slice(self._rows, self._match_rows, killer_name, match_id):
+            for weapon_code, count in cell_weapons[killer_code, victim_code].items():
+                weapon_counts[weapon_code] = weapon_counts.get(weapon_code, 0) + count
+        return self._top(weapon_counts, None, self.weapons)
+
+    def _best_match_cells(self, match_matrices):
+        """
+        :param match_matrices: self._match_rows or self._match_columns
+        :return: list of tuples (match_id, player_name, other_player_name, kill_count) of the biggest cell
+                 of the rows or columns of each player in a single match: by descending kill count, then
+                 match id and name of the other player, sorted by player name
+        """
+        best_cells = {}
+        for match_code, match_matrix in match_matrices.items():
+            match_id = self.match_ids[match_code]
+            for player_code, counts in match_matrix.items():
+                other_name, count = self._top(counts, 1, self.names)[0]
+                best_cell = best_cells.get(player_code)
+                if best_cell is None or (-count, match_id, other_name) < (-best_cell[3], best_cell[0], best_cell[2]):
+                    best_cells[player_code] = (match_id, self.names[player_code], other_name, count)
+        return sorted(best_cells.values(), key=lambda row: row[1])
+
+    def favorite_victims(self):
+        """
+        :return: list of tuples (match_id, player_name, favorite_victim_name, kill_count), the rows of
+                 sql_queries/WP50.sql: the victim each player killed most in a single match
+        """
+        return self._best_match_cells(self._match_rows)
+
+    def worst_enemies(self):
+        """
+        :return: list of tuples (match_id, player_name, worst_enemy_name, kill_count), the rows of
+                 sql_queries/WP51.sql: the killer who killed each player most in a single match
+        """
+        return self._best_match_cells(self._match_columns)
+
+
+def load_kill_matrix(connection, kill_matrix=None):
+    """
+    :param connection: connection object of the sqlite or postgresql database
+    :param kill_matrix: the KillMatrix to add the frags to, a new one if None
+    :return: a KillMatrix of all the kills of the match_frag table
+    """
+    if kill_matrix is None:
+        kill_matrix = KillMatrix()
+    cur = connection.cursor()
+    cur.execute(''' SELECT match_id, killer_name, victim_name, weapon_code FROM match_frag
+                    WHERE victim_name IS NOT NULL ''')
+    kill_matrix.add_frag_rows(cur)
+    cur.close()
+    return kill_matrix
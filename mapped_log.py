@@ -0,0 +1,174 @@
+import mmap
+import re
+
+# Bytes versions of the line patterns of farcry_data_science. A log is scanned as a whole instead of line
+# by line, so '.' is replaced with [^\r\n]: a match never crosses a line, whatever its new line
+# ('\r\n', '\n' or a lone '\r', as when the file is read in text mode).
+LOG_START_PATTERN = re.compile(rb"Log Started at ([^\r\n]+)")
+TIMEZONE_PATTERN = re.compile(rb"\(g_timezone,([^\r\n]*)\)")
+MODE_AND_MAP_PATTERN = re.compile(rb"-* Loading level Levels/(\w+), mission (\w+) -*")
+START_TIME_MATCH_PATTERN = re.compile(rb"Precaching level [^\r\n]{3} <([^\r\n]+?)> done")
+END_TIME_MATCH_PATTERN = re.compile(rb"<([^\r\n]+?)> == Statistics")
+FRAG_PATTERN = re.compile(rb"<([^\r\n]+?)> <Lua> ([^\r\n]+) killed (?:itself|([^\r\n]+) with ([^\r\n]+))")
+LINE_TIME_PATTERN = re.compile(rb"<([^\r\n]{5})>")
+LINE_PATTERN = re.compile(rb"([^\r\n]*)(?:\r\n|\r|\n)|([^\r\n]+)\Z")
+NEW_LINE_PATTERN = re.compile(rb"\r\n|\r|\n")
+
+# (event, keyword, pattern): as in iter_log_events, a pattern is only matched against the lines containing its keyword
+HEADER_PATTERNS = (
+    ('log_start_time', b'Log Started at', LOG_START_PATTERN),
+    ('timezone', b'g_timezone', TIMEZONE_PATTERN),
+    ('mode_and_map', b'Loading level', MODE_AND_MAP_PATTERN),
+    ('start_time_match', b'Precaching level', START_TIME_MATCH_PATTERN),
+    ('end_time_match', b'== Statistics', END_TIME_MATCH_PATTERN),
+)
+
+# The mapping is scanned by windows of this number of bytes, ending at a new line. The pages of a
+# window are released once it has been scanned, so the resident memory doesn't grow with the log.
+SCAN_WINDOW_SIZE = 16 * 1024 * 1024
+
+
+class MappedLog:
+    """
+    A log file mapped in memory instead of being read into a string. The patterns of the parser run
+    as bytes regexes over the mapping and only the matched fields are decoded.
+    The functions of farcry_data_science that take the content of a log (parse_frags, get_timezone,
+    parse_game_session_start_and_end_times...) also accept a MappedLog, see map_log_file.
+    """
+
+    def __init__(self, log_file_pathname, encoding='utf-8'):
+        self.log_file_pathname = log_file_pathname
+        self.encoding = encoding
+        with open(log_file_pathname, 'rb') as file:
+            self.size = file.seek(0, 2)
+            # An empty file can't be mapped
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def _decode(self, value):
+        return value.decode(self.encoding)
+
+    def _release(self, start, end):
+        """
+        Drop the pages of the mapping between start and end from the resident memory of the process,
+        they are read again from the file if they are needed later
+        """
+        if not isinstance(self.buffer, mmap.mmap):
+            return
+        start -= start % mmap.PAGESIZE
+        end -= end % mmap.PAGESIZE
+        if end > start:
+            self.buffer.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def iter_windows(self, start=0):
+        """
+        :param start: position to start from
+        :return: a generator of tuples (start, end) of windows of the mapping ending at a new line,
+                 the pages of each window are released when the next one is generated
+        """
+        while start < self.size:
+            end = min(start + SCAN_WINDOW_SIZE, self.size)
+            if end < self.size:
+                new_line = self.buffer.rfind(b'\n', start, end)
+                if new_line < 0:
+                    new_line = self.buffer.find(b'\n', end)
+                end = self.size if new_line < 0 else new_line + 1
+            yield start, end
+            self._release(start, end)
+            start = end
+
+    def iter_keyword_matches(self, keyword, pattern):
+        """
+        :param keyword: bytes contained in every match of the pattern
+        :param pattern: a bytes pattern that matches inside a single line
+        :return: a generator of the matches of the pattern in the order of the log, only the lines
+                 containing the keyword are matched against the pattern
+        """
+        buffer = self.buffer
+        for start, end in self.iter_windows():
+            position = buffer.find(keyword, start, end)
+            while position >= 0:
+                # A match can't cross a new line: the span between the '\n' around the keyword may hold several
+                # lines ended by a lone '\r', the pattern only matches those containing the keyword anyway
+                line_start = buffer.rfind(b'\n', start, position) + 1 or start
+                line_end = buffer.find(b'\n', position, end)
+                if line_end < 0:
+                    line_end = end
+                yield from pattern.finditer(buffer, line_start, line_end)
+                position = buffer.find(keyword, line_end, end)
+
+    def search(self, keyword, pattern):
+        """
+        :return: the first match of the pattern in the log, or None, see iter_keyword_matches
+        """
+        return next(self.iter_keyword_matches(keyword, pattern), None)
+
+    def find_header_events(self, event_names):
+        """
+        :param event_names: names of the header events to look for, see farcry_data_science.iter_log_events
+        :return: dictionary of the value of the first occurrence of each event found
+        """
+        values = {}
+        for event, keyword, pattern in HEADER_PATTERNS:
+            if event not in event_names:
+                continue
+            match = self.search(keyword, pattern)
+            if match:
+                if event == 'mode_and_map':
+                    values[event] = tuple(map(self._decode, match.groups()[::-1]))
+                else:
+                    values[event] = self._decode(match.group(1))
+        return values
+
+    def iter_frag_matches(self):
+        """
+        :return: a generator of the matches of FRAG_PATTERN, in the order of the log
+        """
+        return self.iter_keyword_matches(b'<Lua>', FRAG_PATTERN)
+
+    def get_line_end(self, position):
+        """
+        :param position: a position inside a line
+        :return: the position of the start of the next line, or the size of the log if it is the last line
+        """
+        match = NEW_LINE_PATTERN.search(self.buffer, position)
+        return self.size if match is None else match.end()
+
+    def scan_events(self):
+        """
+        Scan the log for the events of farcry_data_science.iter_log_events: the header events first,
+        then the frags in the order of the log. time_after_frag is only yielded for the last frag line,
+        which is all a log record keeps.
+        :return: a generator of tuples (event, value) in the same format as iter_log_events
+        """
+        for event, value in self.find_header_events({event for event, _, _ in HEADER_PATTERNS}).items():
+            yield event, value
+
+        last_match = None
+        for match in self.iter_frag_matches():
+            last_match = match
+            # Suicides don't have victim and weapon, remove the empty groups
+            yield 'frag', tuple(self._decode(elem) for elem in match.groups() if elem)
+
+        if last_match is not None:
+            line_time = LINE_TIME_PATTERN.match(self.buffer, self.get_line_end(last_match.end()))
+            if line_time:
+                yield 'time_after_frag', self._decode(line_time.group(1))
+
+    def iter_lines(self):
+        """
+        :return: a generator of the decoded lines of the log, without their new line, as when the
+                 file is read in text mode
+        """
+        for start, end in self.iter_windows():
+            for match in LINE_PATTERN.finditer(self.buffer, start, end):
+                yield self._decode(match.group(1) if match.group(2) is None else match.group(2))
@@ -19,4 +19,4 @@ FROM (
                   killer_name,
                   victim_name
      ) AS killer_victim_table
-WHERE row_number = '1';
\ No newline at end of file
+WHERE row_number = 1;
\ No newline at end of file
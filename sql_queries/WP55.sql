@@ -1,5 +1,8 @@
 -- The function returns the Lucky Luke
 -- longest series of kills for each player and for each match.
+-- A series lasts as long as each kill of the player comes at most
+-- p_max_time_between_kills seconds after his previous kill in the match.
+-- Suicides are not kills.
 -- It returns a set of records defined with the following columns:
 --
 -- match_id: identification of a match;
@@ -8,6 +11,21 @@
 --
 -- kill_count: the number of kills of the longest Lucky
 -- Luke series of this player for this match.
+--
+-- The frags are sorted once: a kill starts a new series when the previous
+-- kill of the same player is too old, and the running sum of these starts
+-- numbers the series of the player. The same query runs on SQLite, see
+-- LUCKY_LUKE_QUERY in utilities/statistics_util.py.
+--
+-- The rows differ from the ones of the previous PL/pgSQL loop, kept below as
+-- calculate_lucky_luke_killers_legacy to compare them:
+--   - suicides are not counted as kills anymore;
+--   - kills made in the same second are counted apart instead of being merged;
+--   - the first kill of a player is compared with the previous kill of the same
+--     player, not with the last frag of the previous player;
+--   - a new series starts at 1 kill, not at 0;
+--   - the last series of a player is closed, so a player whose only series is
+--     long enough is returned.
 CREATE OR REPLACE FUNCTION calculate_lucky_luke_killers(p_min_kill_count integer default 3,
                                                         p_max_time_between_kills integer default 10)
     RETURNS TABLE
@@ -18,6 +36,63 @@ CREATE OR REPLACE FUNCTION calculate_lucky_luke_killers(p_min_kill_count integer
             )
 AS
 $$
+SELECT
+    series.match_id,
+    series.killer_name,
+    MAX(series.kill_count) AS kill_count
+FROM
+(
+    SELECT
+        numbered_kills.match_id,
+        numbered_kills.killer_name,
+        numbered_kills.series_number,
+        COUNT(*) AS kill_count
+    FROM
+    (
+        SELECT
+            kills.match_id,
+            kills.killer_name,
+            SUM(kills.new_series) OVER (PARTITION BY kills.match_id, kills.killer_name
+                                        ORDER BY kills.frag_time) AS series_number
+        FROM
+        (
+            SELECT
+                f.match_id,
+                f.killer_name,
+                f.frag_time,
+                CASE WHEN EXTRACT(EPOCH FROM f.frag_time - LAG(f.frag_time) OVER killer_kills)
+                          <= p_max_time_between_kills
+                     THEN 0 ELSE 1 END AS new_series
+            FROM match_frag f
+            WHERE
+                f.victim_name IS NOT NULL
+            WINDOW killer_kills AS (PARTITION BY f.match_id, f.killer_name ORDER BY f.frag_time)
+        ) AS kills
+    ) AS numbered_kills
+    GROUP BY
+        numbered_kills.match_id,
+        numbered_kills.killer_name,
+        numbered_kills.series_number
+) AS series
+GROUP BY
+    series.match_id,
+    series.killer_name
+HAVING
+    MAX(series.kill_count) >= p_min_kill_count;
+$$ LANGUAGE SQL STABLE;
+
+
+-- The previous implementation, unchanged, with the results described above.
+CREATE OR REPLACE FUNCTION calculate_lucky_luke_killers_legacy(p_min_kill_count integer default 3,
+                                                               p_max_time_between_kills integer default 10)
+    RETURNS TABLE
+            (
+                match_id    uuid,
+                killer_name text,
+                kill_count  bigint
+            )
+AS
+$$
 DECLARE
     rec   RECORD;
     rec1  RECORD;
@@ -0,0 +1,110 @@
+import os
+import unittest
+
+from farcry_data_science import parse_log_file, parse_record_game_session_times
+from utilities.query_cache import QueryCache, configure_query_cache, get_query_cache, load_query, \
+    run_cached_query, run_dashboard_query
+from utilities.sqlite_util import create_connection, insert_match_and_frags, get_match_statistics
+from utilities.statistics_util import MATCH_STATISTICS_QUERY
+
+LOGS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs')
+
+
+def load_log(connection, log_file_name):
+    """
+    :return: identifier of the match of the log inserted into the database of the connection
+    """
+    record = parse_log_file(os.path.join(LOGS_DIRECTORY, log_file_name))
+    match = parse_record_game_session_times(record) + (record['game_mode'], record['map_name'])
+    return insert_match_and_frags(connection, match, record['frags'])
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = QueryCache(max_entries=2, ttl_seconds=10, clock=self.clock)
+
+    def test_expires_after_ttl(self):
+        self.cache.put('key', [(1,)])
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get('key'), [(1,)])
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put('a', [('a',)])
+        self.cache.put('b', [('b',)])
+        self.cache.get('a')
+        self.cache.put('c', [('c',)])
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), [('a',)])
+        self.assertEqual(self.cache.get('c'), [('c',)])
+
+    def test_invalidate_match(self):
+        self.cache.max_entries = 10
+        self.cache.put('match 1', [(1,)], match_id=1)
+        self.cache.put('match 2', [(2,)], match_id=2)
+        self.cache.put('all matches', [(1,), (2,)])
+        # The results of the match and the ones depending on all the matches are dropped
+        self.assertEqual(self.cache.invalidate_match(1), 2)
+        self.assertIsNone(self.cache.get('match 1'))
+        self.assertIsNone(self.cache.get('all matches'))
+        self.assertEqual(self.cache.get('match 2'), [(2,)])
+
+    def test_disabled(self):
+        self.cache.max_entries = 0
+        self.cache.put('key', [(1,)])
+        self.assertIsNone(self.cache.get('key'))
+
+
+class CachedQueryTest(unittest.TestCase):
+
+    def setUp(self):
+        configure_query_cache()
+        self.connections = [create_connection(':memory:'), create_connection(':memory:')]
+
+    def tearDown(self):
+        for connection in self.connections:
+            connection.close()
+        configure_query_cache()
+
+    def test_in_memory_databases_are_cached_apart(self):
+        first, second = self.connections
+        load_log(first, 'log00.txt')
+        load_log(second, 'log03.txt')
+        for connection in (first, second, first, second):
+            expected_rows = connection.execute(load_query('WP49.sql')).fetchall()
+            self.assertEqual(run_dashboard_query(connection, 'weapon_variety'), expected_rows)
+        self.assertEqual(len(get_query_cache()), 2)
+
+    def test_invalidated_by_insert(self):
+        connection = self.connections[0]
+        query = ''' SELECT COUNT(*) FROM match '''
+        load_log(connection, 'log00.txt')
+        self.assertEqual(run_cached_query(connection, query), [(1,)])
+        load_log(connection, 'log03.txt')
+        self.assertEqual(run_cached_query(connection, query), [(2,)])
+
+    def test_match_statistics(self):
+        connection = self.connections[0]
+        match_id = load_log(connection, 'log00.txt')
+        load_log(connection, 'log03.txt')
+        rows = run_dashboard_query(connection, 'match_statistics', match_id)
+        self.assertEqual(sorted(row[1:] for row in rows), sorted(get_match_statistics(connection, match_id)))
+        computed_rows = connection.execute(MATCH_STATISTICS_QUERY).fetchall()
+        self.assertEqual(sorted(run_dashboard_query(connection, 'match_statistics')), sorted(computed_rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,407 @@
+import importlib
+import os
+import time
+
+from utilities import metrics
+
+# Storage backends of the matches, by name. A backend only imports its driver module (utilities.sqlite_util,
+# utilities.postgres_util and psycopg2...) when it is opened, so a SQLite-only run never imports psycopg2:
+#     backend = open_backend('sqlite', './farcry.db')
+#     match_id = backend.insert_match(match, frags, content_hash=content_hash)
+#     backend.close()
+# Other backends are added with register_backend.
+
+# Number of times a match is inserted again after a transient error of the database (locked, connection lost...)
+INSERT_ATTEMPTS = 3
+# Seconds waited before the second attempt, doubled before each following one
+RETRY_DELAY = 0.1
+
+
+def is_sqlite_lock_error(error):
+    """
+    :param error: a sqlite3.OperationalError
+    :return: True if the database was locked or busy, 'database is locked' when another process holds
+             the write lock longer than the busy timeout. Missing tables or columns and syntax errors
+             are OperationalError too, attempting them again would fail the same way.
+    """
+    message = str(error)
+    return 'locked' in message or 'busy' in message
+
+
+class StorageBackend:
+    """
+    Base class of the backends: the retries of ingest_match are shared, the other methods are implemented
+    by each backend with the functions of its driver module.
+    """
+
+    name = None
+
+    def __init__(self, target, batch_size=None):
+        """
+        :param target: what the backend stores the matches into: path of the SQLite database, properties
+                       (hostname, database_name, username, password) of the PostgreSQL database...
+        :param batch_size: number of frags sent to the database in each statement, the default of the driver if None
+        """
+        self.target = target
+        self.batch_size = batch_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_transient_errors(self):
+        """
+        :return: tuple of the exception classes after which an insertion is attempted again
+        """
+        return ()
+
+    def is_transient_error(self, error):
+        """
+        :param error: an exception of one of the classes of get_transient_errors
+        :return: True if the insertion is attempted again after it, False if it is raised at once
+        """
+        return True
+
+    def insert_match(self, match, frags, content_hash=None, log_file_pathname=None, on_duplicate='skip',
+                     report=None):
+        """
+        Same as ingest_match, without the status.
+        :return: identifier of the match, the one of the match already ingested if it is skipped
+        """
+        return self.ingest_match(match, frags, content_hash, log_file_pathname, on_duplicate, report)[0]
+
+    def ingest_match(self, match, frags, content_hash=None, log_file_pathname=None, on_duplicate='skip',
+                     report=None):
+        """
+        Insert a match and all its frags in a single transaction, unless it has already been ingested,
+        from a log with the same content hash or with the same start time, game mode and map.
+        The insertion is attempted again, up to INSERT_ATTEMPTS times, after a transient error.
+        :param match: a tuple (start_time, end_time, game_mode, map_name)
+        :param frags: a list of tuples (frag_time, killer_name[, victim_name, weapon_code])
+        :param content_hash: optional hash of the content of the log file of the match, see hash_log_file
+        :param log_file_pathname: optional path of the log file of the match
+        :param on_duplicate: 'skip' or 'replace' the match if it has already been ingested
+        :param report: optional function called with a line of text before each new attempt
+        :return: a tuple (identifier of the match, status): 'inserted', 'replaced', or 'skipped' with the
+                 identifier of the match already ingested. (None, 'failed') if the database rejected it.
+        """
+        if on_duplicate not in ('skip', 'replace'):
+            raise ValueError('Unknown duplicate policy: %s' % on_duplicate)
+        delay = RETRY_DELAY
+        for attempt in range(1, INSERT_ATTEMPTS + 1):
+            try:
+                return self._insert_match(match, frags, content_hash, log_file_pathname, on_duplicate)
+            except self.get_transient_errors() as error:
+                if attempt == INSERT_ATTEMPTS or not self.is_transient_error(error):
+                    raise
+                metrics.increment('retries', backend=self.name)
+                if report is not None:
+                    report('%s, inserting the match again in %.1fs' % (error, delay))
+                time.sleep(delay)
+                delay *= 2
+
+    def _insert_match(self, match, frags, content_hash, log_file_pathname, on_duplicate):
+        raise NotImplementedError
+
+    def get_ingested_log_hashes(self):
+        """
+        :return: set of the content hashes of the logs already ingested
+        """
+        raise NotImplementedError
+
+    def rebuild_statistics(self):
+        """
+        Compute again the materialized statistics, the player index and the frag rollups from all the frags
+        """
+        raise NotImplementedError
+
+    def check_statistics(self):
+        """
+        :return: a tuple (missing_rows, unexpected_rows) of the differences between the materialized statistics,
+                 the player index and the frag rollups and the rows computed from the frags
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Matches stored in a SQLite database, see utilities.sqlite_util
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, target, batch_size=None, journal_mode=None, synchronous=None):
+        """
+        :param target: path of the SQLite database
+        :param journal_mode: optional sqlite journal mode, example: 'WAL'
+        :param synchronous: optional sqlite synchronous setting, example: 'NORMAL'
+        """
+        super().__init__(target, batch_size)
+        self.util = importlib.import_module('utilities.sqlite_util')
+        self.connection = self.util.create_connection(target)
+        if self.connection is None:
+            raise ValueError('Cannot open the SQLite database %s' % target)
+        self.util.set_pragmas(self.connection, journal_mode, synchronous)
+
+    def get_transient_errors(self):
+        return self.util.sqlite3.OperationalError,
+
+    def is_transient_error(self, error):
+        return is_sqlite_lock_error(error)
+
+    def _insert_match(self, match, frags, content_hash, log_file_pathname, on_duplicate):
+        return self.util.ingest_match_and_frags(self.connection, match, frags,
+                                                self.batch_size or self.util.FRAG_BATCH_SIZE, content_hash,
+                                                log_file_pathname, on_duplicate)
+
+    def get_ingested_log_hashes(self):
+        return self.util.get_ingested_log_hashes(self.connection)
+
+    def rebuild_statistics(self):
+        self.util.rebuild_match_statistics(self.connection)
+
+    def check_statistics(self):
+        missing_rows, unexpected_rows = self.util.check_match_statistics(self.connection)
+        for check_table in (self.util.check_player_index, self.util.check_frag_rollups):
+            missing_table_rows, unexpected_table_rows = check_table(self.connection)
+            missing_rows += missing_table_rows
+            unexpected_rows += unexpected_table_rows
+        return missing_rows, unexpected_rows
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class ShardedSQLiteBackend(StorageBackend):
+    """
+    Matches stored in one SQLite database per month of their start time, see utilities.shard_util.
+    The database of a month is opened when a match of the month is first inserted, and stays open.
+    """
+
+    name = 'sharded_sqlite'
+
+    def __init__(self, target, batch_size=None, journal_mode=None, synchronous=None):
+        """
+        :param target: directory of the databases of the months, created if it doesn't exist
+        :param journal_mode: optional sqlite journal mode of the databases, example: 'WAL'
+        :param synchronous: optional sqlite synchronous setting of the databases, example: 'NORMAL'
+        """
+        super().__init__(target, batch_size)
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.util = importlib.import_module('utilities.sqlite_util')
+        self.shard_util = importlib.import_module('utilities.shard_util')
+        os.makedirs(target, exist_ok=True)
+        # {(year, month): connection}
+        self.connections = {}
+
+    def get_connection(self, month):
+        """
+        :param month: a tuple (year, month)
+        :return: connection object of the database of the month, created if it doesn't exist yet
+        """
+        connection = self.connections.get(month)
+        if connection is None:
+            connection = self.shard_util.open_shard(self.target, month)
+            self.util.set_pragmas(connection, self.journal_mode, self.synchronous)
+            self.connections[month] = connection
+        return connection
+
+    def get_all_connections(self):
+        """
+        :return: list of the connections of the databases of all the months
+        """
+        return [self.get_connection(month) for month, _ in self.shard_util.find_shards(self.target)]
+
+    def get_transient_errors(self):
+        return self.util.sqlite3.OperationalError,
+
+    def is_transient_error(self, error):
+        return is_sqlite_lock_error(error)
+
+    def _insert_match(self, match, frags, content_hash, log_file_pathname, on_duplicate):
+        # A log has a single start time: the same log is always found again in the same month
+        return self.util.ingest_match_and_frags(self.get_connection(self.shard_util.get_shard_month(match[0])),
+                                                match, frags, self.batch_size or self.util.FRAG_BATCH_SIZE,
+                                                content_hash, log_file_pathname, on_duplicate)
+
+    def get_ingested_log_hashes(self):
+        ingested_log_hashes = set()
+        for connection in self.get_all_connections():
+            ingested_log_hashes |= self.util.get_ingested_log_hashes(connection)
+        return ingested_log_hashes
+
+    def rebuild_statistics(self):
+        for connection in self.get_all_connections():
+            self.util.rebuild_match_statistics(connection)
+
+    def check_statistics(self):
+        missing_rows, unexpected_rows = [], []
+        for connection in self.get_all_connections():
+            for check_table in (self.util.check_match_statistics, self.util.check_player_index,
+                                self.util.check_frag_rollups):
+                missing_table_rows, unexpected_table_rows = check_table(connection)
+                missing_rows += missing_table_rows
+                unexpected_rows += unexpected_table_rows
+        return missing_rows, unexpected_rows
+
+    def close(self):
+        for connection in self.connections.values():
+            connection.close()
+        self.connections = {}
+
+
+class PostgresBackend(StorageBackend):
+    """
+    Matches stored in a PostgreSQL database, see utilities.postgres_util. Each operation borrows a connection
+    from the pool shared by the backends of the same properties.
+    """
+
+    name = 'postgres'
+
+    def __init__(self, target, batch_size=None, method='copy'):
+        """
+        :param target: a tuple (hostname, database_name, username, password) of the PostgreSQL database
+        :param method: how frags are sent to the server: 'copy', 'values' or 'row',
+                       see postgres_util.insert_match_and_frags_postgres
+        """
+        super().__init__(tuple(target), batch_size)
+        self.method = method
+        self.util = importlib.import_module('utilities.postgres_util')
+        self.pool = self.util.get_postgres_pool(self.target)
+
+    def get_transient_errors(self):
+        # The server closed the connection, a serialization failure or a deadlock cancelled the transaction...
+        return self.util.psycopg2.OperationalError,
+
+    def _run(self, function, *args):
+        connection = self.pool.getconn()
+        try:
+            return function(connection, *args)
+        except self.get_transient_errors():
+            # The connection may be broken, it is closed instead of being given to the next operation
+            self.pool.putconn(connection, close=True)
+            connection = None
+            raise
+        finally:
+            if connection is not None:
+                self.pool.putconn(connection)
+
+    def _insert_match(self, match, frags, content_hash, log_file_pathname, on_duplicate):
+        return self._run(self.util.ingest_match_and_frags_postgres, match, frags, self.method,
+                         self.batch_size or self.util.FRAG_BATCH_SIZE, content_hash, log_file_pathname, on_duplicate)
+
+    def get_ingested_log_hashes(self):
+        return self._run(self.util.get_ingested_log_hashes_postgres)
+
+    def rebuild_statistics(self):
+        self._run(self.util.rebuild_match_statistics_postgres)
+
+    def check_statistics(self):
+        missing_rows, unexpected_rows = self._run(self.util.check_match_statistics_postgres)
+        for check_table in (self.util.check_player_index_postgres, self.util.check_frag_rollups_postgres):
+            missing_table_rows, unexpected_table_rows = self._run(check_table)
+            missing_rows += missing_table_rows
+            unexpected_rows += unexpected_table_rows
+        return missing_rows, unexpected_rows
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Matches kept in the memory of the process, for the tests and the benchmarks of the parsing and of
+    the ingestion without a database. The matches and the frags are in the matches and frags attributes,
+    by match id. The same logs are skipped or replaced as in the databases.
+    """
+
+    name = 'memory'
+
+    def __init__(self, target=None, batch_size=None):
+        super().__init__(target, batch_size)
+        self.matches = {}
+        self.frags = {}
+        # {content hash or (start_time, game_mode, map_name): match id}, as the ingested_log table
+        self._ingested_matches = {}
+        self._next_match_id = 1
+
+    def _insert_match(self, match, frags, content_hash, log_file_pathname, on_duplicate):
+        start_time, _, game_mode, map_name = match
+        keys = [(start_time, game_mode, map_name)] + ([content_hash] if content_hash is not None else [])
+        ingested_match_id = next((self._ingested_matches[key] for key in keys if key in self._ingested_matches),
+                                 None)
+        if ingested_match_id is not None:
+            if on_duplicate == 'skip':
+                return ingested_match_id, 'skipped'
+            self.delete_match(ingested_match_id)
+
+        match_id = self._next_match_id
+        self._next_match_id += 1
+        self.matches[match_id] = {'match': match, 'content_hash': content_hash,
+                                  'log_file_pathname': log_file_pathname}
+        self.frags[match_id] = list(frags)
+        for key in keys:
+            self._ingested_matches[key] = match_id
+        metrics.increment('rows_written', len(frags), backend=self.name, table='match_frag')
+        return match_id, 'inserted' if ingested_match_id is None else 'replaced'
+
+    def delete_match(self, match_id):
+        """
+        :param match_id: identifier of the match to delete with its frags
+        """
+        del self.matches[match_id], self.frags[match_id]
+        for key, ingested_match_id in list(self._ingested_matches.items()):
+            if ingested_match_id == match_id:
+                del self._ingested_matches[key]
+
+    def get_ingested_log_hashes(self):
+        return {match['content_hash'] for match in self.matches.values() if match['content_hash'] is not None}
+
+    def rebuild_statistics(self):
+        # The statistics are computed from the frags when they are needed
+        pass
+
+    def check_statistics(self):
+        return [], []
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend,
+    'sharded_sqlite': ShardedSQLiteBackend,
+    'postgres': PostgresBackend,
+    'memory': MemoryBackend,
+}
+
+
+def register_backend(name, backend_class):
+    """
+    :param name: name the backend is opened with, see open_backend
+    :param backend_class: a subclass of StorageBackend
+    """
+    BACKENDS[name] = backend_class
+
+
+def open_backend(name, target=None, **options):
+    """
+    :param name: name of the backend: 'sqlite', 'sharded_sqlite', 'postgres', 'memory' or one added
+                 with register_backend
+    :param target: path of the SQLite database, directory of the sharded SQLite databases, properties of
+                   the PostgreSQL database..., see the backend classes
+    :param options: options of the backend, example: journal_mode='WAL' for 'sqlite', method='values' for 'postgres'
+    :return: the opened StorageBackend, to be closed when it is not needed anymore.
+             Raises ImportError if the driver of the backend isn't installed
+    """
+    backend_class = BACKENDS.get(name)
+    if backend_class is None:
+        raise ValueError('Unknown storage backend: %s' % name)
+    try:
+        return backend_class(target, **options)
+    except ImportError as error:
+        metrics.increment('errors', stage='open_backend')
+        print('The driver of the %s backend is not installed: %s' % (name, error))
+        raise
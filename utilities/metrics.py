@@ -0,0 +1,269 @@
+import json
+import sys
+import threading
+import time
+from functools import wraps
+
+# Instrumentation of the parse -> insert pipeline: timers per stage and counters (bytes read, lines
+# scanned, frags parsed, rows written). Nothing is recorded until enable_metrics is called, the hooks
+# only check a flag before calling the instrumented function. Hooks are placed around whole files,
+# matches or batches, never inside the loops over lines or frags.
+
+_enabled = False
+_sinks = []
+_lock = threading.Lock()
+# {(name, ((label, value), ...)): value}
+_counters = {}
+# {stage: [count, total_seconds, max_seconds]}
+_timers = {}
+
+
+def is_enabled():
+    """
+    :return: True if the metrics are being recorded
+    """
+    return _enabled
+
+
+def enable_metrics(*sinks):
+    """
+    Start recording metrics.
+    :param sinks: functions called with the snapshot of the metrics by flush_metrics,
+                  see log_sink, json_file_sink and prometheus_text_sink
+    """
+    global _enabled
+    _sinks[:] = sinks
+    _enabled = True
+
+
+def disable_metrics():
+    """
+    Stop recording metrics, the metrics recorded so far are dropped
+    """
+    global _enabled
+    _enabled = False
+    del _sinks[:]
+    collect()
+
+
+def increment(name, value=1, **labels):
+    """
+    :param name: name of the counter, example: 'rows_written'
+    :param value: number to add to the counter
+    :param labels: labels of the counter, example: table='match_frag'
+    """
+    if not _enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(stage, seconds):
+    """
+    :param stage: name of the stage, example: 'parse_log_record'
+    :param seconds: time spent in the stage
+    """
+    if not _enabled:
+        return
+    with _lock:
+        timer = _timers.get(stage)
+        if timer is None:
+            _timers[stage] = [1, seconds, seconds]
+        else:
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+
+def timed(stage):
+    """
+    Decorator recording the latency of each call of a function under the name of a stage
+    :param stage: name of the stage
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count_items(name, iterable, **labels):
+    """
+    :param name: name of the counter incremented with the number of items of the iterable
+    :param iterable: an iterable, example: the lines of a log file
+    :param labels: labels of the counter
+    :return: the iterable itself when the metrics are disabled, otherwise a generator of its items
+             which increments the counter once the iteration stops
+    """
+    if not _enabled:
+        return iterable
+    return _count_items(name, iterable, labels)
+
+
+def _count_items(name, iterable, labels):
+    count = 0
+    try:
+        for item in iterable:
+            count += 1
+            yield item
+    finally:
+        increment(name, count, **labels)
+
+
+def collect(reset=True):
+    """
+    :param reset: True to restart the counters and timers from zero
+    :return: snapshot of the metrics:
+        {
+            'counters': [{'name': 'rows_written', 'labels': {'table': 'match_frag'}, 'value': 1445}, ...],
+            'timers': {'parse_log_record': {'count': 11, 'total_seconds': 0.04, 'max_seconds': 0.01}, ...}
+        }
+    """
+    with _lock:
+        snapshot = {
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in sorted(_counters.items())],
+            'timers': {stage: {'count': count, 'total_seconds': total_seconds, 'max_seconds': max_seconds}
+                       for stage, (count, total_seconds, max_seconds) in sorted(_timers.items())},
+        }
+        if reset:
+            _counters.clear()
+            _timers.clear()
+    return snapshot
+
+
+def merge(snapshot):
+    """
+    Add the metrics of a snapshot, collected in another process, to the metrics of this process
+    :param snapshot: snapshot returned by collect
+    """
+    if not _enabled or not snapshot:
+        return
+    for counter in snapshot['counters']:
+        increment(counter['name'], counter['value'], **counter['labels'])
+    with _lock:
+        for stage, other in snapshot['timers'].items():
+            timer = _timers.setdefault(stage, [0, 0.0, 0.0])
+            timer[0] += other['count']
+            timer[1] += other['total_seconds']
+            timer[2] = max(timer[2], other['max_seconds'])
+
+
+def flush_metrics():
+    """
+    Send the metrics recorded since the last flush to the sinks
+    :return: the snapshot sent, see collect
+    """
+    snapshot = collect()
+    for sink in _sinks:
+        sink(snapshot)
+    return snapshot
+
+
+def format_log_lines(snapshot):
+    """
+    :param snapshot: snapshot returned by collect
+    :return: list of structured log lines, one per counter and per timer:
+             'metric=rows_written table=match_frag value=1445'
+             'stage=parse_log_record count=11 total_seconds=0.040000 max_seconds=0.010000'
+    """
+    lines = []
+    for counter in snapshot['counters']:
+        labels = ''.join(' %s=%s' % item for item in sorted(counter['labels'].items()))
+        lines.append('metric=%s%s value=%s' % (counter['name'], labels, counter['value']))
+    for stage, timer in snapshot['timers'].items():
+        lines.append('stage=%s count=%d total_seconds=%.6f max_seconds=%.6f'
+                     % (stage, timer['count'], timer['total_seconds'], timer['max_seconds']))
+    return lines
+
+
+def format_prometheus_text(snapshot, prefix='farcry_'):
+    """
+    :param snapshot: snapshot returned by collect
+    :param prefix: prefix of the metric names
+    :return: the metrics in the Prometheus text exposition format
+    """
+    def format_labels(labels):
+        if not labels:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                                 for key, value in sorted(labels.items()))
+
+    lines = []
+    typed_names = set()
+    for counter in snapshot['counters']:
+        metric_name = '%s%s_total' % (prefix, counter['name'])
+        if metric_name not in typed_names:
+            typed_names.add(metric_name)
+            lines.append('# TYPE %s counter' % metric_name)
+        lines.append('%s%s %s' % (metric_name, format_labels(counter['labels']), counter['value']))
+    if snapshot['timers']:
+        metric_name = '%sstage_seconds' % prefix
+        lines.append('# TYPE %s summary' % metric_name)
+        for stage, timer in snapshot['timers'].items():
+            labels = format_labels({'stage': stage})
+            lines.append('%s_count%s %d' % (metric_name, labels, timer['count']))
+            lines.append('%s_sum%s %.6f' % (metric_name, labels, timer['total_seconds']))
+        lines.append('# TYPE %sstage_max_seconds gauge' % prefix)
+        for stage, timer in snapshot['timers'].items():
+            lines.append('%sstage_max_seconds%s %.6f' % (prefix, format_labels({'stage': stage}),
+                                                         timer['max_seconds']))
+    return '\n'.join(lines) + '\n'
+
+
+def log_sink(stream=None):
+    """
+    :param stream: file object the lines are written to, sys.stderr if None
+    :return: a sink writing the metrics as structured log lines, see format_log_lines
+    """
+    def sink(snapshot):
+        output = stream or sys.stderr
+        for line in format_log_lines(snapshot):
+            print(line, file=output)
+    return sink
+
+
+def json_file_sink(file_pathname):
+    """
+    :param file_pathname: JSON file the snapshot is written to, replaced at each flush
+    :return: a sink writing the metrics into a JSON file
+    """
+    def sink(snapshot):
+        with open(file_pathname, 'w') as json_file:
+            json.dump(snapshot, json_file, indent=2)
+    return sink
+
+
+def prometheus_text_sink(file_pathname):
+    """
+    :param file_pathname: text file the metrics are written to, replaced at each flush,
+                          for example in the directory of the textfile collector of the node exporter
+    :return: a sink writing the metrics in the Prometheus text format
+    """
+    def sink(snapshot):
+        with open(file_pathname, 'w') as text_file:
+            text_file.write(format_prometheus_text(snapshot))
+    return sink
+
+
+def create_sink(description):
+    """
+    :param description: 'log', 'json:PATH' or 'prometheus:PATH'
+    :return: the sink described
+    """
+    kind, _, file_pathname = description.partition(':')
+    if kind == 'log' and not file_pathname:
+        return log_sink()
+    if kind == 'json' and file_pathname:
+        return json_file_sink(file_pathname)
+    if kind == 'prometheus' and file_pathname:
+        return prometheus_text_sink(file_pathname)
+    raise ValueError('Unknown metrics sink: %s, expected log, json:PATH or prometheus:PATH' % description)
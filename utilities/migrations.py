@@ -0,0 +1,236 @@
+from datetime import datetime, timezone
+
+# Versioned schema changes of the Far Cry database. Each migration is a tuple
+# (version, description, steps) where steps maps a backend ('sqlite' or 'postgres') to the list of
+# SQL statements, or functions called with the connection, that upgrade the schema to this version.
+# A backend without steps for a migration only records its version.
+
+
+def convert_sqlite_times_to_epochs(conn):
+    """
+    Store the times of the SQLite database as integer seconds since the epoch instead of TEXT
+    ('2018-11-09 12:25:18-05:00'). The time zone of a match is kept in match.utc_offset, in minutes.
+    SQLite can't change the type of a column, so the tables are rebuilt. The views are dropped while
+    their tables don't exist and created again at the end.
+    :param conn: connection object of sqlite database
+    """
+    views = conn.execute(''' SELECT name, sql FROM sqlite_master WHERE type = 'view' ''').fetchall()
+    for view_name, _ in views:
+        conn.execute(''' DROP VIEW "%s" ''' % view_name)
+
+    conn.execute(''' CREATE TABLE match_epoch (
+                         match_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,
+                         start_time INTEGER NOT NULL,
+                         end_time INTEGER NOT NULL,
+                         game_mode TEXT NOT NULL,
+                         map_name TEXT NOT NULL,
+                         utc_offset INTEGER NOT NULL DEFAULT 0
+                     ) ''')
+    # SQLite date functions understand the time zone suffix of the TEXT times and convert them to UTC
+    conn.execute(''' INSERT INTO match_epoch(match_id, start_time, end_time, game_mode, map_name, utc_offset)
+                     SELECT match_id,
+                            CAST(strftime('%s', start_time) AS INTEGER),
+                            CAST(strftime('%s', end_time) AS INTEGER),
+                            game_mode,
+                            map_name,
+                            CASE WHEN length(start_time) > 19
+                                 THEN CAST(substr(start_time, -6, 3) AS INTEGER) * 60
+                                      + (CASE WHEN substr(start_time, -6, 1) = '-' THEN -1 ELSE 1 END)
+                                      * CAST(substr(start_time, -2) AS INTEGER)
+                                 ELSE 0 END
+                     FROM match ''')
+    conn.execute(''' CREATE TABLE match_frag_epoch (
+                         match_id INTEGER NOT NULL,
+                         frag_time INTEGER NOT NULL,
+                         killer_name TEXT NOT NULL,
+                         victim_name TEXT,
+                         weapon_code TEXT,
+                         FOREIGN KEY(match_id) REFERENCES match(match_id) ON UPDATE CASCADE
+                     ) ''')
+    conn.execute(''' INSERT INTO match_frag_epoch(match_id, frag_time, killer_name, victim_name, weapon_code)
+                     SELECT match_id, CAST(strftime('%s', frag_time) AS INTEGER), killer_name, victim_name, weapon_code
+                     FROM match_frag ORDER BY rowid ''')
+    conn.execute(''' DROP TABLE match_frag ''')
+    conn.execute(''' DROP TABLE match ''')
+    conn.execute(''' ALTER TABLE match_epoch RENAME TO match ''')
+    conn.execute(''' ALTER TABLE match_frag_epoch RENAME TO match_frag ''')
+
+    ingested_log = conn.execute(''' SELECT 1 FROM sqlite_master
+                                    WHERE type = 'table' AND name = 'ingested_log' ''').fetchone()
+    if ingested_log:
+        conn.execute(''' ALTER TABLE ingested_log RENAME TO ingested_log_text ''')
+        conn.execute(''' CREATE TABLE ingested_log (
+                             match_id INTEGER NOT NULL PRIMARY KEY,
+                             content_hash TEXT UNIQUE,
+                             start_time INTEGER NOT NULL,
+                             game_mode TEXT NOT NULL,
+                             map_name TEXT NOT NULL,
+                             log_file_pathname TEXT,
+                             UNIQUE(start_time, game_mode, map_name),
+                             FOREIGN KEY(match_id) REFERENCES match(match_id) ON DELETE CASCADE
+                         ) ''')
+        conn.execute(''' INSERT INTO ingested_log(match_id, content_hash, start_time, game_mode, map_name,
+                                                  log_file_pathname)
+                         SELECT match_id, content_hash, CAST(strftime('%s', start_time) AS INTEGER), game_mode,
+                                map_name, log_file_pathname
+                         FROM ingested_log_text ''')
+        conn.execute(''' DROP TABLE ingested_log_text ''')
+
+    for _, view_sql in views:
+        conn.execute(view_sql)
+
+
+MIGRATIONS = [
+    (1, 'base schema', {
+        'sqlite': [
+            ''' CREATE TABLE IF NOT EXISTS match (
+                    match_id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT UNIQUE,
+                    start_time TEXT NOT NULL,
+                    end_time TEXT NOT NULL,
+                    game_mode TEXT NOT NULL,
+                    map_name TEXT NOT NULL
+                ) ''',
+            ''' CREATE TABLE IF NOT EXISTS match_frag (
+                    match_id INTEGER NOT NULL,
+                    frag_time TEXT NOT NULL,
+                    killer_name TEXT NOT NULL,
+                    victim_name TEXT,
+                    weapon_code TEXT,
+                    FOREIGN KEY(match_id) REFERENCES match(match_id) ON UPDATE CASCADE
+                ) ''',
+        ],
+        'postgres': [
+            ''' CREATE EXTENSION IF NOT EXISTS "uuid-ossp"; ''',
+            ''' CREATE TABLE IF NOT EXISTS match (
+                    match_id uuid NOT NULL DEFAULT uuid_generate_v1() PRIMARY KEY,
+                    start_time TIMESTAMPTZ(3) NOT NULL,
+                    end_time TIMESTAMPTZ(3) NOT NULL,
+                    game_mode TEXT NOT NULL,
+                    map_name TEXT NOT NULL
+                ); ''',
+            ''' CREATE TABLE IF NOT EXISTS match_frag (
+                    match_id uuid NOT NULL REFERENCES match(match_id) ON UPDATE CASCADE,
+                    frag_time TIMESTAMPTZ(3) NOT NULL,
+                    killer_name TEXT NOT NULL,
+                    victim_name TEXT,
+                    weapon_code TEXT
+                ); ''',
+        ],
+    }),
+    (2, 'integer epoch times in SQLite', {
+        'sqlite': [convert_sqlite_times_to_epochs],
+    }),
+    (3, 'covering indexes of match_frag for the per-match and per-player queries', {
+        'sqlite': [
+            ''' CREATE INDEX IF NOT EXISTS idx_match_frag_match_id
+                ON match_frag(match_id, killer_name, victim_name, weapon_code) ''',
+            ''' CREATE INDEX IF NOT EXISTS idx_match_frag_killer_name
+                ON match_frag(killer_name, victim_name, match_id) ''',
+            ''' CREATE INDEX IF NOT EXISTS idx_match_frag_victim_name
+                ON match_frag(victim_name, killer_name, match_id) ''',
+        ],
+        'postgres': [
+            ''' CREATE INDEX IF NOT EXISTS idx_match_frag_match_id
+                ON match_frag(match_id, killer_name, victim_name, weapon_code); ''',
+            ''' CREATE INDEX IF NOT EXISTS idx_match_frag_killer_name
+                ON match_frag(killer_name, victim_name, match_id); ''',
+            ''' CREATE INDEX IF NOT EXISTS idx_match_frag_victim_name
+                ON match_frag(victim_name, killer_name, match_id); ''',
+        ],
+    }),
+]
+
+SCHEMA_VERSION_TABLE = {
+    'sqlite': ''' CREATE TABLE IF NOT EXISTS schema_version (
+                      version INTEGER NOT NULL PRIMARY KEY,
+                      description TEXT NOT NULL,
+                      applied_at TEXT NOT NULL
+                  ) ''',
+    'postgres': ''' CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER NOT NULL PRIMARY KEY,
+                        description TEXT NOT NULL,
+                        applied_at TIMESTAMPTZ NOT NULL
+                    ); ''',
+}
+
+PLACEHOLDERS = {'sqlite': '?', 'postgres': '%s'}
+
+
+def get_schema_version(connection, backend):
+    """
+    :param connection: connection object of the sqlite or postgresql database
+    :param backend: 'sqlite' or 'postgres'
+    :return: version of the last migration applied to the database, 0 if none
+    """
+    cur = connection.cursor()
+    cur.execute(SCHEMA_VERSION_TABLE[backend])
+    cur.execute(''' SELECT MAX(version) FROM schema_version ''')
+    version = cur.fetchone()[0]
+    cur.close()
+    return version or 0
+
+
+def get_pending_versions(connection, backend):
+    """
+    :param connection: connection object of the sqlite or postgresql database
+    :param backend: 'sqlite' or 'postgres'
+    :return: list of the versions of the migrations the database doesn't have yet
+    """
+    current_version = get_schema_version(connection, backend)
+    return [version for version, _, _ in MIGRATIONS if version > current_version]
+
+
+def migrate(connection, backend, target_version=None, commit=True):
+    """
+    Apply the migrations the database doesn't have yet, each one in its own transaction.
+    :param connection: connection object of the sqlite or postgresql database
+    :param backend: 'sqlite' or 'postgres'
+    :param target_version: last version to apply, all of them if None
+    :param commit: False to leave the migrations in the current transaction, to roll them back
+                   (PostgreSQL only)
+    :return: list of the versions that have been applied
+    """
+    if backend not in PLACEHOLDERS:
+        raise ValueError('Unknown database backend: %s' % backend)
+
+    # sqlite3 doesn't open transactions before DDL statements, they are handled explicitly here
+    isolation_level = connection.isolation_level if backend == 'sqlite' else None
+    if backend == 'sqlite':
+        connection.isolation_level = None
+
+    applied_versions = []
+    try:
+        current_version = get_schema_version(connection, backend)
+        for version, description, steps in MIGRATIONS:
+            if version <= current_version or (target_version is not None and version > target_version):
+                continue
+            cur = connection.cursor()
+            if backend == 'sqlite':
+                cur.execute('BEGIN')
+            try:
+                for step in steps.get(backend, []):
+                    if callable(step):
+                        step(connection)
+                    else:
+                        cur.execute(step)
+                cur.execute(''' INSERT INTO schema_version(version, description, applied_at) VALUES({0}, {0}, {0}) '''
+                            .format(PLACEHOLDERS[backend]),
+                            (version, description, datetime.now(timezone.utc).isoformat(' ')))
+                if backend == 'sqlite':
+                    cur.execute('COMMIT')
+                elif commit:
+                    connection.commit()
+            except Exception:
+                if backend == 'sqlite':
+                    cur.execute('ROLLBACK')
+                else:
+                    connection.rollback()
+                raise
+            finally:
+                cur.close()
+            applied_versions.append(version)
+    finally:
+        if backend == 'sqlite':
+            connection.isolation_level = isolation_level
+
+    return applied_versions
@@ -0,0 +1,191 @@
+import os
+from datetime import timezone
+
+# Columnar export of the frags and matches, for the analysts loading whole seasons into pandas:
+#     pandas.read_parquet('./export/frags', filters=[('map_name', '=', 'mp_surf')])
+# Each match is written into its own files, named after the content hash of its log, so matches are
+# appended without rewriting the files already exported and exporting a log again replaces its files:
+#     <directory>/frags/match_date=2019-03-01/map_name=mp_surf/<content_hash>.parquet
+#     <directory>/matches/match_date=2019-03-01/map_name=mp_surf/<content_hash>.parquet
+# match_date is the date of the start of the match in the time zone of the server.
+# pyarrow is only imported when the files are written or read, it isn't needed for the rest of the package.
+
+FRAG_DATASET = 'frags'
+MATCH_DATASET = 'matches'
+PARQUET_COMPRESSION = 'zstd'
+
+
+def import_pyarrow():
+    """
+    :return: the pyarrow module, raises ImportError if it isn't installed
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        print('pyarrow is required to export Parquet files: pip install pyarrow')
+        raise
+    return pyarrow
+
+
+def get_frag_schema(pyarrow):
+    """
+    :return: schema of the frag files. victim_name and weapon_code are null for suicides,
+             utc_offset is the time zone of the server in minutes
+    """
+    return pyarrow.schema([
+        pyarrow.field('match_id', pyarrow.string(), nullable=False),
+        pyarrow.field('frag_time', pyarrow.timestamp('s', tz='UTC'), nullable=False),
+        pyarrow.field('utc_offset', pyarrow.int16(), nullable=False),
+        pyarrow.field('killer_name', pyarrow.string(), nullable=False),
+        pyarrow.field('victim_name', pyarrow.string()),
+        pyarrow.field('weapon_code', pyarrow.string()),
+    ])
+
+
+def get_match_schema(pyarrow):
+    """
+    :return: schema of the match files. The map name, as the match date, is the name of the
+             partition directory of the file, see get_partition_directory
+    """
+    return pyarrow.schema([
+        pyarrow.field('match_id', pyarrow.string(), nullable=False),
+        pyarrow.field('start_time', pyarrow.timestamp('s', tz='UTC'), nullable=False),
+        pyarrow.field('end_time', pyarrow.timestamp('s', tz='UTC'), nullable=False),
+        pyarrow.field('utc_offset', pyarrow.int16(), nullable=False),
+        pyarrow.field('game_mode', pyarrow.string(), nullable=False),
+        pyarrow.field('frag_count', pyarrow.int32(), nullable=False),
+        pyarrow.field('log_file_pathname', pyarrow.string()),
+    ])
+
+
+def get_utc_offset(time):
+    """
+    :param time: a datetime.datetime object with time zone information
+    :return: the offset of its time zone in minutes
+    """
+    return int(time.utcoffset().total_seconds()) // 60
+
+
+def get_partition_directory(directory, dataset, match):
+    """
+    :param directory: root directory of the export
+    :param dataset: FRAG_DATASET or MATCH_DATASET
+    :param match: a tuple (start_time, end_time, game_mode, map_name)
+    :return: directory of the files of the match in the dataset
+    """
+    return os.path.join(directory, dataset, 'match_date=%s' % match[0].date().isoformat(), 'map_name=%s' % match[3])
+
+
+def build_frag_table(pyarrow, match_id, frags):
+    """
+    :param match_id: identifier of the match of the frags
+    :param frags: list of tuples (frag_time, killer_name[, victim_name, weapon_code]), as returned by parse_frags
+    :return: a pyarrow.Table of the frags, see get_frag_schema
+    """
+    columns = [
+        [match_id] * len(frags),
+        [int(frag[0].timestamp()) for frag in frags],
+        [get_utc_offset(frag[0]) for frag in frags],
+        [frag[1] for frag in frags],
+        [frag[2] if len(frag) == 4 else None for frag in frags],
+        [frag[3] if len(frag) == 4 else None for frag in frags],
+    ]
+    return pyarrow.Table.from_arrays([pyarrow.array(column, type=field.type)
+                                      for column, field in zip(columns, get_frag_schema(pyarrow))],
+                                     schema=get_frag_schema(pyarrow))
+
+
+def build_match_table(pyarrow, match_id, match, frag_count, log_file_pathname=None):
+    """
+    :param match_id: identifier of the match
+    :param match: a tuple (start_time, end_time, game_mode, map_name)
+    :param frag_count: number of frags of the match
+    :param log_file_pathname: path of the log file of the match
+    :return: a pyarrow.Table of a single row describing the match, see get_match_schema
+    """
+    start_time, end_time, game_mode, _ = match
+    return pyarrow.Table.from_pylist([{
+        'match_id': match_id,
+        'start_time': start_time.astimezone(timezone.utc),
+        'end_time': end_time.astimezone(timezone.utc),
+        'utc_offset': get_utc_offset(start_time),
+        'game_mode': game_mode,
+        'frag_count': frag_count,
+        'log_file_pathname': log_file_pathname,
+    }], schema=get_match_schema(pyarrow))
+
+
+def write_table(pyarrow, table, file_pathname, compression):
+    """
+    Write a table into a Parquet file. The file is written under a hidden temporary name, ignored by
+    the dataset readers, and renamed, so a reader of the dataset never sees a partial file.
+    """
+    file_directory, file_name = os.path.split(file_pathname)
+    os.makedirs(file_directory, exist_ok=True)
+    temporary_pathname = os.path.join(file_directory, '.%s.tmp' % file_name)
+    pyarrow.parquet.write_table(table, temporary_pathname, compression=compression)
+    os.replace(temporary_pathname, file_pathname)
+
+
+def export_match_parquet(directory, content_hash, match, frags, match_id=None, log_file_pathname=None,
+                         compression=PARQUET_COMPRESSION):
+    """
+    :param directory: root directory of the export
+    :param content_hash: content hash of the log file of the match, names the files of the match
+    :param match: a tuple (start_time, end_time, game_mode, map_name) of datetime.datetime objects
+                  with time zone information, the game mode and the map name
+    :param frags: list of the frags of the match, as returned by parse_frags
+    :param match_id: identifier of the match in the database, defaults to content_hash
+    :param log_file_pathname: path of the log file of the match
+    :param compression: Parquet compression codec: 'zstd', 'snappy', 'gzip'...
+    :return: a tuple (pathname of the frag file, pathname of the match file)
+    """
+    pyarrow = import_pyarrow()
+    match_id = str(match_id) if match_id is not None else content_hash
+    file_name = '%s.parquet' % content_hash
+
+    frag_pathname = os.path.join(get_partition_directory(directory, FRAG_DATASET, match), file_name)
+    write_table(pyarrow, build_frag_table(pyarrow, match_id, frags), frag_pathname, compression)
+    # The match file is written last: a match listed in the matches dataset has all its frags exported
+    match_pathname = os.path.join(get_partition_directory(directory, MATCH_DATASET, match), file_name)
+    write_table(pyarrow, build_match_table(pyarrow, match_id, match, len(frags), log_file_pathname),
+                match_pathname, compression)
+    return frag_pathname, match_pathname
+
+
+def get_exported_log_hashes(directory):
+    """
+    :param directory: root directory of the export
+    :return: set of the content hashes of the logs whose match has been exported
+    """
+    log_hashes = set()
+    for _, _, file_names in os.walk(os.path.join(directory, MATCH_DATASET)):
+        log_hashes.update(file_name[:-len('.parquet')] for file_name in file_names if file_name.endswith('.parquet'))
+    return log_hashes
+
+
+def read_parquet_dataset(directory, dataset=FRAG_DATASET, columns=None, filters=None):
+    """
+    :param directory: root directory of the export
+    :param dataset: FRAG_DATASET or MATCH_DATASET
+    :param columns: list of the columns to read, all of them if None
+    :param filters: pyarrow filters on the columns and the partitions,
+                    example: [('match_date', '>=', '2019-03-01'), ('map_name', '=', 'mp_surf')]
+    :return: a pyarrow.Table of the rows of the dataset, match_date and map_name included.
+             Call to_pandas() on it for a DataFrame.
+    """
+    pyarrow = import_pyarrow()
+    import pyarrow.dataset
+
+    dataset_directory = os.path.join(directory, dataset)
+    if not os.path.isdir(dataset_directory):
+        raise FileNotFoundError('No %s exported in %s' % (dataset, directory))
+    schema = get_frag_schema(pyarrow) if dataset == FRAG_DATASET else get_match_schema(pyarrow)
+    partitioning = pyarrow.dataset.partitioning(
+        pyarrow.schema([('match_date', pyarrow.string()), ('map_name', pyarrow.string())]), flavor='hive')
+    schema = pyarrow.unify_schemas([schema, partitioning.schema])
+    parquet_dataset = pyarrow.dataset.dataset(dataset_directory, schema=schema, format='parquet',
+                                              partitioning=partitioning)
+    expression = pyarrow.parquet.filters_to_expression(filters) if filters else None
+    return parquet_dataset.to_table(columns=columns, filter=expression)
@@ -1,4 +1,22 @@
+import io
+from itertools import groupby
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+from utilities import metrics
+from utilities.migrations import migrate
+from utilities.query_cache import invalidate_match
+from utilities.statistics_util import MATCH_STATISTICS_QUERY, count_player_frags, compare_match_statistics, \
+    build_lucky_luke_query, \
+    PLAYER_INDEX_TABLES, build_counter_upsert, build_counter_cleanup, count_player_index, \
+    compare_player_index, build_player_profile, FRAG_ROLLUP_TABLE, count_frag_rollups, build_frag_rollup_query, \
+    get_frag_rollup_parameters, group_frag_rollups
+
+# Number of frags sent to the server in each COPY or execute_values statement
+FRAG_BATCH_SIZE = 5000
+
+# Connection pools shared by all the matches inserted in the same process, by connection properties
+_connection_pools = {}
 
 
 def create_postgres_connection(properties):
@@ -16,6 +34,7 @@ def create_postgres_connection(properties):
     return connection
 
 
+@metrics.timed('insert_match_postgres')
 def insert_match_postgres(connection, match):
     """
     :param connection: connection object of postgresql database
@@ -29,9 +48,12 @@ def insert_match_postgres(connection, match):
     match_id = cur.fetchone()[0]
     connection.commit()
     cur.close()
+    metrics.increment('rows_written', backend='postgres', table='match')
+    invalidate_match(match_id)
     return match_id
 
 
+@metrics.timed('insert_frag_postgres')
 def insert_frag_postgres(connection, match_id, frags):
     """
     :param connection: connection object of postgresql database
@@ -48,3 +70,644 @@ def insert_frag_postgres(connection, match_id, frags):
         cur.execute(sql, full_frag)
     connection.commit()
     cur.close()
+    metrics.increment('rows_written', len(frags), backend='postgres', table='match_frag')
+    invalidate_match(match_id)
+
+
+def get_postgres_pool(properties, minconn=1, maxconn=4):
+    """
+    :param properties: a tuple of the following form: (hostname, database_name, username, password),
+                       see create_postgres_connection
+    :param minconn: number of connections opened when the pool is created
+    :param maxconn: maximum number of connections kept by the pool
+    :return: the connection pool of these properties. The pool is created on first use and
+             then reused, so the connections are shared across matches. The schema of the database
+             is upgraded to the last version when the pool is created, see utilities.migrations
+    """
+    pool = _connection_pools.get(properties)
+    if pool is None or pool.closed:
+        pool = psycopg2.pool.ThreadedConnectionPool(
+            minconn, maxconn,
+            host=properties[0], database=properties[1], user=properties[2], password=properties[3]
+        )
+        connection = pool.getconn()
+        try:
+            migrate(connection, 'postgres')
+        finally:
+            pool.putconn(connection)
+        _connection_pools[properties] = pool
+    return pool
+
+
+def close_postgres_pools():
+    """
+    Close all the connections of all the pools created by get_postgres_pool
+    """
+    for pool in _connection_pools.values():
+        if not pool.closed:
+            pool.closeall()
+    _connection_pools.clear()
+
+
+def copy_escape(value):
+    """
+    :param value: a value of a frag column
+    :return: the value in PostgreSQL COPY text format, None is written as \\N
+    """
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def build_full_frags(match_id, frags):
+    """
+    :param match_id: match id of frags in format uuid
+    :param frags: a list of tuple in format of: (frag_time, killer_name[, victim_name, weapon_code])
+    :return: a generator of tuples (match_id, frag_time, killer_name, victim_name, weapon_code)
+    """
+    for frag in frags:
+        full_frag = (match_id,) + frag
+        if len(full_frag) < 5:
+            full_frag = full_frag + (None, None)
+        yield full_frag
+
+
+def iter_frag_batches(match_id, frags, batch_size=FRAG_BATCH_SIZE):
+    """
+    :param match_id: match id of frags in format uuid
+    :param frags: a list of tuple in format of: (frag_time, killer_name[, victim_name, weapon_code])
+    :param batch_size: maximum number of frags in each batch
+    :return: a generator of lists of at most batch_size full frags
+    """
+    batch = []
+    for full_frag in build_full_frags(match_id, frags):
+        batch.append(full_frag)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+@metrics.timed('copy_frag_postgres')
+def copy_frag_postgres(connection, match_id, frags, batch_size=FRAG_BATCH_SIZE):
+    """
+    Stream frags into the match_frag table with COPY FROM STDIN, without committing.
+    Only one batch of frags is rendered in memory at a time.
+    :param connection: connection object of postgresql database
+    :param match_id: match id of frags to be inserted in format uuid
+    :param frags: a list of tuple in format of: (frag_time, killer_name[, victim_name, weapon_code])
+    :param batch_size: number of frags sent in each COPY statement
+    :return: number of inserted frags
+    """
+    sql = """ COPY match_frag(match_id, frag_time, killer_name, victim_name, weapon_code) FROM STDIN """
+    cur = connection.cursor()
+    frag_count = 0
+    for batch in iter_frag_batches(match_id, frags, batch_size):
+        buffer = io.StringIO()
+        for full_frag in batch:
+            buffer.write('\t'.join(map(copy_escape, full_frag)) + '\n')
+        buffer.seek(0)
+        cur.copy_expert(sql, buffer)
+        frag_count += len(batch)
+    cur.close()
+    metrics.increment('rows_written', frag_count, backend='postgres', table='match_frag')
+    return frag_count
+
+
+@metrics.timed('insert_frag_values_postgres')
+def insert_frag_values_postgres(connection, match_id, frags, batch_size=FRAG_BATCH_SIZE):
+    """
+    Insert frags into the match_frag table with multi-row INSERT statements, without committing.
+    :param connection: connection object of postgresql database
+    :param match_id: match id of frags to be inserted in format uuid
+    :param frags: a list of tuple in format of: (frag_time, killer_name[, victim_name, weapon_code])
+    :param batch_size: number of frags sent in each INSERT statement
+    :return: number of inserted frags
+    """
+    sql = """ INSERT INTO match_frag(match_id, frag_time, killer_name, victim_name, weapon_code)
+                VALUES %s """
+    cur = connection.cursor()
+    frag_count = 0
+    for batch in iter_frag_batches(match_id, frags, batch_size):
+        psycopg2.extras.execute_values(cur, sql, batch, page_size=batch_size)
+        frag_count += len(batch)
+    cur.close()
+    metrics.increment('rows_written', frag_count, backend='postgres', table='match_frag')
+    return frag_count
+
+
+def insert_match_and_frags_postgres(connection, match, frags, method='copy', batch_size=FRAG_BATCH_SIZE,
+                                    content_hash=None, log_file_pathname=None, on_duplicate='skip'):
+    """
+    Same as ingest_match_and_frags_postgres, without the status.
+    :return: match_id of inserted match in format uuid, the one of the match already ingested if it is skipped
+    """
+    return ingest_match_and_frags_postgres(connection, match, frags, method, batch_size, content_hash,
+                                           log_file_pathname, on_duplicate)[0]
+
+
+@metrics.timed('insert_match_and_frags_postgres')
+def ingest_match_and_frags_postgres(connection, match, frags, method='copy', batch_size=FRAG_BATCH_SIZE,
+                                    content_hash=None, log_file_pathname=None, on_duplicate='skip'):
+    """
+    Insert a match and all its frags in a single transaction, unless the match has already been ingested
+    (see find_ingested_match_postgres).
+    :param connection: connection object of postgresql database
+    :param match: a tuple of match in format of: (start_time, endtime, game_mode, map_name)
+    :param frags: a list of tuple in format of: (frag_time, killer_name[, victim_name, weapon_code])
+    :param method: 'copy' to stream frags with COPY FROM STDIN,
+                   'values' to send them with execute_values,
+                   'row' to send them one INSERT at a time (see insert_frag_postgres)
+    :param batch_size: number of frags sent in each statement
+    :param content_hash: optional hash of the content of the log file of the match
+    :param log_file_pathname: optional path of the log file of the match
+    :param on_duplicate: 'skip' to keep the match already ingested,
+                         'replace' to delete it and its frags and insert this one instead
+    :return: a tuple (match_id in format uuid, status): 'inserted', 'replaced', or 'skipped' with the
+             match_id of the match already ingested
+    """
+    sql = """ INSERT INTO match(start_time, end_time, game_mode, map_name)
+                VALUES(%s, %s, %s, %s) RETURNING match_id; """
+    if on_duplicate not in ('skip', 'replace'):
+        raise ValueError('Unknown duplicate policy: %s' % on_duplicate)
+    create_ingested_log_table_postgres(connection)
+    create_match_statistics_table_postgres(connection)
+    try:
+        ingested_match_id = find_ingested_match_postgres(connection, match, content_hash)
+        if ingested_match_id is not None:
+            if on_duplicate == 'skip':
+                connection.commit()
+                return ingested_match_id, 'skipped'
+            delete_match_postgres(connection, ingested_match_id)
+        cur = connection.cursor()
+        cur.execute(sql, match)
+        match_id = cur.fetchone()[0]
+        cur.close()
+        metrics.increment('rows_written', backend='postgres', table='match')
+        if method == 'copy':
+            copy_frag_postgres(connection, match_id, frags, batch_size)
+        elif method == 'values':
+            insert_frag_values_postgres(connection, match_id, frags, batch_size)
+        elif method == 'row':
+            cur = connection.cursor()
+            sql = """ INSERT INTO match_frag(match_id, frag_time, killer_name, victim_name, weapon_code)
+                        VALUES(%s, %s, %s, %s, %s); """
+            for full_frag in build_full_frags(match_id, frags):
+                cur.execute(sql, full_frag)
+            cur.close()
+            metrics.increment('rows_written', len(frags), backend='postgres', table='match_frag')
+        else:
+            raise ValueError('Unknown insert method: %s' % method)
+        update_match_statistics_postgres(connection, match_id, frags)
+        insert_ingested_log_postgres(connection, match_id, match, content_hash, log_file_pathname)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    invalidate_match(ingested_match_id)
+    invalidate_match(match_id)
+    return match_id, 'inserted' if ingested_match_id is None else 'replaced'
+
+
+def create_ingested_log_table_postgres(connection):
+    """
+    Create the index of the ingested logs if it doesn't exist yet. The matches already in the
+    database are added to it, so they are not ingested twice either.
+    :param connection: connection object of postgresql database
+    """
+    cur = connection.cursor()
+    cur.execute(""" SELECT to_regclass('ingested_log'); """)
+    if cur.fetchone()[0] is None:
+        cur.execute(""" CREATE TABLE ingested_log (
+                            match_id uuid NOT NULL PRIMARY KEY REFERENCES match(match_id) ON DELETE CASCADE,
+                            content_hash TEXT UNIQUE,
+                            start_time TIMESTAMPTZ(3) NOT NULL,
+                            game_mode TEXT NOT NULL,
+                            map_name TEXT NOT NULL,
+                            log_file_pathname TEXT,
+                            UNIQUE (start_time, game_mode, map_name)
+                        ); """)
+        cur.execute(""" INSERT INTO ingested_log(match_id, start_time, game_mode, map_name)
+                        SELECT match_id, start_time, game_mode, map_name FROM match
+                        ON CONFLICT DO NOTHING; """)
+        connection.commit()
+    cur.close()
+
+
+def find_ingested_match_postgres(connection, match, content_hash=None):
+    """
+    :param connection: connection object of postgresql database
+    :param match: a tuple of match in format of: (start_time, endtime, game_mode, map_name)
+    :param content_hash: optional hash of the content of the log file of the match
+    :return: the uuid of the match already ingested from this log or for this match, or None
+    """
+    cur = connection.cursor()
+    cur.execute(""" SELECT match_id FROM ingested_log
+                    WHERE content_hash = %s OR (start_time = %s AND game_mode = %s AND map_name = %s)
+                    LIMIT 1; """, (content_hash, match[0], match[2], match[3]))
+    row = cur.fetchone()
+    cur.close()
+    return row[0] if row else None
+
+
+def insert_ingested_log_postgres(connection, match_id, match, content_hash=None, log_file_pathname=None):
+    """
+    Add a match to the index of the ingested logs, without committing.
+    :param connection: connection object of postgresql database
+    :param match_id: match id in format uuid
+    :param match: a tuple of match in format of: (start_time, endtime, game_mode, map_name)
+    :param content_hash: optional hash of the content of the log file of the match
+    :param log_file_pathname: optional path of the log file of the match
+    """
+    cur = connection.cursor()
+    cur.execute(""" INSERT INTO ingested_log(match_id, content_hash, start_time, game_mode, map_name, log_file_pathname)
+                    VALUES(%s, %s, %s, %s, %s, %s); """,
+                (match_id, content_hash, match[0], match[2], match[3], log_file_pathname))
+    cur.close()
+
+
+def get_ingested_log_hashes_postgres(connection):
+    """
+    :param connection: connection object of postgresql database
+    :return: set of the content hashes of all the ingested logs
+    """
+    create_ingested_log_table_postgres(connection)
+    cur = connection.cursor()
+    cur.execute(""" SELECT content_hash FROM ingested_log WHERE content_hash IS NOT NULL; """)
+    hashes = {row[0] for row in cur.fetchall()}
+    cur.close()
+    connection.commit()
+    return hashes
+
+
+def delete_match_postgres(connection, match_id):
+    """
+    Delete a match, its frags and its entry in the index of the ingested logs, without committing.
+    :param connection: connection object of postgresql database
+    :param match_id: match id in format uuid
+    """
+    cur = connection.cursor()
+    cur.execute(""" SELECT frag_time, killer_name, victim_name, weapon_code FROM match_frag WHERE match_id = %s; """,
+                (match_id,))
+    frags = cur.fetchall()
+    update_player_index_postgres(connection, frags,
+                                 {frag[1] for frag in frags} | {frag[2] for frag in frags if frag[2]}, sign=-1)
+    update_frag_rollups_postgres(connection, match_id, frags, sign=-1)
+    cur.execute(""" DELETE FROM match_frag WHERE match_id = %s; """, (match_id,))
+    cur.execute(""" DELETE FROM match_player_statistics WHERE match_id = %s; """, (match_id,))
+    cur.execute(""" DELETE FROM ingested_log WHERE match_id = %s; """, (match_id,))
+    cur.execute(""" DELETE FROM match WHERE match_id = %s; """, (match_id,))
+    cur.close()
+
+
+def create_match_statistics_table_postgres(connection):
+    """
+    Create the materialized statistics of the matches if they don't exist yet, from the frags
+    already in the database.
+    :param connection: connection object of postgresql database
+    """
+    create_player_index_tables_postgres(connection)
+    create_frag_rollup_table_postgres(connection)
+    cur = connection.cursor()
+    cur.execute(""" SELECT to_regclass('match_player_statistics'); """)
+    if cur.fetchone()[0] is None:
+        cur.execute(""" CREATE TABLE match_player_statistics (
+                            match_id uuid NOT NULL REFERENCES match(match_id) ON DELETE CASCADE,
+                            player_name TEXT NOT NULL,
+                            kill_count BIGINT NOT NULL,
+                            death_count BIGINT NOT NULL,
+                            suicide_count BIGINT NOT NULL,
+                            efficiency NUMERIC NOT NULL,
+                            PRIMARY KEY (match_id, player_name)
+                        );
+                        CREATE INDEX idx_match_player_statistics_player_name
+                            ON match_player_statistics(player_name); """)
+        cur.execute(""" INSERT INTO match_player_statistics """ + MATCH_STATISTICS_QUERY)
+        connection.commit()
+    cur.close()
+
+
+def update_match_statistics_postgres(connection, match_id, frags):
+    """
+    Add new frags of a match to its materialized statistics, without committing.
+    :param connection: connection object of postgresql database
+    :param match_id: match id in format uuid
+    :param frags: a list of tuple in format of: (frag_time, killer_name[, victim_name, weapon_code]) just inserted
+    """
+    sql = """ INSERT INTO match_player_statistics(match_id, player_name, kill_count, death_count,
+                                                  suicide_count, efficiency)
+              VALUES(%(match_id)s, %(player_name)s, %(kill_count)s, %(death_count)s, %(suicide_count)s,
+                     ROUND(%(kill_count)s * 100.0 / (%(kill_count)s + %(death_count)s + %(suicide_count)s), 2))
+              ON CONFLICT(match_id, player_name) DO UPDATE SET
+                  kill_count = match_player_statistics.kill_count + excluded.kill_count,
+                  death_count = match_player_statistics.death_count + excluded.death_count,
+                  suicide_count = match_player_statistics.suicide_count + excluded.suicide_count,
+                  efficiency = ROUND(
+                      (match_player_statistics.kill_count + excluded.kill_count) * 100.0 / (
+                          match_player_statistics.kill_count + excluded.kill_count
+                          + match_player_statistics.death_count + excluded.death_count
+                          + match_player_statistics.suicide_count + excluded.suicide_count
+                      ), 2); """
+    rows = [
+        {'match_id': match_id, 'player_name': player_name, 'kill_count': kill_count,
+         'death_count': death_count, 'suicide_count': suicide_count}
+        for player_name, kill_count, death_count, suicide_count in count_player_frags(frags)
+    ]
+    cur = connection.cursor()
+    # A player already in the statistics of the match has been counted in the matches of the player index
+    cur.execute(""" SELECT player_name FROM match_player_statistics WHERE match_id = %s; """, (match_id,))
+    match_player_names = {row[0] for row in cur.fetchall()}
+    psycopg2.extras.execute_batch(cur, sql, rows)
+    cur.close()
+    metrics.increment('rows_written', len(rows), backend='postgres', table='match_player_statistics')
+    update_player_index_postgres(connection, frags, {row['player_name'] for row in rows} - match_player_names)
+    update_frag_rollups_postgres(connection, match_id, frags)
+
+
+def rebuild_match_statistics_postgres(connection):
+    """
+    Compute again the materialized statistics of all the matches from the match_frag table
+    :param connection: connection object of postgresql database
+    """
+    create_match_statistics_table_postgres(connection)
+    cur = connection.cursor()
+    cur.execute(""" DELETE FROM match_player_statistics; """)
+    cur.execute(""" INSERT INTO match_player_statistics """ + MATCH_STATISTICS_QUERY)
+    for table_name, key_columns, count_columns, query in PLAYER_INDEX_TABLES:
+        cur.execute(""" DELETE FROM %s; """ % table_name)
+        cur.execute(""" INSERT INTO %s(%s) """ % (table_name, ', '.join(key_columns + count_columns)) + query)
+    cur.execute(""" DELETE FROM frag_rollup; """)
+    insert_frag_rollups_postgres(connection)
+    connection.commit()
+    cur.close()
+
+
+def check_match_statistics_postgres(connection):
+    """
+    :param connection: connection object of postgresql database
+    :return: a tuple (missing_rows, unexpected_rows) of the differences between the materialized
+             statistics and the ones computed from the match_frag table, see compare_match_statistics
+    """
+    create_match_statistics_table_postgres(connection)
+    cur = connection.cursor()
+    cur.execute(""" SELECT match_id, player_name, kill_count, death_count, suicide_count, efficiency
+                    FROM match_player_statistics; """)
+    materialized_rows = cur.fetchall()
+    cur.execute(MATCH_STATISTICS_QUERY)
+    computed_rows = cur.fetchall()
+    cur.close()
+    connection.commit()
+    return compare_match_statistics(materialized_rows, computed_rows)
+
+
+def create_player_index_tables_postgres(connection):
+    """
+    Create the tables of the cross-match player index if they don't exist yet, from the frags already
+    in the database. See utilities.statistics_util.PLAYER_INDEX_TABLES
+    :param connection: connection object of postgresql database
+    """
+    cur = connection.cursor()
+    for table_name, key_columns, count_columns, query in PLAYER_INDEX_TABLES:
+        cur.execute(""" SELECT to_regclass(%s); """, (table_name,))
+        if cur.fetchone()[0] is not None:
+            continue
+        cur.execute(""" CREATE TABLE %s (%s, PRIMARY KEY (%s)); """ % (
+            table_name, ', '.join(['%s TEXT NOT NULL' % column for column in key_columns]
+                                  + ['%s BIGINT NOT NULL' % column for column in count_columns]),
+            ', '.join(key_columns)))
+        cur.execute(""" INSERT INTO %s(%s) """ % (table_name, ', '.join(key_columns + count_columns)) + query)
+        connection.commit()
+    cur.close()
+
+
+def update_player_index_postgres(connection, frags, new_player_names, sign=1):
+    """
+    Add the frags of a match to the player index, or subtract them, without committing.
+    :param connection: connection object of postgresql database
+    :param frags: a list of tuple in format of: (frag_time, killer_name[, victim_name, weapon_code])
+    :param new_player_names: players whose match count changes: the ones for which these are the first
+                             frags of the match, or all the players of the match when it is deleted
+    :param sign: 1 to add the frags, -1 to subtract them, the rows left with only 0 counts are deleted
+    """
+    rows = count_player_index(frags, new_player_names, sign)
+    cur = connection.cursor()
+    for table_name, key_columns, count_columns, _ in PLAYER_INDEX_TABLES:
+        psycopg2.extras.execute_batch(
+            cur, build_counter_upsert('postgres', table_name, key_columns, count_columns), rows[table_name])
+        if sign < 0:
+            psycopg2.extras.execute_batch(
+                cur, build_counter_cleanup('postgres', table_name, key_columns, count_columns), rows[table_name])
+        metrics.increment('rows_written', len(rows[table_name]), backend='postgres', table=table_name)
+    cur.close()
+
+
+def check_player_index_postgres(connection):
+    """
+    :param connection: connection object of postgresql database
+    :return: a tuple (missing_rows, unexpected_rows) of the differences between the player index and
+             the rows computed from the match_frag table, see compare_player_index
+    """
+    create_player_index_tables_postgres(connection)
+    materialized_rows = {}
+    computed_rows = {}
+    cur = connection.cursor()
+    for table_name, key_columns, count_columns, query in PLAYER_INDEX_TABLES:
+        cur.execute(""" SELECT %s FROM %s; """ % (', '.join(key_columns + count_columns), table_name))
+        materialized_rows[table_name] = cur.fetchall()
+        cur.execute(query)
+        computed_rows[table_name] = cur.fetchall()
+    cur.close()
+    connection.commit()
+    return compare_player_index(materialized_rows, computed_rows)
+
+
+def get_player_profile_postgres(connection, player_name):
+    """
+    :param connection: connection object of postgresql database
+    :param player_name: name of the player
+    :return: dictionary of the totals of the player over all the matches, with their weapons, their opponents
+             and their statistics in each match (see build_player_profile), or None if the player never fragged
+    """
+    create_match_statistics_table_postgres(connection)
+    cur = connection.cursor()
+    cur.execute(""" SELECT player_name, match_count, kill_count, death_count, suicide_count
+                    FROM player_statistics WHERE player_name = %s; """, (player_name,))
+    player_row = cur.fetchone()
+    profile = None
+    if player_row is not None:
+        cur.execute(""" SELECT weapon_code, kill_count FROM player_weapon_statistics
+                        WHERE player_name = %s; """, (player_name,))
+        weapon_rows = cur.fetchall()
+        cur.execute(""" SELECT opponent_name, kill_count, death_count FROM player_opponent_statistics
+                        WHERE player_name = %s; """, (player_name,))
+        opponent_rows = cur.fetchall()
+        cur.execute(""" SELECT s.match_id, s.kill_count, s.death_count, s.suicide_count, s.efficiency
+                        FROM match_player_statistics s JOIN match m ON m.match_id = s.match_id
+                        WHERE s.player_name = %s ORDER BY m.start_time; """, (player_name,))
+        profile = build_player_profile(player_row, weapon_rows, opponent_rows, cur.fetchall())
+    cur.close()
+    connection.commit()
+    return profile
+
+
+def get_head_to_head_postgres(connection, player_name, opponent_name):
+    """
+    :param connection: connection object of postgresql database
+    :return: a tuple (kill_count, death_count): number of times player_name killed opponent_name,
+             and was killed by them, over all the matches
+    """
+    create_match_statistics_table_postgres(connection)
+    cur = connection.cursor()
+    cur.execute(""" SELECT kill_count, death_count FROM player_opponent_statistics
+                    WHERE player_name = %s AND opponent_name = %s; """, (player_name, opponent_name))
+    row = cur.fetchone()
+    cur.close()
+    connection.commit()
+    return tuple(row) if row else (0, 0)
+
+
+def create_frag_rollup_table_postgres(connection):
+    """
+    Create the rollups of the frags if they don't exist yet, from the frags already in the database.
+    See utilities.statistics_util.FRAG_ROLLUP_TABLE
+    :param connection: connection object of postgresql database
+    """
+    cur = connection.cursor()
+    cur.execute(""" SELECT to_regclass('frag_rollup'); """)
+    if cur.fetchone()[0] is None:
+        cur.execute(""" CREATE TABLE frag_rollup (
+                            granularity TEXT NOT NULL,
+                            bucket_time BIGINT NOT NULL,
+                            map_name TEXT NOT NULL,
+                            game_mode TEXT NOT NULL,
+                            weapon_class TEXT NOT NULL,
+                            frag_count BIGINT NOT NULL,
+                            PRIMARY KEY (granularity, bucket_time, map_name, game_mode, weapon_class)
+                        ); """)
+        insert_frag_rollups_postgres(connection)
+        connection.commit()
+    cur.close()
+
+
+def iter_frag_rollups_postgres(connection):
+    """
+    :param connection: connection object of postgresql database
+    :return: a generator of the rows of the rollups of all the frags of the match_frag table, match by match
+    """
+    cur = connection.cursor()
+    cur.execute(""" SELECT f.match_id, m.map_name, m.game_mode, f.frag_time, f.killer_name, f.victim_name,
+                           f.weapon_code
+                    FROM match_frag f JOIN match m ON m.match_id = f.match_id
+                    ORDER BY f.match_id; """)
+    rows = cur.fetchall()
+    cur.close()
+    for _, match_rows in groupby(rows, key=lambda row: row[0]):
+        match_rows = list(match_rows)
+        yield from count_frag_rollups([row[3:] for row in match_rows], match_rows[0][1], match_rows[0][2])
+
+
+def insert_frag_rollups_postgres(connection):
+    """
+    Compute the rollups of all the frags of the match_frag table into the empty frag_rollup table, without committing.
+    :param connection: connection object of postgresql database
+    """
+    table_name, key_columns, count_columns = FRAG_ROLLUP_TABLE
+    cur = connection.cursor()
+    psycopg2.extras.execute_batch(cur, build_counter_upsert('postgres', table_name, key_columns, count_columns),
+                                  list(iter_frag_rollups_postgres(connection)))
+    cur.close()
+
+
+def update_frag_rollups_postgres(connection, match_id, frags, sign=1):
+    """
+    Add the frags of a match to the rollups, or subtract them, without committing.
+    :param connection: connection object of postgresql database
+    :param match_id: match id in format uuid, its map and mode are read from the match table
+    :param frags: a list of tuple in format of: (frag_time, killer_name[, victim_name, weapon_code])
+    :param sign: 1 to add the frags, -1 to subtract them, the buckets left empty are deleted
+    """
+    cur = connection.cursor()
+    cur.execute(""" SELECT map_name, game_mode FROM match WHERE match_id = %s; """, (match_id,))
+    map_name, game_mode = cur.fetchone()
+    rows = count_frag_rollups(frags, map_name, game_mode, sign)
+    table_name, key_columns, count_columns = FRAG_ROLLUP_TABLE
+    psycopg2.extras.execute_batch(cur, build_counter_upsert('postgres', table_name, key_columns, count_columns), rows)
+    if sign < 0:
+        psycopg2.extras.execute_batch(cur, build_counter_cleanup('postgres', table_name, key_columns, count_columns),
+                                      rows)
+    cur.close()
+    metrics.increment('rows_written', len(rows), backend='postgres', table=table_name)
+
+
+def check_frag_rollups_postgres(connection):
+    """
+    :param connection: connection object of postgresql database
+    :return: a tuple (missing_rows, unexpected_rows) of the differences between the rollups and the ones
+             computed from the match_frag table, rows (granularity, bucket_time, map_name, game_mode,
+             weapon_class, frag_count)
+    """
+    create_frag_rollup_table_postgres(connection)
+    table_name, key_columns, count_columns = FRAG_ROLLUP_TABLE
+    computed_counts = {}
+    for row in iter_frag_rollups_postgres(connection):
+        key = tuple(row[column] for column in key_columns)
+        computed_counts[key] = computed_counts.get(key, 0) + row['frag_count']
+    computed_rows = {key + (count,) for key, count in computed_counts.items()}
+    cur = connection.cursor()
+    cur.execute(""" SELECT %s FROM %s; """ % (', '.join(key_columns + count_columns), table_name))
+    materialized_rows = set(cur.fetchall())
+    cur.close()
+    connection.commit()
+    return sorted(computed_rows - materialized_rows, key=str), sorted(materialized_rows - computed_rows, key=str)
+
+
+def get_frag_rollups_postgres(connection, granularity, start_time=None, end_time=None, map_name=None,
+                              game_mode=None, weapon_class=None, group_by=('map_name', 'game_mode', 'weapon_class')):
+    """
+    Count the frags by time bucket from the rollups, without reading the frags, see sqlite_util.get_frag_rollups
+    :param connection: connection object of postgresql database
+    :return: list of tuples (bucket start as a UTC datetime, values of the group_by columns..., frag_count)
+    """
+    create_frag_rollup_table_postgres(connection)
+    parameters = get_frag_rollup_parameters(granularity, start_time, end_time, map_name, game_mode, weapon_class)
+    cur = connection.cursor()
+    cur.execute(build_frag_rollup_query('postgres', map_name, game_mode, weapon_class), parameters)
+    rows = cur.fetchall()
+    cur.close()
+    connection.commit()
+    return group_frag_rollups(rows, granularity, group_by)
+
+
+def get_match_statistics_postgres(connection, match_id):
+    """
+    :param connection: connection object of postgresql database
+    :param match_id: match id in format uuid
+    :return: list of tuples (player_name, kill_count, death_count, suicide_count, efficiency) of the players
+             of the match, by descending kill count
+    """
+    cur = connection.cursor()
+    cur.execute(""" SELECT player_name, kill_count, death_count, suicide_count, efficiency
+                    FROM match_player_statistics WHERE match_id = %s ORDER BY kill_count DESC; """, (match_id,))
+    rows = cur.fetchall()
+    cur.close()
+    connection.commit()
+    return rows
+
+
+def get_lucky_luke_killers_postgres(connection, min_kill_count=3, max_time_between_kills=10):
+    """
+    :param connection: connection object of postgresql database
+    :param min_kill_count: minimum number of kills of the longest series of a killer
+    :param max_time_between_kills: maximum number of seconds between two kills of the same series
+    :return: list of tuples (match_id, killer_name, kill_count) of the longest series of kills of each
+             killer of each match, see utilities.statistics_util.LUCKY_LUKE_QUERY
+    """
+    cur = connection.cursor()
+    cur.execute(build_lucky_luke_query('postgres'), {
+        'min_kill_count': min_kill_count, 'max_time_between_kills': max_time_between_kills
+    })
+    rows = cur.fetchall()
+    cur.close()
+    return rows
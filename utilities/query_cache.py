@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utilities import metrics
+
+SQL_QUERIES_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sql_queries')
+
+# Statistics of the players of each match from the table maintained by the insert functions
+# (see create_match_statistics_table), instead of aggregating all the frags of match_frag
+MATCH_PLAYER_STATISTICS_QUERY = ''' SELECT match_id, player_name, kill_count, death_count, suicide_count, efficiency
+                                    FROM match_player_statistics '''
+
+# Analytics queries of the dashboards: name -> (SQL file of sql_queries/ or query, match scoped).
+# The rows of a match scoped query only depend on the frags of their match_id, so the query can be run
+# for a single match and its cached result survives the ingestion of other matches.
+DASHBOARD_QUERIES = {
+    'weapon_variety': ('WP49.sql', True),
+    'favorite_victim': ('WP50.sql', False),
+    'worst_enemy': ('WP51.sql', False),
+    'match_summary': ('wp43.sql', True),
+    'match_statistics': (MATCH_PLAYER_STATISTICS_QUERY, True),
+}
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 300.0
+
+
+class QueryCache:
+    """
+    Results of queries by (database, query, parameters), evicted when they are older than ttl_seconds
+    or when the cache holds more than max_entries results (least recently used first).
+    Each result remembers the match it has been computed for, or None if it depends on all the matches:
+    invalidate_match drops the results of a match and all the results that depend on every match.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        # {key: (expiry time, match_id, rows)}, in the order they have been used
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        :param key: key of the result
+        :return: the cached rows, or None if they are not cached or have expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= self.clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, rows, match_id=None):
+        """
+        :param key: key of the result
+        :param rows: rows of the result
+        :param match_id: the match the result has been computed for, None if it depends on all the matches
+        """
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl_seconds, match_id, rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_match(self, match_id):
+        """
+        :param match_id: a match whose frags have been written
+        :return: number of results dropped
+        """
+        with self._lock:
+            keys = [key for key, (_, entry_match_id, _) in self._entries.items()
+                    if entry_match_id is None or entry_match_id == match_id]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_query_cache = QueryCache()
+_query_texts = {}
+
+
+def get_query_cache():
+    """
+    :return: the cache shared by the queries of this process
+    """
+    return _query_cache
+
+
+def configure_query_cache(max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+    """
+    Change the eviction settings of the shared cache, the results already cached are dropped
+    :param max_entries: maximum number of results kept, 0 disables the cache
+    :param ttl_seconds: number of seconds a result is kept
+    """
+    _query_cache.clear()
+    _query_cache.max_entries = max_entries
+    _query_cache.ttl_seconds = ttl_seconds
+
+
+def invalidate_match(match_id):
+    """
+    Drop the cached results that may have changed because frags of a match have been written.
+    Called by the insert functions of sqlite_util and postgres_util once their transaction is committed.
+    :param match_id: the match whose frags have been written
+    """
+    if match_id is not None:
+        _query_cache.invalidate_match(match_id)
+
+
+def load_query(query_file_name):
+    """
+    :param query_file_name: name of a SQL file of sql_queries/, example: 'WP49.sql'
+    :return: the query of the file, without its final semicolon
+    """
+    query = _query_texts.get(query_file_name)
+    if query is None:
+        with open(os.path.join(SQL_QUERIES_DIRECTORY, query_file_name)) as query_file:
+            query = _query_texts[query_file_name] = query_file.read().strip().rstrip(';')
+    return query
+
+
+def get_database_key(connection):
+    """
+    :param connection: connection object of the sqlite or postgresql database
+    :return: identifier of the database of the connection, so that results of different databases
+             are cached apart. In-memory and temporary SQLite databases have no file name, each one
+             is only reached through its connection, which identifies it.
+    """
+    dsn = getattr(connection, 'dsn', None)
+    if dsn is not None:
+        return 'postgres', dsn
+    file_name = connection.execute('PRAGMA database_list').fetchone()[2]
+    if not file_name:
+        return 'sqlite', '', id(connection)
+    return 'sqlite', file_name
+
+
+def run_cached_query(connection, query, parameters=(), match_id=None):
+    """
+    :param connection: connection object of the sqlite or postgresql database
+    :param query: SELECT query, with the placeholders of the database ('?' or '%s')
+    :param parameters: tuple of the values of the placeholders
+    :param match_id: the match the query is restricted to, None if its result depends on all the matches
+    :return: list of the rows of the query, from the cache when the same query has already been run
+             and no frag has been written since for the matches it depends on
+    """
+    key = (get_database_key(connection), query, tuple(parameters))
+    rows = _query_cache.get(key)
+    if rows is not None:
+        metrics.increment('query_cache', result='hit')
+        return list(rows)
+
+    metrics.increment('query_cache', result='miss')
+    cur = connection.cursor()
+    cur.execute(query, parameters)
+    rows = cur.fetchall()
+    cur.close()
+    _query_cache.put(key, rows, match_id)
+    return list(rows)
+
+
+def run_dashboard_query(connection, name, match_id=None):
+    """
+    :param connection: connection object of the sqlite or postgresql database
+    :param name: name of the query, see DASHBOARD_QUERIES
+    :param match_id: only return the rows of this match, for the match scoped queries
+    :return: list of the rows of the query, see run_cached_query
+    """
+    query, match_scoped = DASHBOARD_QUERIES[name]
+    if query.endswith('.sql'):
+        query = load_query(query)
+    if match_id is None:
+        return run_cached_query(connection, query)
+    if not match_scoped:
+        raise ValueError('%s is computed over all the matches, it cannot be restricted to one' % name)
+
+    placeholder = '%s' if getattr(connection, 'dsn', None) is not None else '?'
+    query = 'SELECT * FROM (%s) AS match_rows WHERE match_id = %s' % (query, placeholder)
+    return run_cached_query(connection, query, (match_id,), match_id)
@@ -0,0 +1,331 @@
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import repeat
+
+from utilities import metrics
+from utilities.sqlite_util import create_connection, to_epoch, create_ingested_log_table, \
+    create_match_statistics_table, rebuild_match_statistics, get_frag_rollups
+
+# Partitioned SQLite layout: a directory with one database per month of the start time (UTC) of the matches,
+# each with the same schema as the single farcry.db file:
+#     shards/farcry-2019-02.db, shards/farcry-2019-03.db...
+# A month has its own write lock and a match_frag table that stops growing once the month is over.
+# Queries are fanned out to the databases of the months of a time range and their rows are merged,
+# see run_sharded_query. A single database is split with split_database.
+SHARD_FILE_NAME = 'farcry-%04d-%02d.db'
+SHARD_FILE_PATTERN = re.compile(r'^farcry-(\d{4})-(\d{2})\.db$')
+
+# The match ids of a month start at its index (year * 12 + month - 1) times this span, so the ids of different
+# months never collide and the rows of all the months can be merged by match_id
+SHARD_MATCH_ID_SPAN = 10 ** 6
+
+# Frags are at most that many seconds after the start of their match: the frags of a time range can be
+# in the database of the month before the range when a match starts just before the month
+SHARD_PRUNING_MARGIN = 86400
+
+AGGREGATE_FUNCTIONS = {
+    'sum': lambda value, other_value: value + other_value,
+    'min': min,
+    'max': max,
+}
+
+
+def get_shard_month(time):
+    """
+    :param time: a datetime object with time zone, or a number of seconds since the epoch
+    :return: a tuple (year, month) of the time in UTC, the month of the database of a match starting at that time
+    """
+    time = datetime.fromtimestamp(to_epoch(time), timezone.utc)
+    return time.year, time.month
+
+
+def get_month_bounds(month):
+    """
+    :param month: a tuple (year, month)
+    :return: a tuple (start, end) of the month in seconds since the epoch, the end being excluded
+    """
+    year, month_number = month
+    next_year, next_month_number = (year + 1, 1) if month_number == 12 else (year, month_number + 1)
+    return (int(datetime(year, month_number, 1, tzinfo=timezone.utc).timestamp()),
+            int(datetime(next_year, next_month_number, 1, tzinfo=timezone.utc).timestamp()))
+
+
+def get_shard_pathname(shard_directory, month):
+    """
+    :param shard_directory: directory of the databases of the months
+    :param month: a tuple (year, month)
+    :return: path of the database of the month
+    """
+    return os.path.join(shard_directory, SHARD_FILE_NAME % month)
+
+
+def find_shards(shard_directory, start_time=None, end_time=None):
+    """
+    :param shard_directory: directory of the databases of the months
+    :param start_time: datetime with time zone of the start of the range, None for the first month
+    :param end_time: datetime with time zone of the end of the range (excluded), None for the last month
+    :return: list of tuples ((year, month), pathname) of the databases that may hold frags of the range,
+             by month
+    """
+    first_month = get_shard_month(to_epoch(start_time) - SHARD_PRUNING_MARGIN) if start_time is not None else None
+    last_month = get_shard_month(to_epoch(end_time) - 1) if end_time is not None else None
+    shards = []
+    for file_name in sorted(os.listdir(shard_directory)):
+        match = SHARD_FILE_PATTERN.match(file_name)
+        if match is None:
+            continue
+        month = int(match.group(1)), int(match.group(2))
+        if (first_month is None or month >= first_month) and (last_month is None or month <= last_month):
+            shards.append((month, os.path.join(shard_directory, file_name)))
+    return shards
+
+
+def open_shard(shard_directory, month):
+    """
+    Open the database of a month, it is created with the tables of the single database if it doesn't exist yet
+    :param shard_directory: directory of the databases of the months
+    :param month: a tuple (year, month)
+    :return: connection object of the sqlite database of the month
+    """
+    shard_pathname = get_shard_pathname(shard_directory, month)
+    conn = create_connection(shard_pathname)
+    if conn is None:
+        raise ValueError('Cannot open the SQLite database %s' % shard_pathname)
+    create_ingested_log_table(conn)
+    create_match_statistics_table(conn)
+    # The migrations leave a sequence of the match table, at 0 in a new database
+    first_match_id = (month[0] * 12 + month[1] - 1) * SHARD_MATCH_ID_SPAN
+    with conn:
+        row = conn.execute(''' SELECT seq FROM sqlite_sequence WHERE name = 'match' ''').fetchone()
+        if row is None:
+            conn.execute(''' INSERT INTO sqlite_sequence(name, seq) VALUES('match', ?) ''', (first_match_id,))
+        elif row[0] < first_match_id:
+            conn.execute(''' UPDATE sqlite_sequence SET seq = ? WHERE name = 'match' ''', (first_match_id,))
+    return conn
+
+
+def connect_read_only(shard_pathname):
+    """
+    :param shard_pathname: path of the database of a month
+    :return: connection object of the sqlite database, which cannot write it
+    """
+    # urllib.request imports http.client, email and logging: only when a month is queried
+    from urllib.request import pathname2url
+    return sqlite3.connect('file:%s?mode=ro' % pathname2url(os.path.abspath(shard_pathname)), uri=True)
+
+
+def fetch_rows(conn, query, parameters=()):
+    """
+    :param conn: connection object of sqlite database
+    :return: list of the rows of the query
+    """
+    return conn.execute(query, parameters).fetchall()
+
+
+def run_on_shard(shard_pathname, function, args):
+    """
+    Run function(connection, *args) on a read-only connection to the database of a month, in a worker
+    :return: the result of the function
+    """
+    conn = connect_read_only(shard_pathname)
+    try:
+        return function(conn, *args)
+    finally:
+        conn.close()
+
+
+def concat_shard_rows(shard_rows):
+    """
+    :param shard_rows: list of the rows of each database, by month
+    :return: list of all the rows, by month
+    """
+    return [row for rows in shard_rows for row in rows]
+
+
+def merge_aggregates(shard_rows, key_columns, aggregates):
+    """
+    Merge the partial aggregates of the databases: the rows of the same key are combined into one.
+    Only aggregates that can be combined are merged, an average has to be computed from merged sums and counts.
+        example: killers and their kill counts
+        >>>merge_aggregates([[('shogun', 12)], [('shogun', 3), ('Transporter', 5)]], (0,), {1: 'sum'})
+        [('shogun', 15), ('Transporter', 5)]
+    :param shard_rows: list of the rows of each database, as returned by the queries of the databases
+    :param key_columns: indexes of the columns of the key of the rows, the GROUP BY columns of the queries
+    :param aggregates: dictionary {column index: 'sum', 'min' or 'max'} of the way each aggregate is combined,
+                       counts are summed. The other columns keep the value of the first row of the key.
+    :return: list of the merged rows, in the order their key has been found
+    """
+    merged_rows = {}
+    for rows in shard_rows:
+        for row in rows:
+            key = tuple(row[column] for column in key_columns)
+            merged_row = merged_rows.get(key)
+            if merged_row is None:
+                merged_rows[key] = list(row)
+                continue
+            for column, aggregate in aggregates.items():
+                if merged_row[column] is None or row[column] is None:
+                    # SUM, MIN and MAX are NULL on a database without rows
+                    merged_row[column] = row[column] if merged_row[column] is None else merged_row[column]
+                else:
+                    merged_row[column] = AGGREGATE_FUNCTIONS[aggregate](merged_row[column], row[column])
+    return [tuple(row) for row in merged_rows.values()]
+
+
+def top_rows(rows, k, count_column, group_columns=()):
+    """
+    :param rows: list of rows, merged with merge_aggregates first when the counts of a key are split
+                 between databases
+    :param k: number of rows kept in each group
+    :param count_column: index of the column the rows are ranked by, the biggest first.
+                         Ties are broken by the other columns, in ascending order
+    :param group_columns: indexes of the columns of the groups ranked apart, all the rows are one group if empty
+    :return: list of the k first rows of each group
+    """
+    def rank(row):
+        return (-row[count_column],) + tuple((value is None, value) for value in row)
+
+    group_counts = {}
+    kept_rows = []
+    for row in sorted(rows, key=rank):
+        group = tuple(row[column] for column in group_columns)
+        if group_counts.get(group, 0) < k:
+            group_counts[group] = group_counts.get(group, 0) + 1
+            kept_rows.append(row)
+    return kept_rows
+
+
+def map_shards(shard_directory, function, args=(), start_time=None, end_time=None, merge=concat_shard_rows,
+               workers=None, processes=False):
+    """
+    Run function(connection, *args) on the database of each month of a time range in parallel, and merge
+    their results. The time range only prunes the databases, the function filters their rows itself.
+    :param shard_directory: directory of the databases of the months
+    :param function: a function of a connection and of args, it must be defined at the top level of a module
+                     when processes is True
+    :param start_time: datetime with time zone of the start of the range, None for the first month
+    :param end_time: datetime with time zone of the end of the range (excluded), None for the last month
+    :param merge: function of the list of the results of each database, by month, returning the result,
+                  example: functools.partial(merge_aggregates, key_columns=(0,), aggregates={1: 'sum'})
+    :param workers: number of threads or processes, defaults to the ones of concurrent.futures
+    :param processes: True to run the function in a pool of processes instead of threads. sqlite releases
+                      the GIL while it runs a query, threads are enough unless function spends time in Python
+    :return: the merged result
+    """
+    shard_pathnames = [shard_pathname for _, shard_pathname in find_shards(shard_directory, start_time, end_time)]
+    metrics.increment('shard_queries', len(shard_pathnames))
+    if len(shard_pathnames) <= 1:
+        return merge([run_on_shard(shard_pathname, function, args) for shard_pathname in shard_pathnames])
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_class(workers) as executor:
+        return merge(list(executor.map(run_on_shard, shard_pathnames, repeat(function), repeat(args))))
+
+
+def run_sharded_query(shard_directory, query, parameters=(), start_time=None, end_time=None,
+                      merge=concat_shard_rows, workers=None, processes=False):
+    """
+    Run a SELECT query on the database of each month of a time range in parallel, see map_shards
+        example: kill counts of the killers of March 2019
+        >>>run_sharded_query('./shards', '''SELECT killer_name, COUNT(victim_name) FROM match_frag
+        ...                                 WHERE frag_time >= ? AND frag_time < ? GROUP BY killer_name''',
+        ...                  (1551398400, 1554076800), start, end,
+        ...                  functools.partial(merge_aggregates, key_columns=(0,), aggregates={1: 'sum'}))
+    :param query: SELECT query, with '?' placeholders
+    :param parameters: tuple of the values of the placeholders
+    :return: the rows merged by merge, all the rows by month by default
+    """
+    return map_shards(shard_directory, fetch_rows, (query, parameters), start_time, end_time, merge, workers,
+                      processes)
+
+
+def merge_frag_rollups(shard_rows):
+    """
+    :param shard_rows: list of the rows of get_frag_rollups of each database
+    :return: rows of get_frag_rollups, with the counts of a bucket spread over two months added up
+    """
+    counts = {}
+    for rows in shard_rows:
+        for row in rows:
+            counts[row[:-1]] = counts.get(row[:-1], 0) + row[-1]
+    return [key + (count,) for key, count in sorted(counts.items())]
+
+
+def get_sharded_frag_rollups(shard_directory, granularity, start_time=None, end_time=None, map_name=None,
+                             game_mode=None, weapon_class=None, group_by=('map_name', 'game_mode', 'weapon_class'),
+                             workers=None):
+    """
+    Count the frags by time bucket from the rollups of the databases of the months of the range,
+    see sqlite_util.get_frag_rollups for the other parameters
+    :param shard_directory: directory of the databases of the months
+    :param workers: number of threads querying the databases
+    :return: list of tuples (bucket start as a UTC datetime, values of the group_by columns..., frag_count)
+    """
+    return map_shards(shard_directory, get_frag_rollups,
+                      (granularity, start_time, end_time, map_name, game_mode, weapon_class, tuple(group_by)),
+                      start_time, end_time, merge_frag_rollups, workers)
+
+
+@metrics.timed('split_database')
+def split_database(sqlite_pathname, shard_directory, report=print):
+    """
+    Copy the matches of a single database into the databases of the months of their start time, with their
+    frags and ingested logs, and compute the statistics of each month again. The matches keep their ids.
+    The single database is left as is. The matches already copied are skipped, so the split can be run
+    again after more logs have been ingested into the single database.
+    :param sqlite_pathname: path of the single SQLite database, example: './farcry.db'
+    :param shard_directory: directory of the databases of the months, created if it doesn't exist
+    :param report: function called with a line of progress for each month
+    :return: dictionary {(year, month): number of matches copied}
+    """
+    conn = create_connection(sqlite_pathname)
+    if conn is None:
+        raise ValueError('Cannot open the SQLite database %s' % sqlite_pathname)
+    try:
+        # The ingested_log table of an old database is created before its matches are copied
+        create_ingested_log_table(conn)
+        months = sorted({get_shard_month(row[0]) for row in conn.execute(''' SELECT start_time FROM match ''')})
+    finally:
+        conn.close()
+
+    os.makedirs(shard_directory, exist_ok=True)
+    copied_match_counts = {}
+    for month in months:
+        month_start, month_end = get_month_bounds(month)
+        shard_conn = open_shard(shard_directory, month)
+        try:
+            shard_conn.execute(''' ATTACH DATABASE ? AS single ''', (sqlite_pathname,))
+            with shard_conn:
+                shard_conn.execute(''' CREATE TEMP TABLE copied_match AS
+                                       SELECT match_id FROM single.match
+                                       WHERE start_time >= ? AND start_time < ?
+                                       AND match_id NOT IN (SELECT match_id FROM main.match) ''',
+                                   (month_start, month_end))
+                shard_conn.execute(''' INSERT INTO main.match(match_id, start_time, end_time, game_mode, map_name,
+                                                              utc_offset)
+                                       SELECT match_id, start_time, end_time, game_mode, map_name, utc_offset
+                                       FROM single.match WHERE match_id IN (SELECT match_id FROM copied_match) ''')
+                shard_conn.execute(''' INSERT INTO main.match_frag(match_id, frag_time, killer_name, victim_name,
+                                                                   weapon_code)
+                                       SELECT match_id, frag_time, killer_name, victim_name, weapon_code
+                                       FROM single.match_frag
+                                       WHERE match_id IN (SELECT match_id FROM copied_match) ''')
+                shard_conn.execute(''' INSERT INTO main.ingested_log(match_id, content_hash, start_time, game_mode,
+                                                                     map_name, log_file_pathname)
+                                       SELECT match_id, content_hash, start_time, game_mode, map_name,
+                                              log_file_pathname
+                                       FROM single.ingested_log
+                                       WHERE match_id IN (SELECT match_id FROM copied_match) ''')
+                copied_match_count = shard_conn.execute(''' SELECT COUNT(*) FROM copied_match ''').fetchone()[0]
+                shard_conn.execute(''' DROP TABLE copied_match ''')
+            shard_conn.execute(''' DETACH DATABASE single ''')
+            if copied_match_count:
+                rebuild_match_statistics(shard_conn)
+        finally:
+            shard_conn.close()
+        copied_match_counts[month] = copied_match_count
+        metrics.increment('rows_written', copied_match_count, backend='sqlite', table='match')
+        report('%s: %d matches copied' % (get_shard_pathname(shard_directory, month), copied_match_count))
+    return copied_match_counts
@@ -1,22 +1,110 @@
 import sqlite3
+from datetime import datetime
+from itertools import groupby
+from utilities import metrics
+from utilities.migrations import migrate, get_pending_versions
+from utilities.query_cache import invalidate_match
+from utilities.statistics_util import MATCH_STATISTICS_QUERY, count_player_frags, compare_match_statistics, \
+    build_lucky_luke_query, PLAYER_INDEX_TABLES, build_counter_upsert, build_counter_cleanup, \
+    count_player_index, compare_player_index, build_player_profile, FRAG_ROLLUP_TABLE, count_frag_rollups, \
+    build_frag_rollup_query, get_frag_rollup_parameters, group_frag_rollups
+
+# Number of frags sent to sqlite in each executemany call
+FRAG_BATCH_SIZE = 1000
+
+JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF')
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
 
 
 def create_connection(file_pathname):
 
     """ create a database connection to the SQLite database
-        specified by file_pathname
+        specified by file_pathname. A new database is created with the last version
+        of the schema, see utilities.migrations. An existing database is never
+        upgraded here, see migrate_database.
     :param file_pathname: database file
-    :return: Connection object or None
+    :return: Connection object or None if the database can't be opened
+    :raises ValueError: if the schema of the database is older than the last version
     """
     try:
         conn = sqlite3.connect(file_pathname)
-        return conn
-    except Error as e:
+    except sqlite3.Error as e:
+        metrics.increment('errors', stage='create_connection')
         print(e)
+        return None
+
+    try:
+        if not has_match_table(conn):
+            migrate(conn, 'sqlite')
+        else:
+            pending_versions = get_pending_versions(conn, 'sqlite')
+            if pending_versions:
+                raise ValueError('%s needs the migrations %s of its schema, run farcry_data_science.py '
+                                 '--sqlite %s --migrate (the database is copied first)' % (
+                                     file_pathname, ', '.join(map(str, pending_versions)), file_pathname))
+    except Exception:
+        conn.close()
+        raise
+    return conn
 
-    return None
 
+def has_match_table(conn):
+    """
+    :param conn: connection object of sqlite database
+    :return: True if the database already holds the match table, False if it is a new database
+    """
+    sql = ''' SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'match' '''
+    return conn.execute(sql).fetchone() is not None
+
+
+def migrate_database(file_pathname, backup=True):
+    """
+    Upgrade the schema of a SQLite database to the last version, see utilities.migrations.
+    The migrations rebuild tables of the existing databases (the times of match and match_frag become
+    integer epochs), so the database is copied first, to file_pathname + '.v<version>.bak'.
+    :param file_pathname: database file
+    :param backup: False to upgrade the database without copying it
+    :return: a tuple (list of the versions applied, path of the copy or None if the database hasn't been copied)
+    """
+    conn = sqlite3.connect(file_pathname)
+    try:
+        pending_versions = get_pending_versions(conn, 'sqlite')
+        backup_pathname = None
+        if pending_versions and backup and has_match_table(conn):
+            backup_pathname = '%s.v%d.bak' % (file_pathname, pending_versions[0] - 1)
+            backup_conn = sqlite3.connect(backup_pathname)
+            try:
+                conn.backup(backup_conn)
+            finally:
+                backup_conn.close()
+        return migrate(conn, 'sqlite'), backup_pathname
+    finally:
+        conn.close()
 
+
+def to_epoch(time):
+    """
+    :param time: a datetime object with time zone
+    :return: the number of seconds since the epoch, as stored in the database
+    """
+    if isinstance(time, datetime):
+        return int(time.timestamp())
+    return time
+
+
+def convert_match(match):
+    """
+    :param match: a tuple of match information: (start_time, endtime, game_mode, map_name)
+    :return: the match as stored in the match table: (start_time, end_time, game_mode, map_name, utc_offset)
+             with times in seconds since the epoch and the time zone of the match in minutes
+    """
+    start_time, end_time, game_mode, map_name = match
+    utc_offset = start_time.utcoffset() if isinstance(start_time, datetime) else None
+    utc_offset = int(utc_offset.total_seconds()) // 60 if utc_offset is not None else 0
+    return to_epoch(start_time), to_epoch(end_time), game_mode, map_name, utc_offset
+
+
+@metrics.timed('insert_match')
 def insert_match(conn, match):
     """
     Create a new match into the match table
@@ -24,14 +112,17 @@ def insert_match(conn, match):
     :param match: a tuple of match information: (start_time, endtime, game_mode, map_name)
     :return: match id
     """
-    sql = ''' INSERT INTO match(start_time, end_time, game_mode, map_name)
-              VALUES(?, ?, ?, ?) '''
+    sql = ''' INSERT INTO match(start_time, end_time, game_mode, map_name, utc_offset)
+              VALUES(?, ?, ?, ?, ?) '''
     cur = conn.cursor()
     try:
         with conn:
-            cur.execute(sql, match)
-            return cur.lastrowid
+            cur.execute(sql, convert_match(match))
+            metrics.increment('rows_written', backend='sqlite', table='match')
+        invalidate_match(cur.lastrowid)
+        return cur.lastrowid
     except sqlite3.IntegrityError:
+        metrics.increment('errors', stage='insert_match')
         print("Coudn't add the value twice")
 
 
@@ -47,7 +138,583 @@ def insert_frag(conn, frag):
     cur = conn.cursor()
     try:
         with conn:
-            cur.execute(sql, frag)
-            return cur.lastrowid
+            cur.execute(sql, (frag[0], to_epoch(frag[1])) + tuple(frag[2:]))
+            metrics.increment('rows_written', backend='sqlite', table='match_frag')
+        invalidate_match(frag[0])
+        return cur.lastrowid
+    except sqlite3.IntegrityError:
+        metrics.increment('errors', stage='insert_frag')
+        print("Coudn't add the value twice")
+
+
+def set_pragmas(conn, journal_mode=None, synchronous=None):
+    """
+    Tune the durability of the database for bulk loading
+    :param conn: connection object of sqlite database
+    :param journal_mode: one of JOURNAL_MODES, 'WAL' lets readers work while frags are written.
+                         None keeps the current mode of the database
+    :param synchronous: one of SYNCHRONOUS_MODES, 'NORMAL' only syncs at checkpoints in WAL mode.
+                        None keeps the current setting of the connection
+    """
+    if journal_mode is not None:
+        if journal_mode.upper() not in JOURNAL_MODES:
+            raise ValueError('Unknown journal mode: %s' % journal_mode)
+        conn.execute('PRAGMA journal_mode = %s' % journal_mode.upper())
+    if synchronous is not None:
+        if synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError('Unknown synchronous mode: %s' % synchronous)
+        conn.execute('PRAGMA synchronous = %s' % synchronous.upper())
+
+
+@metrics.timed('insert_frags')
+def insert_frags(conn, frags, batch_size=FRAG_BATCH_SIZE):
+    """
+    Create many frags into the match_frag table with executemany, without committing.
+    The caller is responsible of the transaction.
+    :param conn: connection object of sqlite database
+    :param frags: an iterable of tuples of frag information: (match_id, frag_time, killer_name, victim_name, weapon_code)
+    :param batch_size: number of frags sent to sqlite in each executemany call
+    :return: number of inserted frags
+    """
+    sql = ''' INSERT INTO match_frag(match_id, frag_time, killer_name, victim_name, weapon_code)
+              VALUES(?, ?, ?, ?, ?) '''
+    cur = conn.cursor()
+    frag_count = 0
+    batch = []
+    for frag in frags:
+        batch.append(frag)
+        if len(batch) >= batch_size:
+            cur.executemany(sql, batch)
+            frag_count += len(batch)
+            batch = []
+    if batch:
+        cur.executemany(sql, batch)
+        frag_count += len(batch)
+    cur.close()
+    metrics.increment('rows_written', frag_count, backend='sqlite', table='match_frag')
+    return frag_count
+
+
+def insert_match_and_frags(conn, match, frags, batch_size=FRAG_BATCH_SIZE, content_hash=None,
+                           log_file_pathname=None, on_duplicate='skip'):
+    """
+    Same as ingest_match_and_frags, without the status.
+    :return: match id, the one of the match already ingested if it is skipped
+    """
+    return ingest_match_and_frags(conn, match, frags, batch_size, content_hash, log_file_pathname, on_duplicate)[0]
+
+
+@metrics.timed('insert_match_and_frags')
+def ingest_match_and_frags(conn, match, frags, batch_size=FRAG_BATCH_SIZE, content_hash=None,
+                           log_file_pathname=None, on_duplicate='skip'):
+    """
+    Create a new match and all its frags in a single transaction, unless the match has already been ingested.
+    A match is already ingested if a log with the same content hash, or a match with the same
+    start time, game mode and map, is in the ingested_log table.
+    :param conn: connection object of sqlite database
+    :param match: a tuple of match information: (start_time, endtime, game_mode, map_name)
+    :param frags: a list of tuples (frag_time, killer_name[, victim_name, weapon_code])
+    :param batch_size: number of frags sent to sqlite in each executemany call
+    :param content_hash: optional hash of the content of the log file of the match
+    :param log_file_pathname: optional path of the log file of the match
+    :param on_duplicate: 'skip' to keep the match already ingested,
+                         'replace' to delete it and its frags and insert this one instead
+    :return: a tuple (match id, status): 'inserted', 'replaced', or 'skipped' with the id of the match
+             already ingested. (None, 'failed') if the match conflicts with a row of the database.
+    """
+    sql = ''' INSERT INTO match(start_time, end_time, game_mode, map_name, utc_offset)
+              VALUES(?, ?, ?, ?, ?) '''
+    if on_duplicate not in ('skip', 'replace'):
+        raise ValueError('Unknown duplicate policy: %s' % on_duplicate)
+    create_ingested_log_table(conn)
+    create_match_statistics_table(conn)
+    cur = conn.cursor()
+    try:
+        with conn:
+            ingested_match_id = find_ingested_match(conn, match, content_hash)
+            if ingested_match_id is not None:
+                if on_duplicate == 'skip':
+                    return ingested_match_id, 'skipped'
+                delete_match(conn, ingested_match_id)
+            cur.execute(sql, convert_match(match))
+            match_id = cur.lastrowid
+            metrics.increment('rows_written', backend='sqlite', table='match')
+            insert_frags(conn, build_full_frags(match_id, frags), batch_size)
+            update_match_statistics(conn, match_id, frags)
+            insert_ingested_log(conn, match_id, match, content_hash, log_file_pathname)
+        invalidate_match(ingested_match_id)
+        invalidate_match(match_id)
+        return match_id, 'inserted' if ingested_match_id is None else 'replaced'
     except sqlite3.IntegrityError:
-        print("Coudn't add the value twice")
\ No newline at end of file
+        metrics.increment('errors', stage='insert_match_and_frags')
+        print("Coudn't add the value twice")
+        return None, 'failed'
+
+
+def create_ingested_log_table(conn):
+    """
+    Create the index of the ingested logs if it doesn't exist yet. The matches already in the
+    database are added to it, so they are not ingested twice either.
+    :param conn: connection object of sqlite database
+    """
+    sql = ''' SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ingested_log' '''
+    if conn.execute(sql).fetchone():
+        return
+    with conn:
+        conn.execute(''' CREATE TABLE ingested_log (
+                            match_id INTEGER NOT NULL PRIMARY KEY,
+                            content_hash TEXT UNIQUE,
+                            start_time INTEGER NOT NULL,
+                            game_mode TEXT NOT NULL,
+                            map_name TEXT NOT NULL,
+                            log_file_pathname TEXT,
+                            UNIQUE(start_time, game_mode, map_name),
+                            FOREIGN KEY(match_id) REFERENCES match(match_id) ON DELETE CASCADE
+                        ) ''')
+        conn.execute(''' INSERT OR IGNORE INTO ingested_log(match_id, start_time, game_mode, map_name)
+                        SELECT match_id, start_time, game_mode, map_name FROM match ''')
+
+
+def find_ingested_match(conn, match, content_hash=None):
+    """
+    :param conn: connection object of sqlite database
+    :param match: a tuple of match information: (start_time, endtime, game_mode, map_name)
+    :param content_hash: optional hash of the content of the log file of the match
+    :return: the id of the match already ingested from this log or for this match, or None
+    """
+    if content_hash is not None:
+        row = conn.execute(''' SELECT match_id FROM ingested_log WHERE content_hash = ? ''',
+                           (content_hash,)).fetchone()
+        if row:
+            return row[0]
+    row = conn.execute(''' SELECT match_id FROM ingested_log
+                           WHERE start_time = ? AND game_mode = ? AND map_name = ? ''',
+                       (to_epoch(match[0]), match[2], match[3])).fetchone()
+    return row[0] if row else None
+
+
+def insert_ingested_log(conn, match_id, match, content_hash=None, log_file_pathname=None):
+    """
+    Add a match to the index of the ingested logs, without committing.
+    :param conn: connection object of sqlite database
+    :param match_id: the identifier of the match
+    :param match: a tuple of match information: (start_time, endtime, game_mode, map_name)
+    :param content_hash: optional hash of the content of the log file of the match
+    :param log_file_pathname: optional path of the log file of the match
+    """
+    sql = ''' INSERT INTO ingested_log(match_id, content_hash, start_time, game_mode, map_name, log_file_pathname)
+              VALUES(?, ?, ?, ?, ?, ?) '''
+    conn.execute(sql, (match_id, content_hash, to_epoch(match[0]), match[2], match[3], log_file_pathname))
+
+
+def get_ingested_log_hashes(conn):
+    """
+    :param conn: connection object of sqlite database
+    :return: set of the content hashes of all the ingested logs
+    """
+    create_ingested_log_table(conn)
+    sql = ''' SELECT content_hash FROM ingested_log WHERE content_hash IS NOT NULL '''
+    return {row[0] for row in conn.execute(sql)}
+
+
+def delete_match(conn, match_id):
+    """
+    Delete a match, its frags and its entry in the index of the ingested logs, without committing.
+    :param conn: connection object of sqlite database
+    :param match_id: the identifier of the match
+    """
+    sql = ''' SELECT frag_time, killer_name, victim_name, weapon_code FROM match_frag WHERE match_id = ? '''
+    frags = conn.execute(sql, (match_id,)).fetchall()
+    update_player_index(conn, frags, {frag[1] for frag in frags} | {frag[2] for frag in frags if frag[2]}, sign=-1)
+    update_frag_rollups(conn, match_id, frags, sign=-1)
+    conn.execute(''' DELETE FROM match_frag WHERE match_id = ? ''', (match_id,))
+    conn.execute(''' DELETE FROM match_player_statistics WHERE match_id = ? ''', (match_id,))
+    conn.execute(''' DELETE FROM ingested_log WHERE match_id = ? ''', (match_id,))
+    conn.execute(''' DELETE FROM match WHERE match_id = ? ''', (match_id,))
+
+
+def build_full_frags(match_id, frags):
+    """
+    :param match_id: the identifier of a match
+    :param frags: a list of tuples (frag_time, killer_name[, victim_name, weapon_code])
+    :return: a generator of tuples (match_id, frag_time, killer_name, victim_name, weapon_code),
+             frag_time in seconds since the epoch, victim_name and weapon_code are None for suicides
+    """
+    for frag in frags:
+        full_frag = (match_id, to_epoch(frag[0])) + frag[1:]
+        if len(full_frag) < 5:
+            full_frag = full_frag + (None, None,)
+        yield full_frag
+
+
+def insert_match_row(conn, match):
+    """
+    Create a new match into the match table, without committing.
+    The caller is responsible of the transaction.
+    :param conn: connection object of sqlite database
+    :param match: a tuple of match information: (start_time, endtime, game_mode, map_name)
+    :return: match id
+    """
+    sql = ''' INSERT INTO match(start_time, end_time, game_mode, map_name, utc_offset)
+              VALUES(?, ?, ?, ?, ?) '''
+    cur = conn.cursor()
+    cur.execute(sql, convert_match(match))
+    match_id = cur.lastrowid
+    cur.close()
+    metrics.increment('rows_written', backend='sqlite', table='match')
+    return match_id
+
+
+def update_match_times(conn, match_id, start_time, end_time):
+    """
+    Update the start and end time of a match that is still being played, without committing.
+    :param conn: connection object of sqlite database
+    :param match_id: the identifier of the match
+    :param start_time: datetime when the game session started
+    :param end_time: datetime when the game session ended, or of its last frag so far
+    """
+    sql = ''' UPDATE match SET start_time = ?, end_time = ? WHERE match_id = ? '''
+    conn.execute(sql, (to_epoch(start_time), to_epoch(end_time), match_id))
+    sql = ''' UPDATE ingested_log SET start_time = ? WHERE match_id = ? '''
+    conn.execute(sql, (to_epoch(start_time), match_id))
+
+
+def create_log_checkpoint_table(conn):
+    """
+    Create the table that stores how far each followed log file has been ingested
+    :param conn: connection object of sqlite database
+    """
+    sql = ''' CREATE TABLE IF NOT EXISTS log_checkpoint (
+                  log_file_pathname TEXT NOT NULL PRIMARY KEY,
+                  checkpoint TEXT NOT NULL
+              ) '''
+    with conn:
+        conn.execute(sql)
+
+
+def get_log_checkpoint(conn, log_file_pathname):
+    """
+    :param conn: connection object of sqlite database
+    :param log_file_pathname: path of the followed log file
+    :return: the checkpoint saved for this log file, or None if it has never been followed
+    """
+    sql = ''' SELECT checkpoint FROM log_checkpoint WHERE log_file_pathname = ? '''
+    row = conn.execute(sql, (log_file_pathname,)).fetchone()
+    return row[0] if row else None
+
+
+def save_log_checkpoint(conn, log_file_pathname, checkpoint):
+    """
+    Save the checkpoint of a followed log file, without committing, so it is committed in the
+    same transaction as the frags it accounts for.
+    :param conn: connection object of sqlite database
+    :param log_file_pathname: path of the followed log file
+    :param checkpoint: the checkpoint in text format
+    """
+    sql = ''' INSERT OR REPLACE INTO log_checkpoint(log_file_pathname, checkpoint) VALUES(?, ?) '''
+    conn.execute(sql, (log_file_pathname, checkpoint))
+
+
+def create_match_statistics_table(conn):
+    """
+    Create the materialized statistics of the matches if they don't exist yet, from the frags
+    already in the database.
+    :param conn: connection object of sqlite database
+    """
+    create_player_index_tables(conn)
+    create_frag_rollup_table(conn)
+    sql = ''' SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'match_player_statistics' '''
+    if conn.execute(sql).fetchone():
+        return
+    with conn:
+        conn.execute(''' CREATE TABLE match_player_statistics (
+                            match_id INTEGER NOT NULL,
+                            player_name TEXT NOT NULL,
+                            kill_count INTEGER NOT NULL,
+                            death_count INTEGER NOT NULL,
+                            suicide_count INTEGER NOT NULL,
+                            efficiency REAL NOT NULL,
+                            PRIMARY KEY (match_id, player_name)
+                        ) ''')
+        conn.execute(''' CREATE INDEX idx_match_player_statistics_player_name
+                        ON match_player_statistics(player_name) ''')
+        conn.execute(''' INSERT INTO match_player_statistics ''' + MATCH_STATISTICS_QUERY)
+
+
+def update_match_statistics(conn, match_id, frags):
+    """
+    Add new frags of a match to its materialized statistics, without committing.
+    :param conn: connection object of sqlite database
+    :param match_id: the identifier of the match
+    :param frags: a list of tuples (frag_time, killer_name[, victim_name, weapon_code]) just inserted
+    """
+    sql = ''' INSERT INTO match_player_statistics(match_id, player_name, kill_count, death_count,
+                                                  suicide_count, efficiency)
+              VALUES(:match_id, :player_name, :kill_count, :death_count, :suicide_count,
+                     ROUND(:kill_count * 100.0 / (:kill_count + :death_count + :suicide_count), 2))
+              ON CONFLICT(match_id, player_name) DO UPDATE SET
+                  kill_count = match_player_statistics.kill_count + excluded.kill_count,
+                  death_count = match_player_statistics.death_count + excluded.death_count,
+                  suicide_count = match_player_statistics.suicide_count + excluded.suicide_count,
+                  efficiency = ROUND(
+                      (match_player_statistics.kill_count + excluded.kill_count) * 100.0 / (
+                          match_player_statistics.kill_count + excluded.kill_count
+                          + match_player_statistics.death_count + excluded.death_count
+                          + match_player_statistics.suicide_count + excluded.suicide_count
+                      ), 2) '''
+    # A player already in the statistics of the match has been counted in the matches of the player index
+    match_player_names = {row[0] for row in conn.execute(
+        ''' SELECT player_name FROM match_player_statistics WHERE match_id = ? ''', (match_id,))}
+    cur = conn.executemany(sql, (
+        {'match_id': match_id, 'player_name': player_name, 'kill_count': kill_count,
+         'death_count': death_count, 'suicide_count': suicide_count}
+        for player_name, kill_count, death_count, suicide_count in count_player_frags(frags)
+    ))
+    metrics.increment('rows_written', cur.rowcount, backend='sqlite', table='match_player_statistics')
+    player_names = {frag[1] for frag in frags} | {frag[2] for frag in frags if len(frag) > 2 and frag[2]}
+    update_player_index(conn, frags, player_names - match_player_names)
+    update_frag_rollups(conn, match_id, frags)
+
+
+def rebuild_match_statistics(conn):
+    """
+    Compute again the materialized statistics of all the matches from the match_frag table
+    :param conn: connection object of sqlite database
+    """
+    create_match_statistics_table(conn)
+    with conn:
+        conn.execute(''' DELETE FROM match_player_statistics ''')
+        conn.execute(''' INSERT INTO match_player_statistics ''' + MATCH_STATISTICS_QUERY)
+        for table_name, key_columns, count_columns, query in PLAYER_INDEX_TABLES:
+            conn.execute(''' DELETE FROM %s ''' % table_name)
+            conn.execute(''' INSERT INTO %s(%s) ''' % (table_name, ', '.join(key_columns + count_columns)) + query)
+        conn.execute(''' DELETE FROM frag_rollup ''')
+        insert_frag_rollups(conn)
+
+
+def check_match_statistics(conn):
+    """
+    :param conn: connection object of sqlite database
+    :return: a tuple (missing_rows, unexpected_rows) of the differences between the materialized
+             statistics and the ones computed from the match_frag table, see compare_match_statistics
+    """
+    create_match_statistics_table(conn)
+    materialized_rows = conn.execute(''' SELECT match_id, player_name, kill_count, death_count, suicide_count,
+                                          efficiency FROM match_player_statistics ''').fetchall()
+    return compare_match_statistics(materialized_rows, conn.execute(MATCH_STATISTICS_QUERY).fetchall())
+
+
+def create_player_index_tables(conn):
+    """
+    Create the tables of the cross-match player index if they don't exist yet, from the frags already
+    in the database. See utilities.statistics_util.PLAYER_INDEX_TABLES
+    :param conn: connection object of sqlite database
+    """
+    sql = ''' SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ? '''
+    for table_name, key_columns, count_columns, query in PLAYER_INDEX_TABLES:
+        if conn.execute(sql, (table_name,)).fetchone():
+            continue
+        with conn:
+            conn.execute(''' CREATE TABLE %s (%s, PRIMARY KEY (%s)) ''' % (
+                table_name, ', '.join(['%s TEXT NOT NULL' % column for column in key_columns]
+                                      + ['%s INTEGER NOT NULL' % column for column in count_columns]),
+                ', '.join(key_columns)))
+            conn.execute(''' INSERT INTO %s(%s) ''' % (table_name, ', '.join(key_columns + count_columns)) + query)
+
+
+def update_player_index(conn, frags, new_player_names, sign=1):
+    """
+    Add the frags of a match to the player index, or subtract them, without committing.
+    :param conn: connection object of sqlite database
+    :param frags: a list of tuples (frag_time, killer_name[, victim_name, weapon_code])
+    :param new_player_names: players whose match count changes: the ones for which these are the first
+                             frags of the match, or all the players of the match when it is deleted
+    :param sign: 1 to add the frags, -1 to subtract them, the rows left with only 0 counts are deleted
+    """
+    rows = count_player_index(frags, new_player_names, sign)
+    for table_name, key_columns, count_columns, _ in PLAYER_INDEX_TABLES:
+        conn.executemany(build_counter_upsert('sqlite', table_name, key_columns, count_columns),
+                         rows[table_name])
+        if sign < 0:
+            conn.executemany(build_counter_cleanup('sqlite', table_name, key_columns, count_columns),
+                             rows[table_name])
+        metrics.increment('rows_written', len(rows[table_name]), backend='sqlite', table=table_name)
+
+
+def check_player_index(conn):
+    """
+    :param conn: connection object of sqlite database
+    :return: a tuple (missing_rows, unexpected_rows) of the differences between the player index and
+             the rows computed from the match_frag table, see compare_player_index
+    """
+    create_player_index_tables(conn)
+    materialized_rows = {}
+    computed_rows = {}
+    for table_name, key_columns, count_columns, query in PLAYER_INDEX_TABLES:
+        materialized_rows[table_name] = conn.execute(''' SELECT %s FROM %s ''' % (
+            ', '.join(key_columns + count_columns), table_name)).fetchall()
+        computed_rows[table_name] = conn.execute(query).fetchall()
+    return compare_player_index(materialized_rows, computed_rows)
+
+
+def get_player_profile(conn, player_name):
+    """
+    :param conn: connection object of sqlite database
+    :param player_name: name of the player
+    :return: dictionary of the totals of the player over all the matches, with their weapons, their opponents
+             and their statistics in each match (see build_player_profile), or None if the player never fragged
+    """
+    create_match_statistics_table(conn)
+    player_row = conn.execute(''' SELECT player_name, match_count, kill_count, death_count, suicide_count
+                                  FROM player_statistics WHERE player_name = ? ''', (player_name,)).fetchone()
+    if player_row is None:
+        return None
+    weapon_rows = conn.execute(''' SELECT weapon_code, kill_count FROM player_weapon_statistics
+                                   WHERE player_name = ? ''', (player_name,)).fetchall()
+    opponent_rows = conn.execute(''' SELECT opponent_name, kill_count, death_count FROM player_opponent_statistics
+                                     WHERE player_name = ? ''', (player_name,)).fetchall()
+    match_rows = conn.execute(''' SELECT s.match_id, s.kill_count, s.death_count, s.suicide_count, s.efficiency
+                                  FROM match_player_statistics s JOIN match m ON m.match_id = s.match_id
+                                  WHERE s.player_name = ? ORDER BY m.start_time ''', (player_name,)).fetchall()
+    return build_player_profile(player_row, weapon_rows, opponent_rows, match_rows)
+
+
+def get_head_to_head(conn, player_name, opponent_name):
+    """
+    :param conn: connection object of sqlite database
+    :return: a tuple (kill_count, death_count): number of times player_name killed opponent_name,
+             and was killed by them, over all the matches
+    """
+    create_match_statistics_table(conn)
+    row = conn.execute(''' SELECT kill_count, death_count FROM player_opponent_statistics
+                           WHERE player_name = ? AND opponent_name = ? ''', (player_name, opponent_name)).fetchone()
+    return tuple(row) if row else (0, 0)
+
+
+def create_frag_rollup_table(conn):
+    """
+    Create the rollups of the frags if they don't exist yet, from the frags already in the database.
+    See utilities.statistics_util.FRAG_ROLLUP_TABLE
+    :param conn: connection object of sqlite database
+    """
+    sql = ''' SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'frag_rollup' '''
+    if conn.execute(sql).fetchone():
+        return
+    with conn:
+        conn.execute(''' CREATE TABLE frag_rollup (
+                            granularity TEXT NOT NULL,
+                            bucket_time INTEGER NOT NULL,
+                            map_name TEXT NOT NULL,
+                            game_mode TEXT NOT NULL,
+                            weapon_class TEXT NOT NULL,
+                            frag_count INTEGER NOT NULL,
+                            PRIMARY KEY (granularity, bucket_time, map_name, game_mode, weapon_class)
+                        ) ''')
+        insert_frag_rollups(conn)
+
+
+def iter_frag_rollups(conn):
+    """
+    :param conn: connection object of sqlite database
+    :return: a generator of the rows of the rollups of all the frags of the match_frag table, match by match
+    """
+    sql = ''' SELECT f.match_id, m.map_name, m.game_mode, f.frag_time, f.killer_name, f.victim_name, f.weapon_code
+              FROM match_frag f JOIN match m ON m.match_id = f.match_id
+              ORDER BY f.match_id '''
+    for _, match_rows in groupby(conn.execute(sql), key=lambda row: row[0]):
+        match_rows = list(match_rows)
+        yield from count_frag_rollups([row[3:] for row in match_rows], match_rows[0][1], match_rows[0][2])
+
+
+def insert_frag_rollups(conn):
+    """
+    Compute the rollups of all the frags of the match_frag table into the empty frag_rollup table, without committing.
+    :param conn: connection object of sqlite database
+    """
+    table_name, key_columns, count_columns = FRAG_ROLLUP_TABLE
+    conn.executemany(build_counter_upsert('sqlite', table_name, key_columns, count_columns), iter_frag_rollups(conn))
+
+
+def update_frag_rollups(conn, match_id, frags, sign=1):
+    """
+    Add the frags of a match to the rollups, or subtract them, without committing.
+    :param conn: connection object of sqlite database
+    :param match_id: the identifier of the match, its map and mode are read from the match table
+    :param frags: a list of tuples (frag_time, killer_name[, victim_name, weapon_code])
+    :param sign: 1 to add the frags, -1 to subtract them, the buckets left empty are deleted
+    """
+    map_name, game_mode = conn.execute(''' SELECT map_name, game_mode FROM match WHERE match_id = ? ''',
+                                       (match_id,)).fetchone()
+    rows = count_frag_rollups(frags, map_name, game_mode, sign)
+    table_name, key_columns, count_columns = FRAG_ROLLUP_TABLE
+    conn.executemany(build_counter_upsert('sqlite', table_name, key_columns, count_columns), rows)
+    if sign < 0:
+        conn.executemany(build_counter_cleanup('sqlite', table_name, key_columns, count_columns), rows)
+    metrics.increment('rows_written', len(rows), backend='sqlite', table=table_name)
+
+
+def check_frag_rollups(conn):
+    """
+    :param conn: connection object of sqlite database
+    :return: a tuple (missing_rows, unexpected_rows) of the differences between the rollups and the ones
+             computed from the match_frag table, rows (granularity, bucket_time, map_name, game_mode,
+             weapon_class, frag_count)
+    """
+    create_frag_rollup_table(conn)
+    table_name, key_columns, count_columns = FRAG_ROLLUP_TABLE
+    computed_counts = {}
+    for row in iter_frag_rollups(conn):
+        key = tuple(row[column] for column in key_columns)
+        computed_counts[key] = computed_counts.get(key, 0) + row['frag_count']
+    computed_rows = {key + (count,) for key, count in computed_counts.items()}
+    materialized_rows = set(conn.execute(''' SELECT %s FROM %s ''' % (
+        ', '.join(key_columns + count_columns), table_name)).fetchall())
+    return sorted(computed_rows - materialized_rows, key=str), sorted(materialized_rows - computed_rows, key=str)
+
+
+def get_frag_rollups(conn, granularity, start_time=None, end_time=None, map_name=None, game_mode=None,
+                     weapon_class=None, group_by=('map_name', 'game_mode', 'weapon_class')):
+    """
+    Count the frags by time bucket from the rollups, without reading the frags.
+    :param conn: connection object of sqlite database
+    :param granularity: 'minute', 'hour', 'day', 'week' or 'month', the buckets are aligned on UTC
+    :param start_time: datetime with time zone of the start of the range, None for the first frag
+    :param end_time: datetime with time zone of the end of the range (excluded), None for the last frag
+    :param map_name: only count the frags of this map
+    :param game_mode: only count the frags of this mode
+    :param weapon_class: only count the frags of this weapon class, see statistics_util.get_weapon_class
+    :param group_by: columns counted apart, among 'map_name', 'game_mode' and 'weapon_class'
+    :return: list of tuples (bucket start as a UTC datetime, values of the group_by columns..., frag_count)
+        example:
+        >>>get_frag_rollups(conn, 'week', group_by=('weapon_class',))
+        [(datetime(2019, 2, 25, 0, 0, tzinfo=timezone.utc), 'Commando', 5120), ...]
+    """
+    create_frag_rollup_table(conn)
+    parameters = get_frag_rollup_parameters(granularity, start_time, end_time, map_name, game_mode, weapon_class)
+    rows = conn.execute(build_frag_rollup_query('sqlite', map_name, game_mode, weapon_class), parameters)
+    return group_frag_rollups(rows, granularity, group_by)
+
+
+def get_match_statistics(conn, match_id):
+    """
+    :param conn: connection object of sqlite database
+    :param match_id: the identifier of the match
+    :return: list of tuples (player_name, kill_count, death_count, suicide_count, efficiency) of the players
+             of the match, by descending kill count
+    """
+    sql = ''' SELECT player_name, kill_count, death_count, suicide_count, efficiency
+              FROM match_player_statistics WHERE match_id = ? ORDER BY kill_count DESC '''
+    return conn.execute(sql, (match_id,)).fetchall()
+
+
+def get_lucky_luke_killers(conn, min_kill_count=3, max_time_between_kills=10):
+    """
+    :param conn: connection object of sqlite database
+    :param min_kill_count: minimum number of kills of the longest series of a killer
+    :param max_time_between_kills: maximum number of seconds between two kills of the same series
+    :return: list of tuples (match_id, killer_name, kill_count) of the longest series of kills of each
+             killer of each match, see utilities.statistics_util.LUCKY_LUKE_QUERY
+    """
+    return conn.execute(build_lucky_luke_query('sqlite'), {
+        'min_kill_count': min_kill_count, 'max_time_between_kills': max_time_between_kills
+    }).fetchall()
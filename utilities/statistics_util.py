@@ -0,0 +1,488 @@
+from datetime import datetime, timezone, timedelta
+
+# Per match and per player statistics, as computed by the match_statistics view (see sql_queries/WP45.sql).
+# The subquery is aliased so that the query also runs on PostgreSQL.
+MATCH_STATISTICS_QUERY = """
+SELECT
+    match_id,
+    player_name,
+    SUM(kill_count) AS kill_count,
+    SUM(death_count) AS death_count,
+    SUM(suicide_count) AS suicide_count,
+    ROUND(
+        SUM(kill_count) * 100.0 / (
+            SUM(kill_count) + SUM(death_count) + SUM(suicide_count)
+        ), 2
+    ) AS efficiency
+FROM
+(
+    SELECT
+        match_id,
+        killer_name AS player_name,
+        COUNT(victim_name) AS kill_count,
+        COUNT(*) - COUNT(victim_name) AS suicide_count,
+        0 AS death_count
+    FROM match_frag
+    GROUP BY
+        match_id,
+        killer_name
+    UNION ALL
+    SELECT
+        match_id,
+        victim_name AS player_name,
+        0 AS kill_count,
+        0 AS suicide_count,
+        COUNT(victim_name) AS death_count
+    FROM match_frag
+    WHERE
+        victim_name IS NOT NULL
+    GROUP BY
+        match_id,
+        victim_name
+) AS player_frag_counts
+GROUP BY
+    match_id,
+    player_name
+"""
+
+
+def count_player_frags(frags):
+    """
+    :param frags: a list of tuples (frag_time, killer_name[, victim_name, weapon_code])
+    :return: a list of tuples (player_name, kill_count, death_count, suicide_count) of every player
+             of these frags, in the order they first appear
+    """
+    counts = {}
+    for frag in frags:
+        killer_counts = counts.setdefault(frag[1], [0, 0, 0])
+        if len(frag) > 2 and frag[2] is not None:
+            killer_counts[0] += 1
+            counts.setdefault(frag[2], [0, 0, 0])[1] += 1
+        else:
+            killer_counts[2] += 1
+    return [(player_name,) + tuple(player_counts) for player_name, player_counts in counts.items()]
+
+
+def compare_match_statistics(materialized_rows, computed_rows):
+    """
+    :param materialized_rows: rows (match_id, player_name, kill_count, death_count, suicide_count, efficiency)
+                              of the materialized statistics table
+    :param computed_rows: rows of MATCH_STATISTICS_QUERY
+    :return: a tuple (missing_rows, unexpected_rows): rows of the query that are not in the table, and rows
+             of the table that are not in the query. Both are empty when the table is consistent.
+    """
+    def normalize(rows):
+        return {tuple(row[:5]) + (float(row[5]),) for row in rows}
+
+    materialized_rows = normalize(materialized_rows)
+    computed_rows = normalize(computed_rows)
+    return sorted(computed_rows - materialized_rows, key=str), sorted(materialized_rows - computed_rows, key=str)
+
+
+# Longest Lucky Luke series of kills of each killer of each match, in one sorted pass over the frags
+# (see sql_queries/WP55.sql). A kill starts a new series when the previous kill of the same killer in the
+# same match is more than max_time_between_kills seconds older; the running sum of these starts numbers
+# the series of the killer. The difference of two frag times in seconds depends on the backend, see
+# build_lucky_luke_query.
+LUCKY_LUKE_QUERY = """
+SELECT
+    match_id,
+    killer_name,
+    MAX(kill_count) AS kill_count
+FROM
+(
+    SELECT
+        match_id,
+        killer_name,
+        series_number,
+        COUNT(*) AS kill_count
+    FROM
+    (
+        SELECT
+            match_id,
+            killer_name,
+            SUM(new_series) OVER (PARTITION BY match_id, killer_name ORDER BY frag_time) AS series_number
+        FROM
+        (
+            SELECT
+                match_id,
+                killer_name,
+                frag_time,
+                CASE WHEN {seconds_since_previous_kill} <= {max_time_between_kills} THEN 0 ELSE 1 END AS new_series
+            FROM match_frag
+            WHERE
+                victim_name IS NOT NULL
+            WINDOW killer_kills AS (PARTITION BY match_id, killer_name ORDER BY frag_time)
+        ) AS kills
+    ) AS numbered_kills
+    GROUP BY
+        match_id,
+        killer_name,
+        series_number
+) AS series
+GROUP BY
+    match_id,
+    killer_name
+HAVING
+    MAX(kill_count) >= {min_kill_count}
+"""
+
+LUCKY_LUKE_QUERY_BACKENDS = {
+    # SQLite stores the frag times in seconds since the epoch, see utilities.migrations
+    'sqlite': {
+        'seconds_since_previous_kill': 'frag_time - LAG(frag_time) OVER killer_kills',
+        'max_time_between_kills': ':max_time_between_kills',
+        'min_kill_count': ':min_kill_count',
+    },
+    'postgres': {
+        'seconds_since_previous_kill': 'EXTRACT(EPOCH FROM frag_time - LAG(frag_time) OVER killer_kills)',
+        'max_time_between_kills': '%(max_time_between_kills)s',
+        'min_kill_count': '%(min_kill_count)s',
+    },
+}
+
+
+def build_lucky_luke_query(backend):
+    """
+    :param backend: 'sqlite' or 'postgres'
+    :return: LUCKY_LUKE_QUERY for this backend, with the named parameters min_kill_count and
+             max_time_between_kills. Its rows are (match_id, killer_name, kill_count)
+    """
+    return LUCKY_LUKE_QUERY.format(**LUCKY_LUKE_QUERY_BACKENDS[backend])
+
+
+# Cross-match index of the players, maintained at ingest time next to match_player_statistics so that a
+# player profile is read from a few rows instead of scanning match_frag (see sql_queries/wp40.sql, WP50.sql...).
+# Each table is (table name, key columns, count columns, query computing its rows from match_frag).
+PLAYER_INDEX_TABLES = (
+    ('player_statistics', ('player_name',), ('match_count', 'kill_count', 'death_count', 'suicide_count'), """
+SELECT
+    player_name,
+    COUNT(DISTINCT match_id) AS match_count,
+    SUM(kill_count) AS kill_count,
+    SUM(death_count) AS death_count,
+    SUM(suicide_count) AS suicide_count
+FROM
+(
+    SELECT
+        match_id,
+        killer_name AS player_name,
+        COUNT(victim_name) AS kill_count,
+        0 AS death_count,
+        COUNT(*) - COUNT(victim_name) AS suicide_count
+    FROM match_frag
+    GROUP BY
+        match_id,
+        killer_name
+    UNION ALL
+    SELECT
+        match_id,
+        victim_name AS player_name,
+        0 AS kill_count,
+        COUNT(*) AS death_count,
+        0 AS suicide_count
+    FROM match_frag
+    WHERE
+        victim_name IS NOT NULL
+    GROUP BY
+        match_id,
+        victim_name
+) AS player_frag_counts
+GROUP BY
+    player_name
+"""),
+    ('player_weapon_statistics', ('player_name', 'weapon_code'), ('kill_count',), """
+SELECT
+    killer_name AS player_name,
+    weapon_code,
+    COUNT(*) AS kill_count
+FROM match_frag
+WHERE
+    victim_name IS NOT NULL
+GROUP BY
+    killer_name,
+    weapon_code
+"""),
+    ('player_opponent_statistics', ('player_name', 'opponent_name'), ('kill_count', 'death_count'), """
+SELECT
+    player_name,
+    opponent_name,
+    SUM(kill_count) AS kill_count,
+    SUM(death_count) AS death_count
+FROM
+(
+    SELECT
+        killer_name AS player_name,
+        victim_name AS opponent_name,
+        COUNT(*) AS kill_count,
+        0 AS death_count
+    FROM match_frag
+    WHERE
+        victim_name IS NOT NULL
+    GROUP BY
+        killer_name,
+        victim_name
+    UNION ALL
+    SELECT
+        victim_name AS player_name,
+        killer_name AS opponent_name,
+        0 AS kill_count,
+        COUNT(*) AS death_count
+    FROM match_frag
+    WHERE
+        victim_name IS NOT NULL
+    GROUP BY
+        victim_name,
+        killer_name
+) AS opponent_frag_counts
+GROUP BY
+    player_name,
+    opponent_name
+"""),
+)
+
+PARAMETER_STYLES = {'sqlite': ':%s', 'postgres': '%%(%s)s'}
+
+
+def build_counter_upsert(backend, table_name, key_columns, count_columns):
+    """
+    :param backend: 'sqlite' or 'postgres'
+    :return: statement adding the counts of a row, with one named parameter per column, to the row of
+             the same key in a counter table (PLAYER_INDEX_TABLES, FRAG_ROLLUP_TABLE), inserted if the key is missing
+    """
+    columns = key_columns + count_columns
+    return ''' INSERT INTO {0}({1}) VALUES({2})
+               ON CONFLICT({3}) DO UPDATE SET {4} '''.format(
+        table_name, ', '.join(columns), ', '.join(PARAMETER_STYLES[backend] % column for column in columns),
+        ', '.join(key_columns),
+        ', '.join('{1} = {0}.{1} + excluded.{1}'.format(table_name, column) for column in count_columns))
+
+
+def build_counter_cleanup(backend, table_name, key_columns, count_columns):
+    """
+    :param backend: 'sqlite' or 'postgres'
+    :return: statement deleting the row of a key from a counter table once all its counts are 0,
+             after the frags of a match have been subtracted from it
+    """
+    return ''' DELETE FROM {0} WHERE {1} AND {2} '''.format(
+        table_name, ' AND '.join('%s = %s' % (column, PARAMETER_STYLES[backend] % column) for column in key_columns),
+        ' AND '.join('%s = 0' % column for column in count_columns))
+
+
+# Weapon classes of sql_queries/get_killer_class.sql
+WEAPON_CLASSES = {
+    'Hitman': ('Machete', 'Falcon', 'MP5'),
+    'Sniper': ('SniperRifle',),
+    'Commando': ('AG36', 'OICW', 'P90', 'M4', 'Shotgun', 'M249'),
+    'Psychopath': ('Rocket', 'VehicleRocket', 'HandGrenade', 'StickyExplosive', 'Boat', 'Vehicle',
+                   'VehicleMountedRocketMG', 'VehicleMountedAutoMG', 'MG', 'VehicleMountedMG', 'OICWGrenade',
+                   'AG36Grenade'),
+}
+WEAPON_CODE_CLASSES = {weapon_code: weapon_class for weapon_class, weapon_codes in WEAPON_CLASSES.items()
+                       for weapon_code in weapon_codes}
+DEFAULT_WEAPON_CLASS = 'No Name'
+# Class of the suicides in the rollups, they have no weapon
+SUICIDE_WEAPON_CLASS = 'Suicide'
+
+# Rollups of the frags, counted by time bucket, map, mode and weapon class. The minute buckets are counted
+# from the frags, the coarser ones are summed from the minute buckets. A bucket is identified by the time
+# of its start in seconds since the epoch, the buckets are aligned on UTC.
+# Coarser granularities of queries are summed from the day buckets, see group_frag_rollups.
+ROLLUP_GRANULARITIES = (('minute', 60), ('hour', 3600), ('day', 86400))
+QUERY_GRANULARITIES = ('minute', 'hour', 'day', 'week', 'month')
+FRAG_ROLLUP_TABLE = ('frag_rollup', ('granularity', 'bucket_time', 'map_name', 'game_mode', 'weapon_class'),
+                     ('frag_count',))
+
+
+def get_weapon_class(weapon_code):
+    """
+    :param weapon_code: code of a weapon, None for a suicide
+    :return: class of the weapon as computed by get_killer_class, SUICIDE_WEAPON_CLASS for a suicide
+    """
+    if weapon_code is None:
+        return SUICIDE_WEAPON_CLASS
+    return WEAPON_CODE_CLASSES.get(weapon_code, DEFAULT_WEAPON_CLASS)
+
+
+def count_frag_rollups(frags, map_name, game_mode, sign=1):
+    """
+    :param frags: a list of tuples (frag_time, killer_name[, victim_name, weapon_code]) of a match, frag_time
+                  being a datetime with time zone or seconds since the epoch
+    :param map_name: map of the match
+    :param game_mode: mode of the match
+    :param sign: 1 to add the frags to the rollups, -1 to subtract them
+    :return: list of the rows to add to FRAG_ROLLUP_TABLE, as dictionaries of the column values
+    """
+    minute_counts = {}
+    for frag in frags:
+        frag_time = frag[0] if isinstance(frag[0], int) else int(frag[0].timestamp())
+        weapon_class = get_weapon_class(frag[3] if len(frag) > 2 and frag[2] is not None else None)
+        key = frag_time - frag_time % 60, weapon_class
+        minute_counts[key] = minute_counts.get(key, 0) + 1
+
+    counts = {}
+    for granularity, seconds in ROLLUP_GRANULARITIES:
+        for (bucket_time, weapon_class), count in minute_counts.items():
+            key = granularity, bucket_time - bucket_time % seconds, weapon_class
+            counts[key] = counts.get(key, 0) + count
+    return [{'granularity': granularity, 'bucket_time': bucket_time, 'map_name': map_name, 'game_mode': game_mode,
+             'weapon_class': weapon_class, 'frag_count': sign * count}
+            for (granularity, bucket_time, weapon_class), count in counts.items()]
+
+
+def get_rollup_granularity(granularity):
+    """
+    :param granularity: granularity of a query, see QUERY_GRANULARITIES
+    :return: the granularity of the stored rollups the query is computed from
+    """
+    if granularity not in QUERY_GRANULARITIES:
+        raise ValueError('Unknown rollup granularity: %s' % granularity)
+    return granularity if granularity in dict(ROLLUP_GRANULARITIES) else 'day'
+
+
+def get_bucket_start(bucket_time, granularity):
+    """
+    :param bucket_time: start of a stored bucket, in seconds since the epoch
+    :param granularity: granularity of the query, see QUERY_GRANULARITIES
+    :return: the start of the bucket of the query holding it, as a UTC datetime. Weeks start on Monday.
+    """
+    bucket_start = datetime.fromtimestamp(bucket_time, timezone.utc)
+    if granularity == 'week':
+        bucket_start -= timedelta(days=bucket_start.weekday())
+    elif granularity == 'month':
+        bucket_start = bucket_start.replace(day=1)
+    return bucket_start
+
+
+def group_frag_rollups(rows, granularity, group_by):
+    """
+    :param rows: rows (bucket_time, map_name, game_mode, weapon_class, frag_count) of FRAG_ROLLUP_TABLE
+    :param granularity: granularity of the query, see QUERY_GRANULARITIES
+    :param group_by: columns kept apart in the result, among 'map_name', 'game_mode' and 'weapon_class'
+    :return: list of tuples (bucket start as a UTC datetime, values of the group_by columns..., frag_count)
+             sorted by bucket then values
+    """
+    columns = ('map_name', 'game_mode', 'weapon_class')
+    for column in group_by:
+        if column not in columns:
+            raise ValueError('Cannot group the rollups by %s' % column)
+    indices = [columns.index(column) + 1 for column in group_by]
+    counts = {}
+    for row in rows:
+        key = (get_bucket_start(row[0], granularity),) + tuple(row[index] for index in indices)
+        counts[key] = counts.get(key, 0) + int(row[4])
+    return [key + (count,) for key, count in sorted(counts.items())]
+
+
+def build_frag_rollup_query(backend, map_name=None, game_mode=None, weapon_class=None):
+    """
+    :param backend: 'sqlite' or 'postgres'
+    :return: query of the rows (bucket_time, map_name, game_mode, weapon_class, frag_count) of FRAG_ROLLUP_TABLE
+             between two bucket times, with the named parameters granularity, start_time and end_time,
+             and one more for each filter that isn't None
+    """
+    conditions = ['granularity = %s' % (PARAMETER_STYLES[backend] % 'granularity'),
+                  'bucket_time >= %s' % (PARAMETER_STYLES[backend] % 'start_time'),
+                  'bucket_time < %s' % (PARAMETER_STYLES[backend] % 'end_time')]
+    for column, value in (('map_name', map_name), ('game_mode', game_mode), ('weapon_class', weapon_class)):
+        if value is not None:
+            conditions.append('%s = %s' % (column, PARAMETER_STYLES[backend] % column))
+    return ''' SELECT bucket_time, map_name, game_mode, weapon_class, frag_count FROM frag_rollup
+               WHERE %s ''' % ' AND '.join(conditions)
+
+
+def get_frag_rollup_parameters(granularity, start_time=None, end_time=None, map_name=None, game_mode=None,
+                               weapon_class=None):
+    """
+    :return: parameters of build_frag_rollup_query, for the stored granularity the query granularity is summed
+             from (see get_rollup_granularity). start_time is rounded down to the start of its stored bucket,
+             the stored buckets starting before end_time are counted
+    """
+    rollup_granularity = get_rollup_granularity(granularity)
+    seconds = dict(ROLLUP_GRANULARITIES)[rollup_granularity]
+    start_time = int(start_time.timestamp()) if start_time is not None else 0
+    end_time = int(end_time.timestamp()) if end_time is not None else 2 ** 62
+    return {'granularity': rollup_granularity, 'start_time': start_time - start_time % seconds,
+            'end_time': end_time, 'map_name': map_name, 'game_mode': game_mode, 'weapon_class': weapon_class}
+
+
+def count_player_index(frags, new_player_names=(), sign=1):
+    """
+    :param frags: a list of tuples (frag_time, killer_name[, victim_name, weapon_code])
+    :param new_player_names: players for which these frags are the first ones of their match
+    :param sign: 1 to add the frags to the index, -1 to subtract them
+    :return: dictionary {table name of PLAYER_INDEX_TABLES: list of the rows to add to the table,
+             as dictionaries of the column values}
+    """
+    new_player_names = set(new_player_names)
+    weapon_counts = {}
+    opponent_counts = {}
+    for frag in frags:
+        if len(frag) > 2 and frag[2] is not None:
+            weapon_counts[frag[1], frag[3]] = weapon_counts.get((frag[1], frag[3]), 0) + 1
+            opponent_counts.setdefault((frag[1], frag[2]), [0, 0])[0] += 1
+            opponent_counts.setdefault((frag[2], frag[1]), [0, 0])[1] += 1
+
+    return {
+        'player_statistics': [
+            {'player_name': player_name, 'match_count': sign * (player_name in new_player_names),
+             'kill_count': sign * kill_count, 'death_count': sign * death_count,
+             'suicide_count': sign * suicide_count}
+            for player_name, kill_count, death_count, suicide_count in count_player_frags(frags)
+        ],
+        'player_weapon_statistics': [
+            {'player_name': player_name, 'weapon_code': weapon_code, 'kill_count': sign * kill_count}
+            for (player_name, weapon_code), kill_count in weapon_counts.items()
+        ],
+        'player_opponent_statistics': [
+            {'player_name': player_name, 'opponent_name': opponent_name, 'kill_count': sign * kill_count,
+             'death_count': sign * death_count}
+            for (player_name, opponent_name), (kill_count, death_count) in opponent_counts.items()
+        ],
+    }
+
+
+def compare_player_index(materialized_rows, computed_rows):
+    """
+    :param materialized_rows: {table name of PLAYER_INDEX_TABLES: rows of the table}
+    :param computed_rows: {table name of PLAYER_INDEX_TABLES: rows of its query}
+    :return: a tuple (missing_rows, unexpected_rows) as compare_match_statistics, each row prefixed with
+             the name of its table
+    """
+    missing_rows = []
+    unexpected_rows = []
+    for table_name, key_columns, count_columns, _ in PLAYER_INDEX_TABLES:
+        def normalize(rows):
+            return {(table_name,) + tuple(row[:len(key_columns)])
+                    + tuple(int(count) for count in row[len(key_columns):]) for row in rows}
+
+        table_rows = normalize(materialized_rows[table_name])
+        query_rows = normalize(computed_rows[table_name])
+        missing_rows.extend(sorted(query_rows - table_rows, key=str))
+        unexpected_rows.extend(sorted(table_rows - query_rows, key=str))
+    return missing_rows, unexpected_rows
+
+
+def build_player_profile(player_row, weapon_rows, opponent_rows, match_rows):
+    """
+    :param player_row: row (player_name, match_count, kill_count, death_count, suicide_count) of player_statistics
+    :param weapon_rows: rows (weapon_code, kill_count) of the player in player_weapon_statistics
+    :param opponent_rows: rows (opponent_name, kill_count, death_count) of the player in player_opponent_statistics
+    :param match_rows: rows (match_id, kill_count, death_count, suicide_count, efficiency) of the player
+                       in match_player_statistics, in the order of the matches
+    :return: dictionary of the profile of the player, the weapons by descending kill count and the opponents
+             by descending number of frags between them and the player
+    """
+    player_name, match_count, kill_count, death_count, suicide_count = player_row
+    frag_count = kill_count + death_count + suicide_count
+    return {
+        'player_name': player_name,
+        'match_count': match_count,
+        'kill_count': kill_count,
+        'death_count': death_count,
+        'suicide_count': suicide_count,
+        'efficiency': round(kill_count * 100.0 / frag_count, 2) if frag_count else 0.0,
+        'weapons': sorted(map(tuple, weapon_rows), key=lambda row: (-row[1], row[0])),
+        'opponents': sorted(map(tuple, opponent_rows), key=lambda row: (-(row[1] + row[2]), row[0])),
+        'matches': [tuple(row) for row in match_rows],
+    }
@@ -0,0 +1,188 @@
+from utilities import metrics
+
+# Longest kill and death series of every player of every match of a FragTable, as the positions of their frags
+# in the table. The series are found with array operations when numpy is installed (pip install numpy),
+# numpy is only imported when they are computed and isn't needed for the rest of the package.
+# Without numpy, the frags are walked once in Python.
+
+# Kinds of the events of the series of a player, the events of the same frag are handled in this order
+BREAK_EVENT = 0
+COUNT_EVENT = 1
+SUICIDE_EVENT = 2
+
+
+def import_numpy():
+    """
+    :return: the numpy module, or None if it isn't installed
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def find_longest_series(frag_table, losers=False):
+    """
+    :param frag_table: a FragTable of the frags of one or many matches
+    :param losers: False for the kill series of calculate_serial_killers, True for the death series of
+                   calculate_serial_losers
+    :return: dictionary of the longest series of each player of each match, with the same players, order
+             and ties as calculate_serial_killers / calculate_serial_losers:
+             {match_id: {player code: list of the indices of the frags of the series in the table}}
+    """
+    numpy = import_numpy()
+    if numpy is None:
+        metrics.increment('streak_series', implementation='walk')
+        return walk_longest_series(frag_table, losers)
+    metrics.increment('streak_series', implementation='numpy')
+    return vectorize_longest_series(numpy, frag_table, losers)
+
+
+def walk_longest_series(frag_table, losers=False):
+    """
+    find_longest_series without numpy: the frags of each match are walked once through the integer columns
+    of the table, only the current and the longest series of each player are tracked, as ranges of positions.
+    """
+    killer_codes = frag_table.killer_codes
+    victim_codes = frag_table.victim_codes
+    suicides = frag_table.suicides
+
+    longest_series_by_match = {}
+    for match_id, indices in frag_table.match_indices().items():
+        # [position of the first frag, number of frags] of the current series of each player
+        current_series = {}
+        # [position of the first frag, position of the last frag, number of frags] of the longest series
+        longest_series = {}
+        match_frags = zip(frag_table.take(killer_codes, indices), frag_table.take(victim_codes, indices),
+                          frag_table.take(suicides, indices))
+        for position, (killer_code, victim_code, suicide) in enumerate(match_frags):
+            if suicide:
+                # A suicide ends the current series. Of the losers, it starts the next one
+                series = current_series.get(killer_code)
+                if series and series[1]:
+                    current_series[killer_code] = [position, 1 if losers else 0]
+                continue
+
+            player_code, other_player_code = (victim_code, killer_code) if losers else (killer_code, victim_code)
+            if player_code not in current_series:
+                current_series[player_code] = [position, 0]
+                longest_series[player_code] = [position, position, 0]
+            other_series = current_series.get(other_player_code)
+            if other_series and other_series[1]:
+                current_series[other_player_code] = [position, 0]
+
+            series = current_series[player_code]
+            if not series[1]:
+                series[0] = position
+            series[1] += 1
+            if series[1] > longest_series[player_code][2]:
+                longest_series[player_code] = [series[0], position, series[1]]
+
+        match_series = {}
+        for player_code, (first_position, last_position, _) in longest_series.items():
+            series_indices = []
+            for index in indices[first_position:last_position + 1]:
+                if suicides[index]:
+                    if losers and index == indices[first_position] and killer_codes[index] == player_code:
+                        series_indices.append(index)
+                elif (victim_codes[index] if losers else killer_codes[index]) == player_code:
+                    series_indices.append(index)
+            match_series[player_code] = series_indices
+        longest_series_by_match[match_id] = match_series
+    return longest_series_by_match
+
+
+def vectorize_longest_series(numpy, frag_table, losers=False):
+    """
+    find_longest_series with array operations over the whole table, whatever the number of matches.
+    Every frag becomes the events of its players: a kill is a COUNT_EVENT of the killer (of the victim for
+    the losers) and a BREAK_EVENT of the other player, a suicide a BREAK_EVENT of its player (a SUICIDE_EVENT
+    for the losers). The events are sorted by match, player and frag, the series start at the first event
+    of each player and at each break, and their lengths are counted with bincount.
+    :param numpy: the numpy module, see import_numpy
+    """
+    if not len(frag_table):
+        return {}
+    frag_indices = numpy.arange(len(frag_table))
+    match_codes = numpy.asarray(frag_table.match_codes)
+    killer_codes = numpy.asarray(frag_table.killer_codes)
+    victim_codes = numpy.asarray(frag_table.victim_codes)
+    suicides = numpy.asarray(frag_table.suicides).astype(bool)
+    kills = ~suicides
+    counted_codes, broken_codes = (victim_codes, killer_codes) if losers else (killer_codes, victim_codes)
+
+    event_frags = numpy.concatenate((frag_indices[kills], frag_indices[kills], frag_indices[suicides]))
+    event_players = numpy.concatenate((broken_codes[kills], counted_codes[kills], killer_codes[suicides]))
+    event_kinds = numpy.concatenate((numpy.full(kills.sum(), BREAK_EVENT), numpy.full(kills.sum(), COUNT_EVENT),
+                                     numpy.full(suicides.sum(), SUICIDE_EVENT if losers else BREAK_EVENT)))
+    order = numpy.lexsort((event_kinds, event_frags, event_players, match_codes[event_frags]))
+    event_frags, event_players, event_kinds = event_frags[order], event_players[order], event_kinds[order]
+
+    def find_group_starts(event_frags, event_players):
+        group_starts = numpy.ones(len(event_frags), dtype=bool)
+        event_matches = match_codes[event_frags]
+        group_starts[1:] = (event_matches[1:] != event_matches[:-1]) | (event_players[1:] != event_players[:-1])
+        return group_starts
+
+    def count_before_segment(is_counted, segment_starts):
+        # Number of counted events before each event, since the start of its segment
+        counted_before = numpy.cumsum(is_counted) - is_counted
+        segment_firsts = numpy.maximum.accumulate(numpy.where(segment_starts, numpy.arange(len(segment_starts)), 0))
+        return counted_before - counted_before[segment_firsts]
+
+    longest_series_by_match = {match_id: {} for match_id in frag_table.match_ids}
+    group_starts = find_group_starts(event_frags, event_players)
+    is_count = event_kinds == COUNT_EVENT
+    if losers:
+        # The kills and suicides of a player are ignored until his first death
+        kept = is_count | (count_before_segment(is_count, group_starts) > 0)
+        event_frags, event_players, event_kinds = event_frags[kept], event_players[kept], event_kinds[kept]
+        if not len(event_frags):
+            return longest_series_by_match
+        group_starts = find_group_starts(event_frags, event_players)
+        is_count = event_kinds == COUNT_EVENT
+        break_starts = group_starts | (event_kinds == BREAK_EVENT)
+        # A suicide starts a new series holding it, unless the current series is still empty
+        counted_suicides = (event_kinds == SUICIDE_EVENT) & (count_before_segment(is_count, break_starts) > 0)
+        series_starts = break_starts | counted_suicides
+        is_item = is_count | counted_suicides
+    else:
+        series_starts = group_starts | (event_kinds == BREAK_EVENT)
+        is_item = is_count
+
+    series_ids = numpy.cumsum(series_starts) - 1
+    group_ids = numpy.cumsum(group_starts) - 1
+    series_lengths = numpy.bincount(series_ids, weights=is_item).astype(numpy.int64)
+    series_groups = group_ids[series_starts]
+    # The first of the longest series of each group
+    ranked_series = numpy.lexsort((numpy.arange(len(series_lengths)), -series_lengths, series_groups))
+    ranked_groups = series_groups[ranked_series]
+    best_series = ranked_series[numpy.concatenate(([True], ranked_groups[1:] != ranked_groups[:-1]))]
+    best_series = best_series[series_lengths[best_series] > 0]
+    is_best_series = numpy.zeros(len(series_lengths), dtype=bool)
+    is_best_series[best_series] = True
+
+    item_mask = is_item & is_best_series[series_ids]
+    item_frags = event_frags[item_mask]
+    item_series = series_ids[item_mask]
+    if not len(item_frags):
+        return longest_series_by_match
+    series_firsts = numpy.flatnonzero(numpy.concatenate(([True], item_series[1:] != item_series[:-1])))
+    # The players of a match are in the order of their first count event, as in the dictionaries of the walk
+    count_positions = numpy.flatnonzero(is_count)
+    count_groups, first_count_positions = numpy.unique(group_ids[count_positions], return_index=True)
+    group_first_counts = numpy.zeros(group_ids[-1] + 1, dtype=numpy.int64)
+    group_first_counts[count_groups] = event_frags[count_positions[first_count_positions]]
+    first_items = numpy.flatnonzero(item_mask)[series_firsts]
+    chunk_groups = group_ids[first_items]
+    chunk_order = numpy.lexsort((group_first_counts[chunk_groups], match_codes[event_frags[first_items]]))
+
+    chunk_bounds = numpy.append(series_firsts, len(item_frags)).tolist()
+    item_frags = item_frags.tolist()
+    chunk_matches = match_codes[event_frags[first_items]].tolist()
+    chunk_players = event_players[first_items].tolist()
+    for chunk in chunk_order.tolist():
+        longest_series_by_match[frag_table.match_ids[chunk_matches[chunk]]][chunk_players[chunk]] = \
+            item_frags[chunk_bounds[chunk]:chunk_bounds[chunk + 1]]
+    return longest_series_by_match